@@ -0,0 +1,616 @@
+# pylint: disable=too-few-public-methods
+
+"""Storage backends for the savers in :mod:`PyExpLabSys.common.database_saver`
+
+A backend makes the database connections for the savers. The savers form their queries
+for MySQL, with ``%s`` placeholders, and the backends are responsible for executing them
+in their storage. There are three backends:
+
+ * :class:`MySQLBackend` saves to the MySQL server, which is the default. It requires
+   the ``MySQLdb`` or ``pymysql`` package.
+ * :class:`SQLiteBackend` saves to a local SQLite database file, e.g. to run without
+   the server or to test. The tables and columns are created when they are first
+   inserted into.
+ * :class:`ParquetBackend` saves to Parquet files in a local directory, one directory
+   per table and one file per table per commit. It requires the ``pyarrow`` package.
+
+The local backends use the same tables and columns as the MySQL server, e.g.
+``measurements``, ``xy_values`` and ``dateplots``, except that timestamps, which are
+inserted with ``FROM_UNIXTIME(%s)``, are saved as unix time. Since the
+``dateplots_descriptions`` table only exists on the server, the codenames of the
+continuous measurements must be registered in the local backends with
+``register_codenames`` before they are used with a
+:class:`~PyExpLabSys.common.database_saver.ContinuousDataSaver`::
+
+    backend = SQLiteBackend('/home/pi/data.sqlite')
+    backend.register_codenames(['setup_pressure', 'setup_temperature'])
+    saver = ContinuousDataSaver('dateplots_setup', None, None, backend=backend)
+"""
+
+from __future__ import unicode_literals, division, print_function
+import os
+import re
+import glob
+import time
+import socket
+import sqlite3
+import logging
+import threading
+
+try:
+    import MySQLdb
+except ImportError:
+    try:
+        import pymysql as MySQLdb
+        MySQLdb.install_as_MySQLdb()
+    except ImportError:
+        MySQLdb = None  # pylint: disable=invalid-name
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None  # pylint: disable=invalid-name
+
+# Mark this module as supporting Python 2 and 3
+from PyExpLabSys.common.supported_versions import python2_and_3
+python2_and_3(__file__)
+
+
+#: The estimated maximum size in bytes of a point in a batch insert query, used to
+#: calculate the batch size from the max_allowed_packet of the MySQL server
+BATCH_BYTES_PER_POINT = 80
+#: The smallest batch size that is calculated for the MySQL server
+MIN_BATCHSIZE = 1000
+#: The largest batch size that is calculated
+MAX_BATCHSIZE = 100000
+
+# Used to parse the table, columns and values of the INSERT queries of the savers
+INSERT_QUERY = re.compile(
+    r'^\s*INSERT\s+INTO\s+`?(\w+)`?\s*\(([^)]*)\)\s*VALUES\s*(.*?)\s*;?\s*$',
+    re.IGNORECASE | re.DOTALL,
+)
+# Used to find the value groups, e.g. '(%s, FROM_UNIXTIME(%s), %s)', of an INSERT query
+VALUE_GROUP = re.compile(r'\(((?:[^()]|\([^()]*\))*)\)')
+# Used to parse the SELECT queries of the savers for the Parquet backend
+SELECT_QUERY = re.compile(
+    r'^\s*SELECT\s+(DISTINCT\s+)?(?:UNIX_TIMESTAMP\((\w+)\)|(\w+))\s+FROM\s+(\w+)'
+    r'(?:\s+WHERE\s+(\w+)\s*=\s*\'([^\']*)\')?\s*;?\s*$',
+    re.IGNORECASE,
+)
+# Used to translate the MySQL placeholders to SQLite placeholders
+NAMED_PLACEHOLDER = re.compile(r'%\((\w+)\)s')
+# The codenames table of the continuous measurements
+DESCRIPTIONS_TABLE = 'dateplots_descriptions'
+
+
+def _column_names(columns):
+    """Return the list of column names from the column part of an INSERT query"""
+    return [column.strip().strip('`') for column in columns.split(',')]
+
+
+class DatabaseBackend(object):
+    """Base class for the storage backends
+
+    Attributes:
+        Error (Exception): The base class of the exceptions the connections raise
+        OperationalError (Exception): The exception raised when the connection fails,
+            e.g. if the database cannot be reached. The :class:`SqlSaver` reconnects and
+            retries on it.
+    """
+
+    Error = Exception
+    OperationalError = Exception
+
+    def connect(self):
+        """Return a new DB-API 2 like connection"""
+        raise NotImplementedError
+
+    def batchsize(self, cursor):  # pylint: disable=unused-argument
+        """Return the number of points per batch insert query
+
+        Args:
+            cursor: A cursor of a connection from this backend
+        """
+        return MIN_BATCHSIZE
+
+
+MYSQL_LOG = logging.getLogger(__name__ + '.MySQLBackend')
+MYSQL_LOG.addHandler(logging.NullHandler())
+
+class MySQLBackend(DatabaseBackend):
+    """The backend for the MySQL server"""
+
+    def __init__(self, username, password, hostname, database):
+        """Initialize the backend
+
+        Args:
+            username (str): The username for the MySQL database
+            password (str): The password for the MySQL database
+            hostname (str): The hostname of the MySQL server
+            database (str): The database name
+        """
+        MYSQL_LOG.debug('Init with username: %s, password: *****, hostname: %s and '
+                        'database: %s', username, hostname, database)
+        if MySQLdb is None:
+            raise ImportError('MySQLdb or pymysql is required for the MySQL backend')
+        self.username = username
+        self.password = password
+        self.hostname = hostname
+        self.database = database
+        self.Error = MySQLdb.Error  # pylint: disable=invalid-name
+        self.OperationalError = MySQLdb.OperationalError  # pylint: disable=invalid-name
+
+    def connect(self):
+        """Return a new MySQLdb connection"""
+        return MySQLdb.connect(
+            host=socket.gethostbyname(self.hostname),
+            user=self.username,
+            passwd=self.password,
+            db=self.database
+        )
+
+    def batchsize(self, cursor):
+        """Return the number of points per batch insert query calculated from the
+        max_allowed_packet of the server
+
+        The batch size is the number of points that fit in half a packet, with
+        :data:`BATCH_BYTES_PER_POINT` per point, limited to between
+        :data:`MIN_BATCHSIZE` and :data:`MAX_BATCHSIZE`. If the max_allowed_packet
+        cannot be read, the batch size is :data:`MIN_BATCHSIZE`.
+
+        Args:
+            cursor (MySQLdb cursor): A cursor
+        """
+        try:
+            cursor.execute('SHOW VARIABLES LIKE \'max_allowed_packet\'')
+            max_allowed_packet = int(cursor.fetchone()[1])
+        except (MySQLdb.Error, TypeError, ValueError):
+            MYSQL_LOG.warning('Unable to read max_allowed_packet from the server, use a '
+                              'batch size of %s', MIN_BATCHSIZE)
+            max_allowed_packet = 0
+        batchsize = max_allowed_packet // 2 // BATCH_BYTES_PER_POINT
+        MYSQL_LOG.debug('max_allowed_packet is %s', max_allowed_packet)
+        return min(max(batchsize, MIN_BATCHSIZE), MAX_BATCHSIZE)
+
+
+SQLITE_LOG = logging.getLogger(__name__ + '.SQLiteBackend')
+SQLITE_LOG.addHandler(logging.NullHandler())
+
+# The messages of the sqlite3.OperationalErrors that are raised when the database is
+# locked by another connection or the file cannot be opened, and that pass with time
+SQLITE_TRANSIENT_ERRORS = ('locked', 'busy', 'unable to open')
+
+
+class SQLiteUnavailableError(sqlite3.OperationalError):
+    """The exception raised when the SQLite database is locked, busy or cannot be opened
+
+    SQLite also raises :py:class:`sqlite3.OperationalError` for e.g. syntax errors and
+    missing tables, which would fail again on a retry, so only these errors are the
+    OperationalError of the :class:`SQLiteBackend`.
+    """
+
+
+def _sqlite_call(function, *args, **kwargs):
+    """Call function and raise its transient sqlite3.OperationalErrors as
+    :class:`SQLiteUnavailableError`
+    """
+    try:
+        return function(*args, **kwargs)
+    except SQLiteUnavailableError:
+        raise
+    except sqlite3.OperationalError as exception:
+        message = str(exception).lower()
+        if any(error in message for error in SQLITE_TRANSIENT_ERRORS):
+            raise SQLiteUnavailableError(*exception.args)
+        raise
+
+
+class SQLiteBackend(DatabaseBackend):
+    """The backend for a local SQLite database file
+
+    The tables are created, with an ``id INTEGER PRIMARY KEY AUTOINCREMENT`` column, and
+    the columns are added, when they are first inserted into. The MySQL functions
+    ``FROM_UNIXTIME`` and ``UNIX_TIMESTAMP``, which the savers use, are defined to leave
+    the unix time as is.
+    """
+
+    Error = sqlite3.Error
+    OperationalError = SQLiteUnavailableError
+
+    def __init__(self, path, timeout=30.0):
+        """Initialize the backend
+
+        Args:
+            path (str): The path of the SQLite database file
+            timeout (float): The time in seconds to wait for other connections to finish
+                writing
+        """
+        SQLITE_LOG.debug('Init with path: %s', path)
+        self.path = path
+        self.timeout = timeout
+
+    def connect(self):
+        """Return a new :class:`SQLiteConnection`"""
+        return _sqlite_call(SQLiteConnection, self.path, self.timeout)
+
+    def batchsize(self, cursor):
+        """Return the number of points per batch insert query, which is limited by the
+        maximum number of variables in a SQLite query, 999 before SQLite 3.32
+        """
+        if sqlite3.sqlite_version_info < (3, 32, 0):
+            return 999 // 2
+        return 32766 // 2
+
+    def register_codenames(self, codenames):
+        """Add the codenames of continuous measurements to the dateplots_descriptions
+        table, if they are not already there
+        """
+        connection = self.connect()
+        cursor = connection.cursor()
+        for codename in codenames:
+            cursor.execute('SELECT id FROM {} WHERE codename=%s'.format(DESCRIPTIONS_TABLE),
+                           (codename,))
+            if not cursor.fetchall():
+                cursor.execute('INSERT INTO {} (codename) VALUES (%s)'.format(
+                    DESCRIPTIONS_TABLE), (codename,))
+        connection.commit()
+        connection.close()
+
+
+class SQLiteConnection(object):
+    """A connection of the :class:`SQLiteBackend`
+
+    Wraps a :py:class:`sqlite3.Connection`, to take queries for MySQL and to create the
+    tables and columns on insert. The connection can be used from another thread than
+    the one it was created in, but only from one thread at a time.
+    """
+
+    def __init__(self, path, timeout):
+        """Open the connection
+
+        Args:
+            path (str): The path of the SQLite database file
+            timeout (float): The time in seconds to wait for other connections to finish
+                writing
+        """
+        self.connection = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.create_function('FROM_UNIXTIME', 1, lambda value: value)
+        self.connection.create_function('UNIX_TIMESTAMP', 1, lambda value: value)
+        # The codenames of the continuous measurements, see register_codenames
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS {} (id INTEGER PRIMARY KEY AUTOINCREMENT, codename)'
+            .format(DESCRIPTIONS_TABLE)
+        )
+        # The known columns of the tables
+        self.columns = {}
+
+    def cursor(self):
+        """Return a new :class:`SQLiteCursor`"""
+        return SQLiteCursor(self)
+
+    def ensure_columns(self, table, columns):
+        """Create the table or add the columns that do not already exist"""
+        known = self.columns.get(table)
+        if known is not None and known.issuperset(columns):
+            return
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS `{}` (id INTEGER PRIMARY KEY AUTOINCREMENT)'
+            .format(table)
+        )
+        known = set(row[1] for row in
+                    self.connection.execute('PRAGMA table_info(`{}`)'.format(table)))
+        for column in columns:
+            if column in known:
+                continue
+            SQLITE_LOG.info('Add column %s to table %s', column, table)
+            try:
+                self.connection.execute('ALTER TABLE `{}` ADD COLUMN `{}`'.format(table,
+                                                                                 column))
+            except sqlite3.OperationalError as exception:
+                # Another connection may just have added it
+                if 'duplicate column' not in str(exception):
+                    raise
+            known.add(column)
+        self.columns[table] = known
+
+    def commit(self):
+        """Commit the current transaction"""
+        _sqlite_call(self.connection.commit)
+
+    def rollback(self):
+        """Roll back the current transaction"""
+        self.connection.rollback()
+        # The columns added in the transaction are gone again
+        self.columns = {}
+
+    def close(self):
+        """Close the connection"""
+        self.connection.close()
+
+
+class SQLiteCursor(object):
+    """A cursor of a :class:`SQLiteConnection`"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.cursor = connection.connection.cursor()
+
+    @property
+    def rowcount(self):
+        """The number of rows the last query changed"""
+        return self.cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        """The id of the last inserted row"""
+        return self.cursor.lastrowid
+
+    def execute(self, query, args=None):
+        """Execute a query with ``%s`` or ``%(name)s`` placeholders
+
+        Raises:
+            SQLiteUnavailableError: If the database is locked, busy or cannot be opened
+            sqlite3.Error: On other errors, e.g. in the query
+        """
+        return _sqlite_call(self._execute, query, args)
+
+    def _execute(self, query, args):
+        """Create the columns of an INSERT query and execute the query"""
+        match = INSERT_QUERY.match(query)
+        if match is not None:
+            self.connection.ensure_columns(match.group(1), _column_names(match.group(2)))
+        if isinstance(args, dict):
+            query = NAMED_PLACEHOLDER.sub(r':\1', query)
+        else:
+            query = query.replace('%s', '?')
+        self.cursor.execute(query, () if args is None else args)
+        return self.cursor.rowcount
+
+    def fetchone(self):
+        """Return the next row of the result"""
+        return self.cursor.fetchone()
+
+    def fetchall(self):
+        """Return the remaining rows of the result"""
+        return self.cursor.fetchall()
+
+    def close(self):
+        """Close the cursor"""
+        self.cursor.close()
+
+
+class ParquetError(Exception):
+    """The exception raised for queries the :class:`ParquetBackend` does not support"""
+
+
+PARQUET_LOG = logging.getLogger(__name__ + '.ParquetBackend')
+PARQUET_LOG.addHandler(logging.NullHandler())
+
+class ParquetBackend(DatabaseBackend):
+    """The backend for Parquet files in a local directory
+
+    Each table is a directory of Parquet files, with one file for each commit that
+    inserted into the table. The rows are given an ``id`` column, numbered per table.
+    Only the queries that the savers make are supported, i.e. INSERT queries with
+    ``%s``, ``FROM_UNIXTIME(%s)`` and number values, and SELECT queries of a single
+    column with an optional ``WHERE column='value'`` condition. The ids are only unique
+    if a single backend instance writes to the directory at a time.
+    """
+
+    Error = ParquetError
+    # Errors writing the files
+    OperationalError = EnvironmentError
+
+    def __init__(self, directory):
+        """Initialize the backend
+
+        Args:
+            directory (str): The directory of the table directories. It is created if it
+                does not exist.
+        """
+        PARQUET_LOG.debug('Init with directory: %s', directory)
+        if pyarrow is None:
+            raise ImportError('pyarrow is required for the Parquet backend')
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._lock = threading.Lock()
+        # The next id for the tables
+        self._next_ids = {}
+        self._file_number = 0
+
+    def connect(self):
+        """Return a new :class:`ParquetConnection`"""
+        return ParquetConnection(self)
+
+    def batchsize(self, cursor):
+        """Return the number of points per batch insert query, :data:`MAX_BATCHSIZE`"""
+        return MAX_BATCHSIZE
+
+    def register_codenames(self, codenames):
+        """Add the codenames of continuous measurements to the dateplots_descriptions
+        table, if they are not already there
+        """
+        known = set(self.read_column(DESCRIPTIONS_TABLE, 'codename'))
+        connection = self.connect()
+        cursor = connection.cursor()
+        for codename in codenames:
+            if codename not in known:
+                cursor.execute('INSERT INTO {} (codename) VALUES (%s)'.format(
+                    DESCRIPTIONS_TABLE), (codename,))
+        connection.commit()
+
+    def files(self, table):
+        """Return the paths of the files of a table, oldest first"""
+        return sorted(glob.glob(os.path.join(self.directory, table, '*.parquet')))
+
+    def read_column(self, table, column):
+        """Return the values of a column of a table, in the order they were written
+
+        The values are None for the rows in files without the column.
+        """
+        values = []
+        for path in self.files(table):
+            parquet_file = pyarrow.parquet.read_table(path)
+            if column in parquet_file.column_names:
+                values.extend(parquet_file.column(column).to_pylist())
+            else:
+                values.extend([None] * parquet_file.num_rows)
+        return values
+
+    def reserve_ids(self, table, number):
+        """Return the first of number new consecutive ids for the rows of a table"""
+        with self._lock:
+            if table not in self._next_ids:
+                ids = [id_ for id_ in self.read_column(table, 'id') if id_ is not None]
+                self._next_ids[table] = max(ids or [0]) + 1
+            first = self._next_ids[table]
+            self._next_ids[table] += number
+            return first
+
+    def write(self, table, rows):
+        """Write the rows, dicts of column names to values, to a new file of a table"""
+        columns = []
+        for row in rows:
+            for column in row:
+                if column not in columns:
+                    columns.append(column)
+        data = {column: [row.get(column) for row in rows] for column in columns}
+        table_directory = os.path.join(self.directory, table)
+        with self._lock:
+            if not os.path.isdir(table_directory):
+                os.makedirs(table_directory)
+            self._file_number += 1
+            name = '{:017.6f}-{}-{}.parquet'.format(time.time(), os.getpid(),
+                                                   self._file_number)
+        path = os.path.join(table_directory, name)
+        # Write to a temporary name and rename, so that readers never see partial files
+        pyarrow.parquet.write_table(pyarrow.Table.from_pydict(data), path + '.tmp')
+        os.rename(path + '.tmp', path)
+
+
+class ParquetConnection(object):
+    """A connection of the :class:`ParquetBackend`
+
+    The inserted rows are kept in memory until they are written on :meth:`commit`.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        # The uncommitted rows of the tables
+        self.rows = {}
+
+    def cursor(self):
+        """Return a new :class:`ParquetCursor`"""
+        return ParquetCursor(self)
+
+    def commit(self):
+        """Write the inserted rows"""
+        for table, rows in list(self.rows.items()):
+            self.backend.write(table, rows)
+            del self.rows[table]
+
+    def rollback(self):
+        """Discard the inserted rows"""
+        self.rows.clear()
+
+    def close(self):
+        """Close the connection, the uncommitted rows are discarded"""
+        self.rows.clear()
+
+
+class ParquetCursor(object):
+    """A cursor of a :class:`ParquetConnection`"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.rowcount = -1
+        self.lastrowid = None
+        self._result = []
+
+    def execute(self, query, args=None):
+        """Execute one of the supported queries with ``%s`` placeholders
+
+        Raises:
+            ParquetError: If the query is not supported
+        """
+        match = INSERT_QUERY.match(query)
+        if match is not None:
+            self._insert(match.group(1), _column_names(match.group(2)), match.group(3),
+                         list(args or ()))
+            return self.rowcount
+        match = SELECT_QUERY.match(query)
+        if match is not None:
+            self._select(*match.groups())
+            return self.rowcount
+        raise ParquetError('Unsupported query: {:.100}'.format(query))
+
+    def _insert(self, table, columns, values, args):
+        """Parse the value groups of an INSERT query and add the rows"""
+        rows = []
+        for group in VALUE_GROUP.findall(values):
+            row = []
+            for expression in group.split(','):
+                expression = expression.strip()
+                if expression in ('%s', 'FROM_UNIXTIME(%s)'):
+                    if not args:
+                        raise ParquetError('Too few arguments for the values')
+                    row.append(args.pop(0))
+                else:
+                    try:
+                        row.append(int(expression))
+                    except ValueError:
+                        try:
+                            row.append(float(expression))
+                        except ValueError:
+                            raise ParquetError(
+                                'Unsupported value: {:.100}'.format(expression))
+            if len(row) != len(columns):
+                raise ParquetError('The number of values does not match the columns')
+            rows.append(dict(zip(columns, row)))
+        if not rows or args:
+            raise ParquetError('Too many arguments for the values')
+
+        first_id = self.connection.backend.reserve_ids(table, len(rows))
+        for offset, row in enumerate(rows):
+            row['id'] = first_id + offset
+        self.connection.rows.setdefault(table, []).extend(rows)
+        self.rowcount = len(rows)
+        self.lastrowid = first_id
+
+    def _select(self, distinct, unix_timestamp_column, column, table, where_column,
+                where_value):
+        """Select the values of a column, optionally with a condition"""
+        column = column or unix_timestamp_column
+        backend = self.connection.backend
+        values = backend.read_column(table, column)
+        if where_column is not None:
+            where_values = backend.read_column(table, where_column)
+            values = [value for value, where in zip(values, where_values)
+                      if _text(where) == where_value]
+        if distinct:
+            seen = set()
+            values = [value for value in values if not (value in seen or seen.add(value))]
+        self._result = [(value,) for value in values]
+        self.rowcount = len(self._result)
+
+    def fetchone(self):
+        """Return the next row of the result"""
+        return self._result.pop(0) if self._result else None
+
+    def fetchall(self):
+        """Return the remaining rows of the result"""
+        result, self._result = self._result, []
+        return result
+
+    def close(self):
+        """Close the cursor"""
+        self._result = []
+
+
+def _text(value):
+    """Return value as text, for comparison with the values in queries"""
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return '{}'.format(value)
@@ -6,24 +6,28 @@
 from __future__ import unicode_literals, division, print_function
 import re
 import time
+import pickle
+import sqlite3
 import logging
 import threading
-import socket
-from collections import namedtuple
+from collections import namedtuple, deque
 # Py2/3 import of Queue
 try:
-    from Queue import Queue
+    from Queue import Queue, Empty
 except ImportError:
-    from queue import Queue  # pylint: disable=import-error
+    from queue import Queue, Empty  # pylint: disable=import-error
 
 try:
-    import MySQLdb
+    import numpy
 except ImportError:
-    import pymysql as MySQLdb
-    MySQLdb.install_as_MySQLdb()
+    numpy = None  # pylint: disable=invalid-name
 
 # Mark this module as supporting Python 2 and 3
 from PyExpLabSys.common.supported_versions import python2_and_3
+# The batch size constants are imported for backwards compatibility
+from PyExpLabSys.common.database_backends import (  # pylint: disable=unused-import
+    MySQLBackend, BATCH_BYTES_PER_POINT, MIN_BATCHSIZE, MAX_BATCHSIZE,
+)
 python2_and_3(__file__)
 
 # Database constants
@@ -34,10 +38,41 @@ DATABASE = 'cinfdata'
 
 # Used for check of valid, un-escaped column names, to prevent injection
 COLUMN_NAME = re.compile(r'^[0-9a-zA-Z$_]*$')
+#: The number of spooled queries that are replayed per commit, see SqlSaver
+SPOOL_REPLAY_SIZE = 1000
+#: The SqlWriterPool lane for continuous data and single points, which goes first
+LANE_CONTINUOUS = 0
+#: The SqlWriterPool lane for bulk uploads
+LANE_BULK = 1
+
+# Used to split a single row INSERT query into the part before the values and the values
+# part, e.g. '(%s, FROM_UNIXTIME(%s), %s)', to form multi row inserts, see SqlSaver
+SINGLE_ROW_INSERT = re.compile(
+    r'^\s*(INSERT\s.+?\sVALUES\s*)(\((?:[^()]|\([^()]*\))*\))\s*;?\s*$',
+    re.IGNORECASE | re.DOTALL,
+)
 # namedtuple used for custom column formatting, see MeasurementSaver.__init__
 CustomColumn = namedtuple('CustomColumn', ['value', 'format_string'])
 
 
+def _get_backend(backend, username, password, writer_pool=None):
+    """Return backend, or if it is None, the backend of writer_pool or a MySQLBackend
+    for the server in :data:`HOSTNAME` and :data:`DATABASE`
+
+    Raises:
+        ValueError: If both backend and writer_pool are given, and writer_pool uses
+            another backend
+    """
+    if writer_pool is not None:
+        if backend is None:
+            return writer_pool.backend
+        if backend is not writer_pool.backend:
+            raise ValueError('The backend must be the backend of the writer_pool')
+    if backend is None:
+        return MySQLBackend(username, password, HOSTNAME, DATABASE)
+    return backend
+
+
 # Loging object for the DataSetSaver (DSS) shortened, because it will be written a lot
 DSS_LOG = logging.getLogger(__name__ + '.MeasurementSaver')
 DSS_LOG.addHandler(logging.NullHandler())
@@ -49,18 +84,23 @@ class DataSetSaver(object):
         measurement_ids (dict): Mapping of codenames to measurements ids
         measurements_table (str): The measurements tables
         xy_values_table (str): The x, y values tables
-        sql_saver (:class:`SqlSaver`): The SqlSaver used to save points
+        sql_saver (:class:`SqlSaver`): The SqlSaver used to save points, or a
+            :class:`SqlWriterPoolHandle` if a ``writer_pool`` is used
+        writer_pool (:class:`SqlWriterPool`): The writer pool or None
+        backend (:class:`~PyExpLabSys.common.database_backends.DatabaseBackend`): The
+            storage backend
         insert_measurement_query (str): The query used to insert a measurement
         insert_point_query (str): The query used to insert a point
         insert_batch_query (str): The query used to insert a batch of points
-        connection (MySQLdb connection): The database connection used to register new
+        connection: The database connection, from the backend, used to register new
             measurements
-        cursor (MySQLdb cursor): The database cursor used to register new measurements
+        cursor: The database cursor used to register new measurements
 
     """
 
     def __init__(self, measurements_table, xy_values_table, username, password,
-                 measurement_specs=None):
+                 measurement_specs=None, batch_size=1, batch_wait=0.0, spool_path=None,
+                 writer_pool=None, backend=None):
         """Initialize local parameters
 
         Args:
@@ -70,6 +110,22 @@ class DataSetSaver(object):
             passwork (str): The database password
             measurement_specs (sequence): A sequence of ``measurement_codename,
                 metadata`` pairs, see below
+            batch_size (int): The maximum number of queries the :class:`SqlSaver` commits
+                together
+            batch_wait (float): The maximum time in seconds the :class:`SqlSaver` waits
+                for queries for a batch
+            spool_path (str): The path of the file the :class:`SqlSaver` spools queries
+                to during database outages
+            writer_pool (SqlWriterPool): If given, the points are saved by this pool,
+                shared with other savers, instead of by a :class:`SqlSaver` of this
+                saver, and ``batch_size``, ``batch_wait`` and ``spool_path`` are not used.
+                The batches from :meth:`save_points_batch` are saved in the
+                :data:`LANE_BULK` lane.
+            backend (DatabaseBackend): The storage backend, see
+                :mod:`PyExpLabSys.common.database_backends`. Defaults to the backend
+                of the ``writer_pool``, if one is given, and otherwise to the MySQL
+                server in :data:`HOSTNAME` and :data:`DATABASE`. With a
+                ``writer_pool``, it must be the backend of the pool.
 
         ``measurement_specs`` is used if you want to initialize all the measurements at
         ``__init__`` time. You can also do it later with :meth:`add_measurement`. The
@@ -114,7 +170,14 @@ class DataSetSaver(object):
         # Initialize instance variables
         self.measurements_table = measurements_table
         self.xy_values_table = xy_values_table
-        self.sql_saver = SqlSaver(username, password)
+        self.writer_pool = writer_pool
+        self.backend = _get_backend(backend, username, password, writer_pool)
+        if writer_pool is None:
+            self.sql_saver = SqlSaver(username, password, batch_size=batch_size,
+                                      batch_wait=batch_wait, spool_path=spool_path,
+                                      backend=self.backend)
+        else:
+            self.sql_saver = writer_pool.handle()
 
         # Initialize queries
         self.insert_measurement_query = 'INSERT INTO {} ({{}}) values ({{}})'\
@@ -126,14 +189,12 @@ class DataSetSaver(object):
         self.select_distict_query = 'SELECT DISTINCT {{}} from {}'.format(measurements_table)
 
         # Init local database connection
-        self.connection = MySQLdb.connect(
-            host=socket.gethostbyname(HOSTNAME),
-            user=username,
-            passwd=password,
-            db=DATABASE
-        )
+        self.connection = self.backend.connect()
         self.cursor = self.connection.cursor()
 
+        # The batch size for save_points_batch, see get_batchsize
+        self._batchsize = None
+
         # Initialize measurement ids
         self.measurement_ids = {}
         if measurement_specs:
@@ -182,6 +243,7 @@ class DataSetSaver(object):
 
         # Make the insert and save the measurement_table id for use in saving the data
         self.cursor.execute(query, values)
+        self.connection.commit()
         self.measurement_ids[codename] = self.cursor.lastrowid
         DSS_LOG.debug('Measurement codenamed: \'%s\' added', codename)
 
@@ -203,23 +265,38 @@ class DataSetSaver(object):
         query_args.extend(point)
         self.sql_saver.enqueue_query(self.insert_point_query, query_args)
 
-    def save_points_batch(self, codename, x_values, y_values, batchsize=1000):
+    def save_points_batch(self, codename, x_values, y_values, batchsize=None):
         """Save a number points for the same codename in batches
 
+        If numpy is available and the values are finite numbers, the values are
+        converted in bulk with numpy, which is much faster for large data sets,
+        otherwise point by point, so that e.g. None is saved as NULL.
+
         Args:
             codename (str): The codename for the measurement to save the points for
-            x_values (sequence): A sequence of x values
-            y_values (sequence): A sequence of y values
+            x_values (sequence): A sequence of x values, e.g. a numpy array
+            y_values (sequence): A sequence of y values, e.g. a numpy array
             batchsize (int): The number of points to send in the same batch. Defaults to
-                1000, see the warning below before changing it
+                None, which means that it is given by the backend, see
+                :meth:`get_batchsize`. See the warning below before setting
+                it.
+
+        Returns:
+            dict: Statistics for the call with the keys: points, batches, batchsize,
+                enqueue_duration (the time it took to prepare and enqueue the batches in
+                seconds) and enqueued_points_per_second. The points are not necessarily
+                written to the database yet, see :meth:`wait_for_queue_to_empty`.
 
         .. warning:: The batchsize is ultimately limited by the max package size that the
            MySQL server will receive. The default is 1MB. Each point amounts to around 60
            bytes in the final query. Rounding this up to 100, means that the limit is
-           ~10000 points. This means that the default of 1000 should be safe and that if
-           it is changed by the user, expect problems if exceeding the lower 10000ths.
+           ~10000 points. This means that if it is set by the user, expect problems if
+           exceeding the lower 10000ths.
 
         """
+        start = time.time()
+        if batchsize is None:
+            batchsize = self.get_batchsize()
         DSS_LOG.debug('For codename \'%s\' save %s points in batches of %s',
                       codename, len(x_values), batchsize)
 
@@ -233,27 +310,66 @@ class DataSetSaver(object):
             message = 'No entry in measurements_ids for codename: \'{}\''.format(codename)
             raise ValueError(message)
 
-        # Gather values in batches of batsize, start enumerate from 1, to make the criteria
-        values = []
-        number_of_values = 0
-        for x_value, y_value in zip(x_values, y_values):
-            # Add this point
-            values.extend([measurement_id, x_value, y_value])
-            number_of_values += 1
-
-            # Save a batch (> should not be necessary)
-            if number_of_values >= batchsize:
-                value_marker_string = ', '.join(['(%s, %s, %s)'] * number_of_values)
-                query = self.insert_batch_query.format(value_marker_string)
-                self.sql_saver.enqueue_query(query, values)
-                values = []
-                number_of_values = 0
-
-        # Save the remaining number of points (smaller than the batchsize)
-        if number_of_values > 0:
-            value_marker_string = ', '.join(['(%s, %s, %s)'] * number_of_values)
-            query = self.insert_batch_query.format(value_marker_string)
-            self.sql_saver.enqueue_query(query, values)
+        # Form the flat list of x and y values; x1, y1, x2, y2, ...
+        values = None
+        if numpy is not None:
+            try:
+                points = numpy.column_stack((numpy.asarray(x_values, dtype=float),
+                                             numpy.asarray(y_values, dtype=float)))
+            except (TypeError, ValueError):
+                DSS_LOG.debug('Values are not numeric, convert them point by point')
+            else:
+                # None is converted to NaN, which must not be saved in place of NULL
+                if numpy.isfinite(points).all():
+                    values = points.ravel().tolist()
+                else:
+                    DSS_LOG.debug('Values are not finite, convert them point by point')
+        if values is None:
+            values = [value for point in zip(x_values, y_values) for value in point]
+
+        # The measurement id is an int from the database, so it can safely be formatted
+        # directly into the query, which saves a third of the query arguments
+        value_marker = '({}, %s, %s)'.format(int(measurement_id))
+        number_of_points = len(values) // 2
+        query = None
+        batches = 0
+        for first in range(0, number_of_points, batchsize):
+            batch_values = values[2 * first: 2 * (first + batchsize)]
+            size = len(batch_values) // 2
+            # All batches except the last one have the same size and query
+            if query is None or size != batchsize:
+                query = self.insert_batch_query.format(', '.join([value_marker] * size))
+            self._enqueue_bulk(query, batch_values)
+            batches += 1
+
+        duration = time.time() - start
+        stats = {
+            'points': number_of_points, 'batches': batches, 'batchsize': batchsize,
+            'enqueue_duration': duration,
+            'enqueued_points_per_second':
+                number_of_points / duration if duration > 0 else None,
+        }
+        DSS_LOG.info('For codename \'%s\' enqueued %s points in %s batches in %.3f s',
+                     codename, number_of_points, batches, duration)
+        return stats
+
+    def get_batchsize(self):
+        """Return the batch size for :meth:`save_points_batch` given by the backend
+
+        For the MySQL server it is calculated from the max_allowed_packet of the server,
+        see :meth:`.MySQLBackend.batchsize`. It is only asked for once.
+        """
+        if self._batchsize is None:
+            self._batchsize = self.backend.batchsize(self.cursor)
+            DSS_LOG.debug('Use a batch size of %s', self._batchsize)
+        return self._batchsize
+
+    def _enqueue_bulk(self, query, query_args):
+        """Enqueue a bulk upload query, in the bulk lane if a writer pool is used"""
+        if self.writer_pool is None:
+            self.sql_saver.enqueue_query(query, query_args)
+        else:
+            self.sql_saver.enqueue_query(query, query_args, lane=LANE_BULK)
 
     def get_unique_values_from_measurements(self, column):  # pylint: disable=invalid-name
         """Return a set of unique column values from the measurements database
@@ -307,11 +423,14 @@ class ContinuousDataSaver(object):
     Continuous measurements are measurements of a single parameters as a function of
     datetime. The class can ONLY be used with the new layout of tables for continous data,
     where there is only one table per setup, as apposed to the old layout where there was
-    one table per measurement type per setup. The class sends data to the hostname and
-    database named in :data:`.HOSTNAME` and :data:`.DATABASE` respectively.
+    one table per measurement type per setup. Per default, the class sends data to the
+    hostname and database named in :data:`.HOSTNAME` and :data:`.DATABASE`
+    respectively.
     """
 
-    def __init__(self, continuous_data_table, username, password, measurement_codenames=None):
+    def __init__(self, continuous_data_table, username, password, measurement_codenames=None,
+                 batch_size=1, batch_wait=0.0, spool_path=None, writer_pool=None,
+                 backend=None):
         """Initialize the continous logger
 
         Args:
@@ -322,6 +441,21 @@ class ContinuousDataSaver(object):
                 logger will send data to. These codenames can be given here, to initialize
                 them at the time of initialization or later by the use of the
                 :meth:`add_continuous_measurement` method.
+            batch_size (int): The maximum number of points the :class:`SqlSaver` commits
+                together
+            batch_wait (float): The maximum time in seconds the :class:`SqlSaver` waits
+                for points for a batch
+            spool_path (str): The path of the file the :class:`SqlSaver` spools points
+                to during database outages
+            writer_pool (SqlWriterPool): If given, the points are saved by this pool,
+                shared with other savers, in the :data:`LANE_CONTINUOUS` lane, instead
+                of by a :class:`SqlSaver` of this saver, and ``batch_size``,
+                ``batch_wait`` and ``spool_path`` are not used.
+            backend (DatabaseBackend): The storage backend, see
+                :mod:`PyExpLabSys.common.database_backends`. Defaults to the backend
+                of the ``writer_pool``, if one is given, and otherwise to the MySQL
+                server in :data:`HOSTNAME` and :data:`DATABASE`. With a
+                ``writer_pool``, it must be the backend of the pool.
 
         .. note:: The codenames are the 'official' codenames defined in the database for
             contionuous measurements NOT codenames that can be userdefined
@@ -334,17 +468,18 @@ class ContinuousDataSaver(object):
 
         # Initialize instance variables
         self.continuous_data_table = continuous_data_table
-        self.sql_saver = SqlSaver(username, password)
+        self.backend = _get_backend(backend, username, password, writer_pool)
+        if writer_pool is None:
+            self.sql_saver = SqlSaver(username, password, batch_size=batch_size,
+                                      batch_wait=batch_wait, spool_path=spool_path,
+                                      backend=self.backend)
+        else:
+            self.sql_saver = writer_pool.handle()
         self.username = username
         self.password = password
 
         # Init local database connection
-        self.connection = MySQLdb.connect(
-            host=socket.gethostbyname(HOSTNAME),
-            user=username,
-            passwd=password,
-            db=DATABASE
-        )
+        self.connection = self.backend.connect()
         self.cursor = self.connection.cursor()
 
         # Dict used to translate code_names to measurement numbers
@@ -426,6 +561,90 @@ class ContinuousDataSaver(object):
         CDS_LOG.debug('stop finished')
 
 
+SQL_SPOOL_LOG = logging.getLogger(__name__ + '.SqlSpool')
+SQL_SPOOL_LOG.addHandler(logging.NullHandler())
+
+class SqlSpool(object):
+    """An append-only on-disk spool of ``(query, query_args)`` elements
+
+    The elements are kept in order in a SQLite database file, with the arguments
+    pickled, so they survive a restart of the process. The spool is safe to use from
+    several threads.
+    """
+
+    def __init__(self, path):
+        """Open or create the spool
+
+        Args:
+            path (str): The path of the SQLite database file
+        """
+        SQL_SPOOL_LOG.info('Open spool at: %s', path)
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            # With the write-ahead log, a commit survives a crash of the process without
+            # a disk sync for every commit
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS spool '
+                '(id INTEGER PRIMARY KEY, query TEXT NOT NULL, args BLOB NOT NULL)'
+            )
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM spool').fetchone()[0]
+
+    @staticmethod
+    def _rows(elements, ids=None):
+        """Return the rows to insert for (query, query_args) elements"""
+        rows = [(query, sqlite3.Binary(pickle.dumps(args, 2))) for query, args in elements]
+        if ids is None:
+            return rows
+        return [(id_,) + row for id_, row in zip(ids, rows)]
+
+    def append(self, elements):
+        """Append (query, query_args) elements to the end of the spool"""
+        with self._lock, self._connection:
+            self._connection.executemany('INSERT INTO spool (query, args) VALUES (?, ?)',
+                                         self._rows(elements))
+
+    def prepend(self, elements):
+        """Insert (query, query_args) elements, in order, in front of the spool"""
+        with self._lock, self._connection:
+            first = self._connection.execute('SELECT MIN(id) FROM spool').fetchone()[0]
+            if first is None:
+                first = 1
+            ids = range(first - len(elements), first)
+            self._connection.executemany(
+                'INSERT INTO spool (id, query, args) VALUES (?, ?, ?)',
+                self._rows(elements, ids),
+            )
+
+    def read(self, limit):
+        """Return up to limit of the oldest elements
+
+        Returns:
+            list: (id, query, query_args) elements, oldest first
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT id, query, args FROM spool ORDER BY id LIMIT ?', (limit,)
+            ).fetchall()
+        return [(id_, query, pickle.loads(bytes(args))) for id_, query, args in rows]
+
+    def remove(self, last_id):
+        """Remove the elements up to and including the one with last_id"""
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM spool WHERE id <= ?', (last_id,))
+
+    def close(self):
+        """Close the spool"""
+        with self._lock:
+            self._connection.close()
+
+
 SQL_SAVER_LOG = logging.getLogger(__name__ + '.SqlSaver')
 SQL_SAVER_LOG.addHandler(logging.NullHandler())
 
@@ -437,17 +656,46 @@ class SqlSaver(threading.Thread):
         that they must be on the form of a ``(query, query_args)`` tuple. (These are the
         arguments to the execute method on the cursor object)
 
+    Per default, every query is committed on its own. With a ``batch_size`` larger than
+    1, the saver instead takes up to ``batch_size`` queries from the queue at a time,
+    waiting up to ``batch_wait`` seconds for more to arrive, and commits them together.
+    Consecutive queries in a batch with the same single row ``INSERT ... VALUES (...)``
+    query (like the ones made by :meth:`.ContinuousDataSaver.save_point` and
+    :meth:`.DataSetSaver.save_point`) are sent as one multi row insert.
+
+    With a ``spool_path``, the saver keeps the queries in a :class:`SqlSpool` on disk,
+    instead of in memory, when the queue grows beyond ``spool_threshold`` queries or
+    the database cannot be reached. Queries that fail are moved to the spool together
+    with the rest of the queue and the saver keeps spooling, until it has replayed the
+    whole spool to the database in batches of :data:`SPOOL_REPLAY_SIZE`. This bounds
+    the memory use during database outages and, since the spool is replayed when the
+    saver is started again, no data is lost if the process is restarted during an
+    outage. The queries are saved in the order they were enqueued. A batch that was
+    committed just before the process died, but not yet removed from the spool, is
+    saved again on the replay.
+
     Attributes:
         queue (Queue.Queue): The queue the queries and qeury arguments are stored in. See
             note below.
+        batch_size (int): The maximum number of queries to commit together
+        batch_wait (float): The maximum time in seconds to wait for more queries for a
+            batch
         commits (int): The number of commits the saver has performed
-        commit_time (float): The timespan the last commit took
-        connection (MySQLdb connection): The MySQLdb database connection
-        cursor (MySQLdb cursor): The MySQLdb database cursor
+        commit_time (float): The timespan the last commit took, including the execution
+            of the queries in it
+        rows (int): The number of rows the saver has written
+        rows_per_commit (int): The number of rows written in the last commit
+        spool (SqlSpool): The spool, or None if no ``spool_path`` was given
+        spool_threshold (int): The queue size beyond which queries are spooled
+        backend (:class:`~PyExpLabSys.common.database_backends.DatabaseBackend`): The
+            storage backend
+        connection: The database connection, from the backend
+        cursor: The database cursor
 
     """
 
-    def __init__(self, username, password, queue=None):
+    def __init__(self, username, password, queue=None, batch_size=1, batch_wait=0.0,
+                 spool_path=None, spool_threshold=10000, backend=None):
         """Initialize local variables
 
         Args:
@@ -455,19 +703,43 @@ class SqlSaver(threading.Thread):
             password (str): The password for the MySQL database
             queue (Queue.Queue): A custom queue to use. If it is left out, a new
                 :py:class:`Queue.Queue` object will be used.
+            batch_size (int): The maximum number of queries to commit together. The
+                default of 1 commits every query on its own.
+            batch_wait (float): The maximum time in seconds, from the first query of a
+                batch is taken from the queue, to wait for the rest of the batch. The
+                default of 0 only batches the queries that are already in the queue.
+            spool_path (str): The path of the :class:`SqlSpool` file. If it is left out,
+                queries are only kept in memory.
+            spool_threshold (int): The number of queries in the queue, beyond which new
+                queries are spooled
+            backend (DatabaseBackend): The storage backend, see
+                :mod:`PyExpLabSys.common.database_backends`. Defaults to the MySQL
+                server in :data:`HOSTNAME` and :data:`DATABASE`.
         """
 
-        SQL_SAVER_LOG.info('Init with username: %s, password: ***** and queue: %s',
-                           username, queue)
+        SQL_SAVER_LOG.info('Init with username: %s, password: *****, queue: %s, '
+                           'batch_size: %s, batch_wait: %s, spool_path: %s and '
+                           'spool_threshold: %s', username, queue, batch_size, batch_wait,
+                           spool_path, spool_threshold)
         super(SqlSaver, self).__init__()
         #threading.Thread.__init__(self)
         self.daemon = True
 
+        if batch_size < 1:
+            raise ValueError('batch_size must be at least 1')
+        if batch_wait < 0:
+            raise ValueError('batch_wait cannot be negative')
+
         # Initialize internal variables
         self.username = username
         self.password = password
+        self.backend = _get_backend(backend, username, password)
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
         self.commits = 0
         self.commit_time = 0
+        self.rows = 0
+        self.rows_per_commit = 0
         self._stop_called = False  # Only used to modify logging output
 
         # Set queue or initialize a new one
@@ -476,17 +748,30 @@ class SqlSaver(threading.Thread):
         else:
             self.queue = queue
 
+        # Open the spool and replay what is left in it from earlier
+        self.spool = None if spool_path is None else SqlSpool(spool_path)
+        self.spool_threshold = spool_threshold
+        self._spool_lock = threading.Lock()
+        self._spooling = self.spool is not None and len(self.spool) > 0
+
         # Initialize database connection
-        SQL_SAVER_LOG.debug('Open connection to MySQL database')
-        self.connection = MySQLdb.connect(
-            host=socket.gethostbyname(HOSTNAME),
-            user=username,
-            passwd=password,
-            db=DATABASE
-        )
-        self.cursor = self.connection.cursor()
+        SQL_SAVER_LOG.debug('Open connection to the database')
+        try:
+            self._connect()
+        except self.backend.OperationalError:
+            if self.spool is None:
+                raise
+            # Spool until the database can be reached
+            SQL_SAVER_LOG.warning('Unable to connect to the database, will spool to %s',
+                                  spool_path)
+            self.connection = self.cursor = None
         SQL_SAVER_LOG.debug('Connection opened, init done')
 
+    def _connect(self):
+        """Open the database connection and cursor"""
+        self.connection = self.backend.connect()
+        self.cursor = self.connection.cursor()
+
     def stop(self):
         """Add stop word to queue to exit the loop when the queue is empty"""
         SQL_SAVER_LOG.info('stop called. Wait for %s elements remaining in the queue to '
@@ -495,7 +780,7 @@ class SqlSaver(threading.Thread):
         self._stop_called = True
         # Make sure to wait untill it is closed down to return, otherwise we are going to
         # tear down the environment around it
-        while self.isAlive():
+        while self.is_alive():
             time.sleep(10**-5)
         SQL_SAVER_LOG.debug('stopped')
 
@@ -510,56 +795,271 @@ class SqlSaver(threading.Thread):
         """
         SQL_SAVER_LOG.debug('Enqueue query\n\'%.70s...\'\nwith args: %.60s...', query,
                             query_args)
-        self.queue.put((query, query_args))
+        if self.spool is None:
+            self.queue.put((query, query_args))
+            return
+
+        with self._spool_lock:
+            if not self._spooling and self.queue.qsize() >= self.spool_threshold:
+                SQL_SAVER_LOG.warning('The queue exceeded %s queries, spool to %s',
+                                      self.spool_threshold, self.spool.path)
+                self._spooling = True
+            # Once spooling, everything goes to the spool, to keep the order
+            if self._spooling:
+                self.spool.append([(query, query_args)])
+            else:
+                self.queue.put((query, query_args))
 
     def run(self):
         """Execute SQL inserts from the queue until stopped"""
         SQL_SAVER_LOG.info('run started')
         while True:
-            start = time.time()
-            query, args = self.queue.get()
+            # The spool only contains queries that are newer than those in the queue
+            if self._spooling and self.queue.empty():
+                self._replay_spool()
+                continue
+            batch = self._get_batch()
 
             # If stop has been called this log output is elavated to info level, because
             # if not the user os waiting without information and may think that the
             # process hangs
             if self._stop_called:
-                SQL_SAVER_LOG.info('Dequeued element, %s remaining', self.queue.qsize())
+                SQL_SAVER_LOG.info('Dequeued %s elements, %s remaining', len(batch),
+                                   self.queue.qsize())
             else:
-                SQL_SAVER_LOG.debug('Dequeued element, %s remaining', self.queue.qsize())
+                SQL_SAVER_LOG.debug('Dequeued %s elements, %s remaining', len(batch),
+                                    self.queue.qsize())
+
+            # Magic key-word to stop Sql Saver, which is always last in a batch
+            stop = batch[-1][0] == 'STOP'
+            if stop:
+                batch.pop()
+            if batch:
+                self._commit_batch(batch)
+            if stop:
+                # Try to empty the spool, what is left is replayed on the next start
+                while self._spooling and self._replay_spool():
+                    pass
+                break
+
+        if self.connection is not None:
+            self.connection.close()
+        if self.spool is not None:
+            SQL_SAVER_LOG.info('%s queries left in the spool', len(self.spool))
+            self.spool.close()
+        SQL_SAVER_LOG.debug('run stopped')
 
-            if query == 'STOP': # Magic key-word to stop Sql Saver
+    def _get_batch(self):
+        """Return the next batch of up to batch_size (query, args) elements
+
+        Blocks until the first element is available and then waits up to batch_wait for
+        the rest. The batch is ended early by the STOP element.
+        """
+        batch = [self.queue.get()]
+        deadline = time.time() + self.batch_wait
+        while len(batch) < self.batch_size and batch[-1][0] != 'STOP':
+            remaining = deadline - time.time()
+            try:
+                if remaining > 0:
+                    batch.append(self.queue.get(timeout=remaining))
+                else:
+                    batch.append(self.queue.get_nowait())
+            except Empty:
                 break
+        return batch
 
-            success = False
-            while not success:
-                try:
-                    self.cursor.execute(query, args=args)
-                    success = True
-                    SQL_SAVER_LOG.debug('Executed query\n\'%.70s\'\nwith args: %.60s', query,
-                                        args)
-                except MySQLdb.OperationalError: # Failed to perfom commit
+    @staticmethod
+    def _group(batch):
+        """Group consecutive single row inserts with the same query into multi row inserts
+
+        Args:
+            batch (list): The (query, args) elements
+
+        Returns:
+            list: (query, args) elements to execute in order
+        """
+        # Runs of consecutive elements as [query, match, list of args], where match is
+        # the SINGLE_ROW_INSERT match for queries that can be merged, otherwise None
+        runs = []
+        for query, args in batch:
+            if runs and runs[-1][1] is not None and runs[-1][0] == query:
+                runs[-1][2].append(args)
+                continue
+            match = SINGLE_ROW_INSERT.match(query)
+            # Only positional args with one placeholder per arg can be merged
+            if match is not None and ('ON DUPLICATE' in query.upper() or
+                                      not isinstance(args, (list, tuple)) or
+                                      match.group(2).count('%s') != len(args)):
+                match = None
+            runs.append([query, match, [args]])
+
+        out = []
+        for query, match, args_list in runs:
+            if len(args_list) == 1:
+                out.append((query, args_list[0]))
+            else:
+                values = ', '.join([match.group(2)] * len(args_list))
+                out.append((match.group(1) + values,
+                            [arg for args in args_list for arg in args]))
+        return out
+
+    def _execute_and_commit(self, batch):
+        """Execute the queries in batch and commit them
+
+        Raises:
+            OperationalError: The OperationalError of the backend, if the database
+                connection fails
+        """
+        start = time.time()
+        if self.connection is None:
+            self._connect()
+        rows = 0
+        for query, args in self._group(batch):
+            self.cursor.execute(query, args=args)
+            rows += max(self.cursor.rowcount, 0)
+            SQL_SAVER_LOG.debug('Executed query\n\'%.70s\'\nwith args: %.60s',
+                                query, args)
+        self.connection.commit()
+
+        self.commits += 1
+        self.commit_time = time.time() - start
+        self.rows += rows
+        self.rows_per_commit = rows
+
+    def _reconnect(self):
+        """Wait 5 seconds and make a new database connection"""
+        time.sleep(5)
+        try:
+            self._connect()
+        except self.backend.OperationalError: # Failed to re-connect
+            pass
+
+    def _rollback(self):
+        """Roll back the queries of a failed batch, that were executed but not committed
+
+        Otherwise, if the connection is still alive, they would be committed again
+        along with the retry of the whole batch.
+        """
+        if self.connection is None:
+            return
+        try:
+            self.connection.rollback()
+        # E.g. the connection is gone, and the queries with it
+        except (self.backend.OperationalError, self.backend.Error):
+            pass
+
+    def _commit_batch(self, batch):
+        """Execute the queries in batch and commit them, reconnecting and retrying every
+        5 seconds on errors, or moving them to the spool if there is one
+
+        Other errors than the OperationalError of the backend, e.g. in a query, would
+        fail again on a retry, so then the queries are executed one at a time and the
+        ones that fail are logged and dropped.
+        """
+        one_by_one = False
+        while batch:
+            part = batch[:1] if one_by_one else batch
+            try:
+                self._execute_and_commit(part)
+            except self.backend.OperationalError: # Failed to perfom execute or commit
+                # The whole batch is retried, so roll back the part that was executed
+                self._rollback()
+                if self.spool is not None:
+                    SQL_SAVER_LOG.error(
+                        'Executing a query raised an OperationalError. Move the '
+                        'queries to the spool and retry from there.'
+                    )
+                    self._spool_batch(batch)
+                    return
+                SQL_SAVER_LOG.error(
+                    'Executing a query raised an OperationalError. Make new '
+                    'database connection and retry in 5 seconds.'
+                )
+                self._reconnect()
+                continue
+            except self.backend.Error:
+                self._rollback()
+                if not one_by_one and len(batch) > 1:
                     SQL_SAVER_LOG.error(
-                        'Executing a query raised an MySQLdb.OperationalError. Make new '
-                        'database connection and retry in 5 seconds.'
+                        'Executing a query raised an error. Execute the queries one at '
+                        'a time and drop the ones that fail.'
                     )
-                    time.sleep(5)
-                    try:
-                        self.connection = MySQLdb.connect(
-                            host=socket.gethostbyname(HOSTNAME),
-                            user=self.username,
-                            passwd=self.password,
-                            db=DATABASE
-                        )
-                        self.cursor = self.connection.cursor()
-                    except MySQLdb.OperationalError: # Failed to re-connect
-                        pass
-
-            self.connection.commit()
-            self.commits += 1
-            self.commit_time = time.time() - start
+                    one_by_one = True
+                    continue
+                SQL_SAVER_LOG.exception('Drop the query\n\'%.70s\'\nwith args: %.60s',
+                                        *part[0])
+            batch = batch[len(part):]
+
+    def _spool_batch(self, batch):
+        """Move the batch and the rest of the queue, in front of the spool"""
+        stop = False
+        with self._spool_lock:
+            elements = list(batch)
+            while True:
+                try:
+                    element = self.queue.get_nowait()
+                except Empty:
+                    break
+                if element[0] == 'STOP':
+                    stop = True
+                else:
+                    elements.append(element)
+            self.spool.prepend(elements)
+            self._spooling = True
+        SQL_SAVER_LOG.warning('Spooled %s queries to %s', len(elements), self.spool.path)
+        if stop:
+            self.queue.put(('STOP', None))
+
+    def _replay_spool(self):
+        """Replay the oldest queries in the spool to the database
 
-        self.connection.close()
-        SQL_SAVER_LOG.debug('run stopped')
+        Returns:
+            bool: False if the database connection failed, otherwise True
+        """
+        elements = self.spool.read(SPOOL_REPLAY_SIZE)
+        if not elements:
+            with self._spool_lock:
+                if len(self.spool) == 0:
+                    SQL_SAVER_LOG.info('The spool is replayed, stop spooling')
+                    self._spooling = False
+            return True
+
+        try:
+            self._execute_and_commit([(query, args) for _, query, args in elements])
+        except self.backend.OperationalError:
+            self._replay_failed()
+            return False
+        except self.backend.Error:
+            self._rollback()
+            SQL_SAVER_LOG.error(
+                'Replaying the spool raised an error. Replay the queries one at a time '
+                'and drop the ones that fail.'
+            )
+            for id_, query, args in elements:
+                try:
+                    self._execute_and_commit([(query, args)])
+                except self.backend.OperationalError:
+                    self._replay_failed()
+                    return False
+                except self.backend.Error:
+                    self._rollback()
+                    SQL_SAVER_LOG.exception(
+                        'Drop the query\n\'%.70s\'\nwith args: %.60s', query, args
+                    )
+                self.spool.remove(id_)
+            return True
+        self.spool.remove(elements[-1][0])
+        SQL_SAVER_LOG.debug('Replayed %s queries from the spool', len(elements))
+        return True
+
+    def _replay_failed(self):
+        """Roll back the failed replay and make a new database connection"""
+        SQL_SAVER_LOG.error(
+            'Replaying the spool raised an OperationalError. Make new '
+            'database connection and retry in 5 seconds.'
+        )
+        self._rollback()
+        self._reconnect()
 
     def wait_for_queue_to_empty(self):
         """Wait for the queue to empty
@@ -571,6 +1071,237 @@ class SqlSaver(threading.Thread):
             time.sleep(0.01)
 
 
+LANE_QUEUE_LOG = logging.getLogger(__name__ + '.LaneQueue')
+LANE_QUEUE_LOG.addHandler(logging.NullHandler())
+
+class LaneQueue(Queue):
+    """A queue of ``(query, query_args)`` elements with priority lanes
+
+    Elements are put as ``(query, query_args, lane)``, or as ``(query, query_args)``
+    for lane 0, and got as ``(query, query_args)`` from the lowest numbered lane that
+    is not empty, in the order they were put in that lane. The STOP element of the
+    :class:`SqlSaver` is got only when all the lanes are empty.
+    """
+
+    def __init__(self, lanes=2, maxsize=0):
+        """Initialize the queue
+
+        Args:
+            lanes (int): The number of lanes
+            maxsize (int): The maximum number of elements in the queue, 0 for no limit
+        """
+        LANE_QUEUE_LOG.debug('Init with %s lanes', lanes)
+        # Used in _init, which is called from Queue.__init__
+        self.lanes = lanes
+        # Queue is an old style class in Python 2, so super cannot be used
+        Queue.__init__(self, maxsize)
+
+    def _init(self, maxsize):
+        # The last lane is for STOP elements
+        self._lanes = [deque() for _ in range(self.lanes + 1)]
+
+    def _qsize(self, len=len):  # pylint: disable=redefined-builtin
+        return sum(len(lane) for lane in self._lanes)
+
+    def _put(self, item):
+        if item[0] == 'STOP':
+            self._lanes[-1].append(item)
+        elif len(item) == 3:
+            self._lanes[item[2]].append(item[:2])
+        else:
+            self._lanes[0].append(item)
+
+    def _get(self):
+        for lane in self._lanes:
+            if lane:
+                return lane.popleft()
+
+
+SQL_WRITER_POOL_LOG = logging.getLogger(__name__ + '.SqlWriterPool')
+SQL_WRITER_POOL_LOG.addHandler(logging.NullHandler())
+
+class SqlWriterPool(object):
+    """A pool of :class:`SqlSaver` threads, each with its own database connection, that
+    execute the queries from a shared :class:`LaneQueue`
+
+    The pool can be shared by several :class:`ContinuousDataSaver` and
+    :class:`DataSetSaver` instances in the same process, with their ``writer_pool``
+    argument. Their single points are put in the :data:`LANE_CONTINUOUS` lane and the
+    batches from :meth:`DataSetSaver.save_points_batch` in the :data:`LANE_BULK` lane,
+    so that the connections are used for bulk uploads only when there are no
+    continuous points waiting::
+
+        pool = SqlWriterPool('username', 'password', connections=4)
+        continuous_saver = ContinuousDataSaver('dateplots_setup', 'username',
+                                               'password', writer_pool=pool)
+        data_set_saver = DataSetSaver('measurements_setup', 'xy_values_setup',
+                                      'username', 'password', writer_pool=pool)
+
+    The pool is started when the first saver that uses it is started, and stopped, after
+    all the queued queries have been executed, when the last one is stopped. It can
+    also be started and stopped directly. Since a thread can only be started once, a
+    pool that is started again after it was stopped gets new :class:`SqlSaver`
+    threads, with new connections.
+
+    .. note:: Since the queries are executed by several connections in parallel, the
+        queries are not necessarily committed in the order they were enqueued, e.g. the
+        batches of a large data set may be inserted out of order.
+
+    Attributes:
+        queue (LaneQueue): The queue shared by the savers
+        sql_savers (list): The :class:`SqlSaver` instances of the pool
+        backend (:class:`~PyExpLabSys.common.database_backends.DatabaseBackend`): The
+            storage backend, which is also used by the savers that use the pool
+    """
+
+    def __init__(self, username, password, connections=2, batch_size=1, batch_wait=0.0,
+                 backend=None):
+        """Initialize the pool and open the connections
+
+        Args:
+            username (str): The username for the MySQL database
+            password (str): The password for the MySQL database
+            connections (int): The number of connections, and :class:`SqlSaver` threads
+            batch_size (int): The maximum number of queries each :class:`SqlSaver`
+                commits together
+            batch_wait (float): The maximum time in seconds each :class:`SqlSaver` waits
+                for queries for a batch
+            backend (DatabaseBackend): The storage backend, see
+                :mod:`PyExpLabSys.common.database_backends`. Defaults to the MySQL
+                server in :data:`HOSTNAME` and :data:`DATABASE`.
+        """
+        SQL_WRITER_POOL_LOG.info('Init with username: %s, password: *****, connections: '
+                                 '%s, batch_size: %s and batch_wait: %s', username,
+                                 connections, batch_size, batch_wait)
+        if connections < 1:
+            raise ValueError('connections must be at least 1')
+        self.queue = LaneQueue(lanes=2)
+        self.backend = _get_backend(backend, username, password)
+        self._saver_args = (username, password, connections, batch_size, batch_wait)
+        self.sql_savers = self._create_sql_savers()
+        self._lock = threading.Lock()
+        self._users = 0
+        self._started = False
+
+    def _create_sql_savers(self):
+        """Return new :class:`SqlSaver` instances for the queue of the pool"""
+        username, password, connections, batch_size, batch_wait = self._saver_args
+        return [
+            SqlSaver(username, password, queue=self.queue, batch_size=batch_size,
+                     batch_wait=batch_wait, backend=self.backend)
+            for _ in range(connections)
+        ]
+
+    def start(self):
+        """Start the :class:`SqlSaver` threads, if they are not already started"""
+        with self._lock:
+            if self._started:
+                return
+            SQL_WRITER_POOL_LOG.info('start called')
+            # The threads of a stopped pool cannot be started again
+            if any(sql_saver.ident is not None for sql_saver in self.sql_savers):
+                self.sql_savers = self._create_sql_savers()
+            for sql_saver in self.sql_savers:
+                sql_saver.start()
+            self._started = True
+
+    def stop(self):
+        """Stop the :class:`SqlSaver` threads, after the queue has been emptied"""
+        with self._lock:
+            if not self._started:
+                return
+            SQL_WRITER_POOL_LOG.info('stop called. Wait for %s elements remaining in the '
+                                     'queue to be sent to the database', self.queue.qsize())
+            # Every saver takes one STOP, so put them all before waiting for any of them
+            for sql_saver in self.sql_savers:
+                sql_saver._stop_called = True  # pylint: disable=protected-access
+                self.queue.put(('STOP', None))
+            for sql_saver in self.sql_savers:
+                sql_saver.join()
+            self._started = False
+            SQL_WRITER_POOL_LOG.debug('stopped')
+
+    def enqueue_query(self, query, query_args=None, lane=0):
+        """Enqueue a query and arguments in a lane
+
+        Args:
+            query (str): The SQL query to be executed
+            query_args (sequence or mapping): Optional sequence or mapping of arguments
+                to be formatted into the query
+            lane (int): The lane, :data:`LANE_CONTINUOUS` or :data:`LANE_BULK`
+
+        Raises:
+            ValueError: If lane is not one of the lanes of the queue
+        """
+        if lane not in range(self.queue.lanes):
+            raise ValueError('The lane must be one of {}, not {}'.format(
+                list(range(self.queue.lanes)), lane))
+        SQL_WRITER_POOL_LOG.debug('Enqueue query in lane %s\n\'%.70s...\'\nwith args: '
+                                  '%.60s...', lane, query, query_args)
+        self.queue.put((query, query_args, lane))
+
+    def wait_for_queue_to_empty(self):
+        """Wait for the queue to empty"""
+        while self.queue.qsize() > 0:
+            time.sleep(0.01)
+
+    def handle(self):
+        """Return a :class:`SqlWriterPoolHandle` for a saver that uses the pool"""
+        return SqlWriterPoolHandle(self)
+
+    def _add_user(self):
+        """Register a started user and start the pool for the first one"""
+        with self._lock:
+            self._users += 1
+        self.start()
+
+    def _remove_user(self):
+        """Unregister a user and stop the pool after the last one"""
+        with self._lock:
+            self._users -= 1
+            last = self._users == 0
+        if last:
+            self.stop()
+
+
+class SqlWriterPoolHandle(object):
+    """The interface of a :class:`SqlWriterPool` for a single saver
+
+    It has the same methods as the :class:`SqlSaver` that the saver otherwise uses, and
+    starting and stopping it starts and stops the pool, when it is the first and last
+    user respectively.
+    """
+
+    def __init__(self, pool):
+        """Initialize the handle
+
+        Args:
+            pool (SqlWriterPool): The pool
+        """
+        self.pool = pool
+        self._started = False
+
+    def start(self):
+        """Start using the pool"""
+        if not self._started:
+            self._started = True
+            self.pool._add_user()  # pylint: disable=protected-access
+
+    def stop(self):
+        """Stop using the pool"""
+        if self._started:
+            self._started = False
+            self.pool._remove_user()  # pylint: disable=protected-access
+
+    def enqueue_query(self, query, query_args=None, lane=LANE_CONTINUOUS):
+        """Enqueue a query and arguments, see :meth:`SqlWriterPool.enqueue_query`"""
+        self.pool.enqueue_query(query, query_args, lane)
+
+    def wait_for_queue_to_empty(self):
+        """Wait for the queue of the pool to empty"""
+        self.pool.wait_for_queue_to_empty()
+
+
 def run_module():
     """Run the module to perform elementary functional test"""
     import numpy
@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+"""The serialization module contains the serializers used for the socket traffic in
+:mod:`PyExpLabSys.common.sockets` and :mod:`PyExpLabSys.common.socket_clients`
+
+**JSON** is the default format on the wire. It is decoded with the fastest of the
+available implementations, ``orjson``, ``ujson`` or the standard library :py:mod:`json`
+(see :data:`JSON_BACKEND`). Decoding falls back to the standard library for input the
+fast implementation rejects, e.g. NaN. If ``orjson`` is installed, it is also used for
+encoding (see :data:`FAST_DUMPS`), which leaves out the spaces after the separators, but
+otherwise decodes to the same objects. Objects it would not encode the same way as the
+standard library, e.g. with NaN (which it encodes as null), non-ASCII characters or
+non-string keys, are encoded with the standard library.
+
+**MessagePack** is available as a more compact binary format, for the commands that ask
+for it (e.g. ``msgpack_wn``). The `msgpack <https://msgpack.org/>`_ package is used if it
+is installed, otherwise a pure Python implementation of the subset of the format that is
+needed for the socket data (nil, bool, int, float, str, bin, array and map) is used (see
+:data:`MSGPACK_BACKEND`).
+"""
+
+from __future__ import unicode_literals
+
+import json
+import struct
+
+import six
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # pylint: disable=invalid-name
+try:
+    import ujson
+except ImportError:
+    ujson = None  # pylint: disable=invalid-name
+try:
+    import msgpack
+except ImportError:
+    msgpack = None  # pylint: disable=invalid-name
+
+from .supported_versions import python2_and_3
+python2_and_3(__file__)
+
+
+if orjson is not None:
+    #: The name of the JSON implementation used for decoding
+    JSON_BACKEND = 'orjson'
+    _FAST_LOADS = orjson.loads
+elif ujson is not None:
+    JSON_BACKEND = 'ujson'
+    _FAST_LOADS = ujson.loads
+else:
+    JSON_BACKEND = 'json'
+    _FAST_LOADS = None
+
+#: Whether :func:`dumps` encodes with ``orjson``. Set it to False to always get the
+#: exact output of :py:func:`json.dumps`.
+FAST_DUMPS = orjson is not None
+#: The name of the MessagePack implementation, ``'msgpack'`` or ``'builtin'``
+MSGPACK_BACKEND = 'builtin' if msgpack is None else 'msgpack'
+#: The maximum nesting depth of arrays and maps, that the builtin MessagePack decoder
+#: accepts
+MSGPACK_MAX_DEPTH = 256
+
+
+def dumps(obj):
+    """Returns obj encoded as JSON
+
+    With :data:`FAST_DUMPS`, the JSON is compact, otherwise it is the same as
+    :py:func:`json.dumps` returns. Either way, it is ASCII and decodes to the same
+    objects.
+
+    Args:
+        obj (object): The object to encode
+
+    Returns:
+        str: The JSON string
+    """
+    if FAST_DUMPS:
+        try:
+            encoded = orjson.dumps(obj)
+        except TypeError:
+            # E.g. non-string keys or integers larger than 64 bit
+            pass
+        else:
+            # orjson encodes NaN and infinity as null, so only JSON without null is
+            # known to be exact, and the replies must be ASCII
+            if b'null' not in encoded and encoded.isascii():
+                return encoded.decode('ascii')
+    return json.dumps(obj)
+
+
+def loads(data):
+    """Returns the object decoded from JSON
+
+    Args:
+        data (str or bytes): The JSON data. Bytes must be UTF-8 encoded.
+
+    Returns:
+        object: The decoded object
+
+    Raises:
+        ValueError: If data is not valid JSON
+    """
+    if _FAST_LOADS is not None:
+        try:
+            return _FAST_LOADS(data)
+        except ValueError:
+            # E.g. NaN, which the standard library accepts
+            pass
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    return json.loads(data)
+
+
+def packb(obj):
+    """Returns obj encoded as MessagePack
+
+    Tuples are encoded as arrays, like lists.
+
+    Args:
+        obj (object): The object to encode
+
+    Returns:
+        bytes: The MessagePack data
+
+    Raises:
+        TypeError: If obj contains an object that cannot be encoded
+    """
+    if msgpack is not None:
+        return msgpack.packb(obj, use_bin_type=True)
+    out = []
+    _pack(obj, out)
+    return b''.join(out)
+
+
+def unpackb(data):
+    """Returns the object decoded from MessagePack
+
+    Arrays are decoded as lists.
+
+    Args:
+        data (bytes): The MessagePack data
+
+    Returns:
+        object: The decoded object
+
+    Raises:
+        ValueError: If data is not valid MessagePack, contains types that are not
+            supported or, with the builtin decoder, is nested deeper than
+            :data:`MSGPACK_MAX_DEPTH`
+    """
+    if msgpack is not None:
+        try:
+            return msgpack.unpackb(data, raw=False)
+        except Exception as exception:  # pylint: disable=broad-except
+            # msgpack raises several different exceptions on invalid data
+            raise ValueError('Invalid MessagePack data: {}'.format(exception))
+
+    data = bytearray(data)
+    try:
+        obj, offset = _unpack(data, 0)
+    except (IndexError, struct.error):
+        raise ValueError('Invalid MessagePack data: the data is truncated')
+    except TypeError:
+        raise ValueError('Invalid MessagePack data: unhashable map key')
+    if offset != len(data):
+        raise ValueError('Invalid MessagePack data: extra data after the object')
+    return obj
+
+
+# Formats of the fixed size MessagePack types by type code
+_FIXED = {0xca: struct.Struct('>f'), 0xcb: struct.Struct('>d'),
+          0xcc: struct.Struct('>B'), 0xcd: struct.Struct('>H'),
+          0xce: struct.Struct('>I'), 0xcf: struct.Struct('>Q'),
+          0xd0: struct.Struct('>b'), 0xd1: struct.Struct('>h'),
+          0xd2: struct.Struct('>i'), 0xd3: struct.Struct('>q')}
+# Formats of the lengths of the variable size MessagePack types by type code
+_STR_LENGTH = {0xd9: struct.Struct('>B'), 0xda: struct.Struct('>H'),
+               0xdb: struct.Struct('>I')}
+_BIN_LENGTH = {0xc4: struct.Struct('>B'), 0xc5: struct.Struct('>H'),
+               0xc6: struct.Struct('>I')}
+_ARRAY_LENGTH = {0xdc: struct.Struct('>H'), 0xdd: struct.Struct('>I')}
+_MAP_LENGTH = {0xde: struct.Struct('>H'), 0xdf: struct.Struct('>I')}
+_DOUBLE = struct.Struct('>Bd')
+
+
+def _pack_length(length, fix_code, fix_limit, codes, out):
+    """Appends the type code and length for a variable size type to out"""
+    if fix_code is not None and length < fix_limit:
+        out.append(struct.pack('B', fix_code | length))
+    elif length <= 0xff and len(codes) == 3:
+        out.append(struct.pack('>BB', codes[0], length))
+    elif length <= 0xffff:
+        out.append(struct.pack('>BH', codes[-2], length))
+    elif length <= 0xffffffff:
+        out.append(struct.pack('>BI', codes[-1], length))
+    else:
+        raise ValueError('The object is too large for MessagePack')
+
+
+def _pack_int(obj, out):
+    """Appends the MessagePack encoding of an int to out"""
+    if 0 <= obj < 0x80 or -0x20 <= obj < 0:
+        out.append(struct.pack('b' if obj < 0 else 'B', obj))
+        return
+    if obj >= 0:
+        codes = (0xcc, 0xcd, 0xce, 0xcf)
+        limits = (0xff, 0xffff, 0xffffffff, 0xffffffffffffffff)
+        for code, limit in zip(codes, limits):
+            if obj <= limit:
+                out.append(struct.pack('B', code) + _FIXED[code].pack(obj))
+                return
+    else:
+        codes = (0xd0, 0xd1, 0xd2, 0xd3)
+        limits = (-0x80, -0x8000, -0x80000000, -0x8000000000000000)
+        for code, limit in zip(codes, limits):
+            if obj >= limit:
+                out.append(struct.pack('B', code) + _FIXED[code].pack(obj))
+                return
+    raise ValueError('The integer {} is out of range for MessagePack'.format(obj))
+
+
+def _pack(obj, out):
+    """Appends the MessagePack encoding of obj to the list of bytes out"""
+    if obj is None:
+        out.append(b'\xc0')
+    elif obj is True:
+        out.append(b'\xc3')
+    elif obj is False:
+        out.append(b'\xc2')
+    elif isinstance(obj, six.integer_types):
+        _pack_int(obj, out)
+    elif isinstance(obj, float):
+        out.append(_DOUBLE.pack(0xcb, obj))
+    elif isinstance(obj, six.text_type):
+        encoded = obj.encode('utf-8')
+        _pack_length(len(encoded), 0xa0, 32, (0xd9, 0xda, 0xdb), out)
+        out.append(encoded)
+    elif isinstance(obj, (bytes, bytearray)):
+        _pack_length(len(obj), None, 0, (0xc4, 0xc5, 0xc6), out)
+        out.append(bytes(obj))
+    elif isinstance(obj, (list, tuple)):
+        _pack_length(len(obj), 0x90, 16, (0xdc, 0xdd), out)
+        for item in obj:
+            _pack(item, out)
+    elif isinstance(obj, dict):
+        _pack_length(len(obj), 0x80, 16, (0xde, 0xdf), out)
+        for key, value in obj.items():
+            _pack(key, out)
+            _pack(value, out)
+    else:
+        raise TypeError('Object of type {} cannot be encoded as MessagePack'.format(
+            type(obj).__name__))
+
+
+def _unpack(data, offset, depth=0):
+    """Returns the object decoded from data at offset and the offset after it
+
+    Args:
+        data (bytearray): The MessagePack data
+        offset (int): The offset of the object
+        depth (int): The number of arrays and maps the object is nested in
+
+    Returns:
+        tuple: The object and the offset after it
+    """
+    # pylint: disable=too-many-return-statements,too-many-branches
+    code = data[offset]
+    offset += 1
+    # Fix sized types, where the value or the length is in the type code
+    if code <= 0x7f:
+        return code, offset
+    if code >= 0xe0:
+        return code - 0x100, offset
+    if code <= 0x8f:
+        return _unpack_map(data, offset, code & 0x0f, depth)
+    if code <= 0x9f:
+        return _unpack_array(data, offset, code & 0x0f, depth)
+    if code <= 0xbf:
+        return _unpack_str(data, offset, code & 0x1f)
+
+    if code == 0xc0:
+        return None, offset
+    if code == 0xc2:
+        return False, offset
+    if code == 0xc3:
+        return True, offset
+    if code in _FIXED:
+        fixed = _FIXED[code]
+        return fixed.unpack_from(data, offset)[0], offset + fixed.size
+    for lengths, unpacker in ((_STR_LENGTH, _unpack_str), (_BIN_LENGTH, _unpack_bin)):
+        if code in lengths:
+            length = lengths[code].unpack_from(data, offset)[0]
+            return unpacker(data, offset + lengths[code].size, length)
+    for lengths, unpacker in ((_ARRAY_LENGTH, _unpack_array), (_MAP_LENGTH, _unpack_map)):
+        if code in lengths:
+            length = lengths[code].unpack_from(data, offset)[0]
+            return unpacker(data, offset + lengths[code].size, length, depth)
+    raise ValueError('Unsupported MessagePack type code: 0x{:02x}'.format(code))
+
+
+def _unpack_str(data, offset, length):
+    """Returns the str of length at offset and the offset after it"""
+    end = offset + length
+    if end > len(data):
+        raise IndexError('The data is truncated')
+    return data[offset:end].decode('utf-8'), end
+
+
+def _unpack_bin(data, offset, length):
+    """Returns the bytes of length at offset and the offset after it"""
+    end = offset + length
+    if end > len(data):
+        raise IndexError('The data is truncated')
+    return bytes(data[offset:end]), end
+
+
+def _check_depth(depth):
+    """Raises ValueError if an array or map at depth is nested too deep
+
+    The decoder is recursive, so this keeps malicious input from exhausting the stack
+    """
+    if depth >= MSGPACK_MAX_DEPTH:
+        raise ValueError('Invalid MessagePack data: nested deeper than {}'.format(
+            MSGPACK_MAX_DEPTH))
+
+
+def _unpack_array(data, offset, length, depth):
+    """Returns the list of length items at offset and the offset after it"""
+    _check_depth(depth)
+    out = []
+    for _ in range(length):
+        item, offset = _unpack(data, offset, depth + 1)
+        out.append(item)
+    return out, offset
+
+
+def _unpack_map(data, offset, length, depth):
+    """Returns the dict of length items at offset and the offset after it"""
+    _check_depth(depth)
+    out = {}
+    for _ in range(length):
+        key, offset = _unpack(data, offset, depth + 1)
+        value, offset = _unpack(data, offset, depth + 1)
+        out[key] = value
+    return out, offset
@@ -3,26 +3,118 @@
 from __future__ import unicode_literals, print_function
 
 
+import os
+import mmap
 import socket
+import struct
 import sys
-import json
+import time
+from collections import deque
+try:
+    import asyncio
+except ImportError:
+    # asyncio is only available in Python 3
+    asyncio = None  # pylint: disable=invalid-name
+
+from .serialization import loads, unpackb
+from .socket_protocol import (  # pylint: disable=unused-import
+    UNKNOWN_COMMAND, OLD_DATA, STREAM, SUBSCRIBED, MAX_DATAGRAM_SIZE, REQUEST_ID_MARK,
+    TCP_LENGTH, BINARY_HEADER, BINARY_MAGIC, BINARY_VERSION, BINARY_FLAG_OLD_DATA,
+    BINARY_FLAG_NOT_NUMERIC, SHARED_MEMORY_DIR, SHARED_MEMORY_NAME, SHM_HEADER, SHM_MAGIC,
+    SHM_VERSION, SHM_SEQUENCE, SHM_SEQUENCE_OFFSET, SHM_CODENAMES_OFFSET, SHM_POINT,
+)
 
 
-OLD_DATA = 'OLD_DATA'
 CHUNK_SIZE = 1024
 
+# The number of times to try to read a consistent snapshot from shared memory
+SHM_READ_ATTEMPTS = 10000
+
+
+def decode_binary(data):
+    """Decode a reply in the binary format from a pull socket
+
+    See :meth:`PyExpLabSys.common.sockets.PullUDPHandler.handle` for a description of
+    the format.
+
+    Args:
+        data (bytes): The reply
+
+    Returns:
+        list: List of points, in the order they were requested, as ``(x, y)`` tuples.
+            Points that are too old are replaced by :data:`OLD_DATA` and points that are
+            not numeric by None.
+    """
+    try:
+        magic, version, number_of_points = BINARY_HEADER.unpack_from(data)
+    except struct.error:
+        raise ValueError('The reply is too short to be in the binary format')
+    if magic != BINARY_MAGIC or version != BINARY_VERSION:
+        msg = 'The reply is not in version {} of the binary format'
+        raise ValueError(msg.format(BINARY_VERSION))
+
+    flags_start = BINARY_HEADER.size
+    values_start = flags_start + number_of_points
+    flags = bytearray(data[flags_start: values_start])
+    values = struct.unpack_from('<{}d'.format(2 * number_of_points), data, values_start)
+
+    points = []
+    for index, flag in enumerate(flags):
+        if flag & BINARY_FLAG_OLD_DATA:
+            points.append(OLD_DATA)
+        elif flag & BINARY_FLAG_NOT_NUMERIC:
+            points.append(None)
+        else:
+            points.append(values[2 * index: 2 * index + 2])
+    return points
+
 
 class DateDataPullClient(object):
     """Client for the DateDataPullClient
 
     codenames and name are available as attributes
+
+    With ``request_ids``, every request is prefixed with a request ID, which the socket
+    server echoes in its reply. Replies to requests that were given up on (e.g. after
+    a timeout) are then discarded instead of being mistaken for the reply to the next
+    request, and several requests can be in flight at once, see
+    :meth:`communicate_many`. This requires a socket server that supports request IDs.
+
+    With ``tcp_port``, the commands are sent over a TCP connection to the TCP listener
+    of the socket server instead, which has no limit on the size of the replies, e.g.
+    for large histories.
     """
 
-    def __init__(self, host, expected_socket_name, port=9000, exception_on_old_data=True):
-        """Initialize the DateDataPullClient object"""
+    def __init__(self, host, expected_socket_name, port=9000, exception_on_old_data=True,
+                 request_ids=False, timeout=None, tcp_port=None):
+        """Initialize the DateDataPullClient object
+
+        Args:
+            host (str): The host of the socket server
+            expected_socket_name (str): The expected name of the socket server
+            port (int): The port of the socket server
+            exception_on_old_data (bool): Whether to raise ValueError on old data
+            request_ids (bool): Whether to prefix the requests with request IDs
+            timeout (float): The timeout in seconds for the replies. Defaults to None,
+                which means wait forever
+            tcp_port (int): If given, communicate with the TCP listener of the socket
+                server on this port
+        """
         self.exception_on_old_data = exception_on_old_data
-        self.socket_ = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.host_port = (host, port)
+        if tcp_port is None:
+            self.socket_ = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.socket_.settimeout(timeout)
+            self.host_port = (host, port)
+        else:
+            self.host_port = (host, tcp_port)
+            self.socket_ = socket.create_connection(self.host_port, timeout)
+        self.tcp = tcp_port is not None
+        self.request_ids = request_ids
+        self._last_request_id = 0
+        # The request IDs of the requests in flight and the replies received for them
+        # out of order
+        self._in_flight = set()
+        self._replies = {}
 
         # Read name and test expected_socket_name
         self.name = self._communicate('name')
@@ -32,22 +124,126 @@ class DateDataPullClient(object):
 
         # Read codenames
         codenames_json = self._communicate('codenames_json')
-        self.codenames = json.loads(codenames_json)
+        self.codenames = loads(codenames_json)
         self.codenames_set = set(self.codenames)
         
 
+    def _send(self, command):
+        """Send a command with a new request ID
+
+        Args:
+            command (str): The command
+
+        Returns:
+            int: The request ID
+        """
+        self._last_request_id += 1
+        request_id = self._last_request_id
+        request = '{0}{1}{0}{2}'.format(REQUEST_ID_MARK, request_id, command)
+        self.socket_.sendto(request.encode('utf-8'), self.host_port)
+        self._in_flight.add(request_id)
+        return request_id
+
+    def _receive(self, request_id):
+        """Return the reply for a request ID
+
+        Replies for other requests in flight are kept for later and replies for
+        requests that are no longer in flight are discarded.
+
+        Args:
+            request_id (int): The request ID
+
+        Returns:
+            bytes: The reply without the request ID prefix
+        """
+        try:
+            while request_id not in self._replies:
+                reply = self.socket_.recv(MAX_DATAGRAM_SIZE)
+                mark = REQUEST_ID_MARK.encode('ascii')
+                end = reply.find(mark, 1)
+                if not reply.startswith(mark) or end < 0:
+                    raise ValueError('The socket server did not echo the request ID. '
+                                     'It may not support request IDs.')
+                try:
+                    reply_id = int(reply[1:end])
+                except ValueError:
+                    continue
+                if reply_id in self._in_flight:
+                    self._replies[reply_id] = reply[end + 1:]
+            return self._replies.pop(request_id)
+        finally:
+            self._in_flight.discard(request_id)
+
+    def communicate_many(self, commands):
+        """Send several commands at once and return the replies
+
+        The commands are all sent before the replies are received, so the time it takes
+        is about that of a single command. Requires ``request_ids`` or ``tcp_port``.
+
+        Args:
+            commands (sequence): The commands
+
+        Returns:
+            list: The decoded replies in the order of the commands
+        """
+        if self.tcp:
+            request = b''
+            for command in commands:
+                command = command.encode('utf-8')
+                request += TCP_LENGTH.pack(len(command)) + command
+            self.socket_.sendall(request)
+            replies = []
+            for _ in commands:
+                length = TCP_LENGTH.unpack(self._receive_exactly(TCP_LENGTH.size))[0]
+                replies.append(self._receive_exactly(length).decode('utf-8'))
+            return replies
+        if not self.request_ids:
+            raise ValueError('Sending several commands at once requires request_ids '
+                             'or tcp_port')
+        request_ids = [self._send(command) for command in commands]
+        try:
+            return [self._receive(request_id).decode('utf-8')
+                    for request_id in request_ids]
+        finally:
+            # Discard the replies to the rest, if one of them failed
+            for request_id in request_ids:
+                self._in_flight.discard(request_id)
+                self._replies.pop(request_id, None)
+
+    def _communicate_tcp(self, command):
+        """Send a command over TCP and return the undecoded reply"""
+        request = command.encode('utf-8')
+        self.socket_.sendall(TCP_LENGTH.pack(len(request)) + request)
+        length = TCP_LENGTH.unpack(self._receive_exactly(TCP_LENGTH.size))[0]
+        return self._receive_exactly(length)
+
+    def _receive_exactly(self, size):
+        """Return size bytes from the TCP connection"""
+        received = []
+        remaining = size
+        while remaining:
+            chunk = self.socket_.recv(min(remaining, MAX_DATAGRAM_SIZE))
+            if not chunk:
+                raise socket.error('The connection was closed by the socket server')
+            received.append(chunk)
+            remaining -= len(chunk)
+        return b''.join(received)
+
     def _communicate(self, command):
         """Encode, send and decode a command for a socket"""
+        return self._communicate_binary(command).decode('utf-8')
+
+    def _communicate_binary(self, command):
+        """Send a command and return the undecoded reply"""
+        if self.tcp:
+            return self._communicate_tcp(command)
+        if self.request_ids:
+            return self._receive(self._send(command))
         self.socket_.sendto(command.encode('utf-8'), self.host_port)
-        # Received all
-        received = b''
-        while True:
-            chunk = self.socket_.recv(CHUNK_SIZE)
-            received += chunk
-            if len(chunk) < CHUNK_SIZE:
-                break
-        return received.decode('utf-8')
-    
+        # A datagram is received whole, and the rest of it would be discarded by a
+        # smaller receive
+        return self.socket_.recv(MAX_DATAGRAM_SIZE)
+
     def get_field(self, fieldname):
         """Return field by name"""
         # Check for valud fieldname
@@ -56,24 +252,82 @@ class DateDataPullClient(object):
             raise ValueError(msg)
     
         data_json = self._communicate('{}#json'.format(fieldname))
-        data = json.loads(data_json)
+        data = loads(data_json)
         if data == OLD_DATA and self.exception_on_old_data:
             raise ValueError('Old data')
         return data
 
+    def get_fields(self, fieldnames):
+        """Return several fields by name in a single request
+
+        Args:
+            fieldnames (sequence): The names of the fields to return
+
+        Returns:
+            dict: Mapping of fieldnames to values
+        """
+        unknown = set(fieldnames) - self.codenames_set
+        if unknown:
+            msg = 'Unknown fieldnames {}, valid fields are: {}'.format(sorted(unknown),
+                                                                      self.codenames)
+            raise ValueError(msg)
+
+        data_json = self._communicate('{}#json_wn'.format(','.join(fieldnames)))
+        data = loads(data_json)
+        for fieldname, value in data.items():
+            if value == OLD_DATA and self.exception_on_old_data:
+                raise ValueError('Old data, for field "{}"'.format(fieldname))
+        return data
+
     def get_all_fields(self):
         """Return all fields"""
         data_json = self._communicate('json_wn')
-        data = json.loads(data_json)
+        data = loads(data_json)
+        for fieldname, value in data.items():
+            if value == OLD_DATA and self.exception_on_old_data:
+                raise ValueError('Old data, for field "{}"'.format(fieldname))
+        return data
+
+    def get_all_fields_binary(self):
+        """Return all fields, transferred in the binary format
+
+        Non-numeric values are returned as None.
+        """
+        points = decode_binary(self._communicate_binary('binary'))
+        data = dict(zip(self.codenames, points))
+        for fieldname, value in data.items():
+            if value == OLD_DATA and self.exception_on_old_data:
+                raise ValueError('Old data, for field "{}"'.format(fieldname))
+        return data
+
+    def get_all_fields_msgpack(self):
+        """Return all fields, transferred encoded as MessagePack"""
+        data = unpackb(self._communicate_binary('msgpack_wn'))
         for fieldname, value in data.items():
             if value == OLD_DATA and self.exception_on_old_data:
                 raise ValueError('Old data, for field "{}"'.format(fieldname))
         return data
 
+    def get_history(self, since=0.0):
+        """Return the points in the history of the socket that are newer than since
+
+        Only available for sockets that keep a history.
+
+        Args:
+            since (float): Unix time
+
+        Returns:
+            dict: Mapping of fieldnames to lists of [x, y] points
+        """
+        data_json = self._communicate('history_json#{}'.format(since))
+        if data_json.startswith('ERROR#'):
+            raise ValueError(data_json.split('#', 1)[1])
+        return loads(data_json)
+
     def get_status(self):
         """Return the system status of the socket host"""
         status_json = self._communicate("status")
-        return json.loads(status_json)
+        return loads(status_json)
 
     def __getattr__(self, name):
         """Custom getattr to allow getting fields as attributes"""
@@ -85,6 +339,501 @@ class DateDataPullClient(object):
         
 
 
+class SharedMemoryReader(object):
+    """Reader for the points of a pull socket server on the same host
+
+    The socket server must be created with ``shared_memory=True``, see
+    :class:`PyExpLabSys.common.sockets.SharedMemorySegment`. The points are read
+    directly from memory, without any system calls, so reading is much faster than
+    requesting the points over the network::
+
+        reader = SharedMemoryReader(9000)
+        print(reader.get_all_fields())
+
+    codenames are available as an attribute.
+
+    .. note:: If the socket server is stopped, the reader keeps returning the last
+        points. Create a new reader when the socket server is restarted.
+    """
+
+    def __init__(self, port, exception_on_old_data=True):
+        """Open the shared memory segment
+
+        Args:
+            port (int): The port of the socket server
+            exception_on_old_data (bool): Whether to raise ValueError on old data
+        """
+        self.exception_on_old_data = exception_on_old_data
+        path = os.path.join(SHARED_MEMORY_DIR, SHARED_MEMORY_NAME.format(port))
+        with open(path, 'rb') as file_:
+            self._mmap = mmap.mmap(file_.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, number_of_points, codenames_length = \
+            SHM_HEADER.unpack_from(self._mmap)
+        if magic != SHM_MAGIC or version != SHM_VERSION:
+            self._mmap.close()
+            msg = 'The shared memory segment at {} is not in version {} of the layout'
+            raise ValueError(msg.format(path, SHM_VERSION))
+        self._points_offset = SHM_CODENAMES_OFFSET + codenames_length
+        self._points_end = self._points_offset + SHM_POINT.size * number_of_points
+        codenames_json = self._mmap[SHM_CODENAMES_OFFSET:self._points_offset]
+        self.codenames = loads(codenames_json.decode('utf-8'))
+        self.codenames_set = set(self.codenames)
+        self._index = {codename: index for index, codename in enumerate(self.codenames)}
+
+    def _read(self):
+        """Return a consistent copy of the points region"""
+        for _ in range(SHM_READ_ATTEMPTS):
+            sequence = SHM_SEQUENCE.unpack_from(self._mmap, SHM_SEQUENCE_OFFSET)[0]
+            if sequence % 2:
+                # The writer is writing
+                continue
+            data = self._mmap[self._points_offset:self._points_end]
+            if SHM_SEQUENCE.unpack_from(self._mmap, SHM_SEQUENCE_OFFSET)[0] == sequence:
+                return data
+        raise RuntimeError('Unable to read a consistent snapshot from shared memory')
+
+    def _point(self, data, index, now):
+        """Return the decoded point at index in data
+
+        Points that are too old are returned as :data:`OLD_DATA` and points that are
+        not numeric as None.
+        """
+        flags, x, y, timestamp, timeout = SHM_POINT.unpack_from(data,
+                                                                index * SHM_POINT.size)
+        # NaN timeouts, meaning no timeout, fail the comparison
+        if now - timestamp > timeout:
+            return OLD_DATA
+        if flags & BINARY_FLAG_NOT_NUMERIC:
+            return None
+        return (x, y)
+
+    def get_field(self, fieldname):
+        """Return field by name"""
+        if fieldname not in self.codenames_set:
+            msg = 'Unknown fieldnames, valid fields are: {}'.format(self.codenames)
+            raise ValueError(msg)
+        point = self._point(self._read(), self._index[fieldname], time.time())
+        if point == OLD_DATA and self.exception_on_old_data:
+            raise ValueError('Old data')
+        return point
+
+    def get_all_fields(self):
+        """Return all fields
+
+        Non-numeric values are returned as None.
+        """
+        data = self._read()
+        now = time.time()
+        fields = {}
+        for index, codename in enumerate(self.codenames):
+            point = self._point(data, index, now)
+            if point == OLD_DATA and self.exception_on_old_data:
+                raise ValueError('Old data, for field "{}"'.format(codename))
+            fields[codename] = point
+        return fields
+
+    def close(self):
+        """Close the shared memory segment"""
+        self._mmap.close()
+
+
+class SocketDirectoryClient(object):
+    """Client for the SocketDirectory
+
+    Discover the socket servers on a host and read the values of all their codenames
+    in a single request::
+
+        client = SocketDirectoryClient('rasppi42')
+        for entry in client.get_directory():
+            print(entry['port'], entry['name'], entry['codenames'])
+        print(client.get_fields(['power', '9001:temperature']))
+
+    The name of the directory socket server is available as an attribute.
+    """
+
+    def __init__(self, host, port=8999, exception_on_old_data=True, timeout=1.0):
+        """Initialize the SocketDirectoryClient object
+
+        Args:
+            host (str): The host of the directory socket server
+            port (int): The port of the directory socket server
+            exception_on_old_data (bool): Whether to raise ValueError on old data
+            timeout (float): The timeout in seconds for the replies. None means wait
+                forever
+        """
+        self.exception_on_old_data = exception_on_old_data
+        self.socket_ = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket_.settimeout(timeout)
+        self.host_port = (host, port)
+        self.name = self._communicate('name')
+
+    def _communicate(self, command):
+        """Send a command and return the decoded reply
+
+        Raises:
+            ValueError: If the reply is an error
+        """
+        self.socket_.sendto(command.encode('utf-8'), self.host_port)
+        reply = self.socket_.recv(MAX_DATAGRAM_SIZE).decode('utf-8')
+        if reply.startswith('ERROR#'):
+            raise ValueError(reply.split('#', 1)[1])
+        return reply
+
+    def _check_old_data(self, fields):
+        """Raise ValueError if one of the fields is old and exceptions are requested"""
+        for fieldname, value in fields.items():
+            if value == OLD_DATA and self.exception_on_old_data:
+                raise ValueError('Old data, for field "{}"'.format(fieldname))
+
+    def get_directory(self):
+        """Return the list of socket servers
+
+        Returns:
+            list: A dict for each socket server with the keys port, name, type,
+                codenames (None for push socket servers) and shared_memory
+        """
+        return loads(self._communicate('directory_json'))
+
+    def get_fields(self, fieldnames):
+        """Return several fields, from any of the socket servers, by name
+
+        Args:
+            fieldnames (sequence): The names of the fields to return. A name can be
+                qualified with the port of its socket server as ``port:codename``
+
+        Returns:
+            dict: Mapping of fieldnames, as given, to values
+        """
+        reply = self._communicate('{}#json_wn'.format(','.join(fieldnames)))
+        if reply == UNKNOWN_COMMAND:
+            raise ValueError('Unknown fieldnames in {}'.format(list(fieldnames)))
+        fields = loads(reply)
+        self._check_old_data(fields)
+        return fields
+
+    def get_all_fields(self):
+        """Return all fields of all the pull socket servers
+
+        Returns:
+            dict: Mapping of ports to dicts of codenames to values
+        """
+        data = loads(self._communicate('json_wn'))
+        fields = {}
+        for port, port_fields in data.items():
+            self._check_old_data(port_fields)
+            fields[int(port)] = port_fields
+        return fields
+
+    def close(self):
+        """Close the client socket"""
+        self.socket_.close()
+
+
+class DateDataPullSubscriber(object):
+    """Subscriber for the points set on a DateDataPullSocket or DataPullSocket
+
+    Instead of polling, the subscriber receives the points from the socket server as
+    they are set. The subscription lease is renewed automatically by
+    :meth:`get_update`.
+    """
+
+    def __init__(self, host, port=9000, fieldnames=None):
+        """Initialize the subscriber and subscribe
+
+        Args:
+            host (str): The host of the socket server
+            port (int): The port of the socket server
+            fieldnames (sequence): The names of the fields to subscribe to. Defaults to
+                all fields
+        """
+        self.socket_ = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.host_port = (host, port)
+        if fieldnames is None:
+            self.command = 'subscribe'
+        else:
+            self.command = '{}#subscribe'.format(','.join(fieldnames))
+        self._pending = deque()
+        self.renew_at = 0.0
+        self.subscribe()
+
+    def subscribe(self, timeout=1.0):
+        """Subscribe or renew the subscription
+
+        Args:
+            timeout (float): The timeout in seconds to wait for the reply
+        """
+        self.socket_.sendto(self.command.encode('utf-8'), self.host_port)
+        self.socket_.settimeout(timeout)
+        while True:
+            reply = self.socket_.recv(MAX_DATAGRAM_SIZE).decode('utf-8')
+            if reply.startswith(STREAM + '#'):
+                # Points streamed from an existing subscription, save them for later
+                self._pending.append(reply)
+                continue
+            if not reply.startswith(SUBSCRIBED + '#'):
+                raise ValueError('Subscription failed with reply: {}'.format(reply))
+            lease = float(reply.split('#')[1])
+            # Renew when half the lease has passed
+            self.renew_at = time.time() + lease / 2
+            return lease
+
+    def get_update(self, timeout=None):
+        """Return the next point set on the socket server
+
+        Args:
+            timeout (float): The timeout in seconds. Defaults to None, which means
+                wait forever.
+
+        Returns:
+            dict: Mapping of the fieldname to the point, or None if there was no update
+                within the timeout
+        """
+        end = None if timeout is None else time.time() + timeout
+        while not self._pending:
+            now = time.time()
+            if now >= self.renew_at:
+                self.subscribe()
+                continue
+            # Never wait past the time to renew
+            wait = self.renew_at - now
+            if end is not None:
+                if now >= end:
+                    return None
+                wait = min(wait, end - now)
+            self.socket_.settimeout(wait)
+            try:
+                reply = self.socket_.recv(MAX_DATAGRAM_SIZE).decode('utf-8')
+            except socket.timeout:
+                continue
+            if reply.startswith(STREAM + '#'):
+                self._pending.append(reply)
+        return loads(self._pending.popleft().split('#', 1)[1])
+
+    def close(self):
+        """Unsubscribe and close the socket"""
+        self.socket_.sendto(b'unsubscribe', self.host_port)
+        self.socket_.close()
+
+
+class MultiPullClient(object):
+    """Client that polls many pull socket servers concurrently
+
+    The commands for all the targets are sent from a single socket in an asyncio event
+    loop, so a host that does not answer only delays the results for its own targets::
+
+        client = MultiPullClient(timeout=0.5, retries=1)
+        results = client.poll([
+            ('rasppi12', 9000, 'temperature#raw'),
+            ('rasppi16', 9000, 'M11200362H#raw'),
+            ('rasppi16', 9000, 'M11200362C#raw'),
+        ])
+
+    The results are a dict, that maps each target to its reply, or to the exception,
+    if there was no reply, e.g. a :py:class:`socket.timeout`, or if the reply could not
+    be decoded, e.g. a :py:class:`UnicodeDecodeError`.
+
+    Every request is prefixed with a request ID, which the socket server echoes in its
+    reply, and the replies are matched to the requests by it, so a late reply, e.g. to
+    a request that timed out, is discarded instead of being taken as the reply to the
+    next request. This requires socket servers that support request IDs. Only one
+    request is outstanding for each address at a time. The targets for different
+    addresses are polled concurrently, the ones for the same address one after the
+    other.
+
+    This class is Python 3 only.
+    """
+
+    def __init__(self, timeout=1.0, retries=0):
+        """Initialize the client
+
+        Args:
+            timeout (float): The default timeout in seconds for each request
+            retries (int): The number of times to resend a request that timed out
+        """
+        if asyncio is None:
+            raise RuntimeError('MultiPullClient requires asyncio (Python 3)')
+        if timeout <= 0:
+            raise ValueError('The timeout must be positive')
+        if retries < 0:
+            raise ValueError('The number of retries cannot be negative')
+        self.timeout = timeout
+        self.retries = retries
+        # Cache of host name to IP-address lookups
+        self._addresses = {}
+
+    def _resolve(self, host):
+        """Return the IP-address for host, cached"""
+        if host not in self._addresses:
+            self._addresses[host] = socket.gethostbyname(host)
+        return self._addresses[host]
+
+    def poll_async(self, targets, loop=None):
+        """Poll targets in loop
+
+        Args:
+            targets (sequence): (host, port, command) tuples. A 4th element can be
+                given, to use another timeout than the default for that target.
+            loop (asyncio.AbstractEventLoop): The event loop to poll in. Defaults to
+                the current event loop.
+
+        Returns:
+            asyncio.Future: Future for the results
+
+        .. note:: Host names are looked up in a blocking manner the first time they are
+            used.
+        """
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        done = loop.create_future()
+        results = {}
+        queues = {}
+        seen = set()
+        for target in targets:
+            if target in seen:
+                continue
+            seen.add(target)
+            try:
+                address = (self._resolve(target[0]), target[1])
+            except socket.error as exception:
+                results[target] = exception
+                continue
+            queues.setdefault(address, deque()).append(target)
+
+        if not queues:
+            done.set_result(results)
+            return done
+
+        protocol = _MultiPullProtocol(self, loop, queues, results, done)
+        endpoint = loop.create_task(
+            loop.create_datagram_endpoint(lambda: protocol, family=socket.AF_INET)
+        )
+
+        def endpoint_failed(future):
+            """Forward an exception from creating the endpoint"""
+            if future.exception() is not None and not done.done():
+                done.set_exception(future.exception())
+        endpoint.add_done_callback(endpoint_failed)
+        return done
+
+    def poll(self, targets):
+        """Poll targets and wait for the results
+
+        Args:
+            targets (sequence): (host, port, command) tuples. A 4th element can be
+                given, to use another timeout than the default for that target.
+
+        Returns:
+            dict: Mapping of targets to replies (str) or the exceptions for the targets
+                that failed
+        """
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(self.poll_async(targets, loop=loop))
+        finally:
+            loop.close()
+
+
+class _MultiPullProtocol(object):
+    """Datagram protocol for one poll of the :class:`.MultiPullClient`"""
+
+    def __init__(self, client, loop, queues, results, done):
+        """Initialize the protocol
+
+        Args:
+            client (MultiPullClient): The client
+            loop (asyncio.AbstractEventLoop): The event loop
+            queues (dict): Mapping of addresses to deques of the targets
+            results (dict): The results, which are added to
+            done (asyncio.Future): Future, whose result is set to the results, when
+                all targets are polled
+        """
+        self.client = client
+        self.loop = loop
+        self.queues = queues
+        self.results = results
+        self.done = done
+        self.transport = None
+        self._attempts = {address: 0 for address in queues}
+        self._timers = {}
+        self._last_request_id = 0
+        # The outstanding request IDs mapped to their address and the request IDs sent
+        # (with retries) for the current target for each address
+        self._request_ids = {}
+        self._sent_ids = {address: [] for address in queues}
+
+    def connection_made(self, transport):
+        """Send the first request for each address"""
+        self.transport = transport
+        for address in self.queues:
+            self._send(address)
+
+    def _send(self, address):
+        """Send the request for the next target for address"""
+        target = self.queues[address][0]
+        timeout = target[3] if len(target) > 3 else self.client.timeout
+        self._last_request_id += 1
+        request_id = self._last_request_id
+        self._request_ids[request_id] = address
+        self._sent_ids[address].append(request_id)
+        request = '{0}{1}{0}{2}'.format(REQUEST_ID_MARK, request_id, target[2])
+        self.transport.sendto(request.encode('utf-8'), address)
+        self._timers[address] = self.loop.call_later(timeout, self._timed_out, address)
+
+    def _next(self, address, result):
+        """Set the result for the current target for address and move on"""
+        target = self.queues[address].popleft()
+        self.results[target] = result
+        self._attempts[address] = 0
+        # Replies to the earlier requests for the target are no longer wanted
+        for request_id in self._sent_ids[address]:
+            del self._request_ids[request_id]
+        self._sent_ids[address] = []
+        if self.queues[address]:
+            self._send(address)
+        elif all(not queue for queue in self.queues.values()):
+            self.transport.close()
+            if not self.done.done():
+                self.done.set_result(self.results)
+
+    def _timed_out(self, address):
+        """Resend or give up on the current target for address"""
+        if self._attempts[address] < self.client.retries:
+            self._attempts[address] += 1
+            self._send(address)
+            return
+        target = self.queues[address][0]
+        message = 'No reply for "{}" from {}'.format(target[2], address)
+        self._next(address, socket.timeout(message))
+
+    def datagram_received(self, data, address):
+        """Set the reply as the result for the target of its request ID"""
+        mark = REQUEST_ID_MARK.encode('ascii')
+        end = data.find(mark, 1)
+        if not data.startswith(mark) or end < 0:
+            return
+        try:
+            address = self._request_ids[int(data[1:end])]
+        except (ValueError, KeyError):
+            # Not a request ID or a late reply for a target that is done
+            return
+
+        try:
+            result = data[end + 1:].decode('utf-8')
+        except UnicodeDecodeError as exception:
+            result = exception
+        self._timers.pop(address).cancel()
+        self._next(address, result)
+
+    def error_received(self, exception):
+        """Errors, e.g. port unreachable, are handled by the timeouts"""
+        pass
+
+    def connection_lost(self, exception):
+        """Cancel the pending timeouts"""
+        for timer in self._timers.values():
+            timer.cancel()
+
+
 def module_demo():
     date_data_pull_client = DateDataPullClient('127.0.0.1', 'testsocket')
     print("Name:", date_data_pull_client.name)
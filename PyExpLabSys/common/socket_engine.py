@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""The socket_engine module contains an asyncio backend for the socket servers in
+:mod:`PyExpLabSys.common.sockets`
+
+Per default every :class:`.DateDataPullSocket`, :class:`.DataPullSocket` and
+:class:`.DataPushSocket` runs its own :py:class:`SocketServer.UDPServer` in its own
+thread. On a machine that hosts many sockets, that amounts to a thread per port and GIL
+contention on every request. As an alternative, an :class:`.AsyncioSocketEngine` can be
+started and handed to the socket servers via their ``engine`` argument, in which case
+all of them are served from a single event loop in a single thread::
+
+    from PyExpLabSys.common.socket_engine import AsyncioSocketEngine
+    from PyExpLabSys.common.sockets import DateDataPullSocket
+
+    engine = AsyncioSocketEngine()
+    engine.start()
+    pressure = DateDataPullSocket('pressures', ['p1', 'p2'], port=9000, engine=engine)
+    pressure.start()
+    temperature = DateDataPullSocket('temperatures', ['t1'], port=9001, engine=engine)
+    temperature.start()
+
+The request handlers are the exact same as for the thread based servers, so the
+commands understood and the data served are the same.
+
+.. note:: The requests for all the sockets served by an engine are handled one at a
+   time in the event loop. Handlers that block (e.g. a slow callback with the
+   ``'callback_direct'`` action) will therefore delay requests for other sockets on the
+   same engine.
+
+This module is Python 3 only.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import asyncio
+import logging
+import socket
+import threading
+try:
+    import SocketServer
+except ImportError:
+    # SocketServer was renamed in Python3
+    import socketserver as SocketServer
+
+from .supported_versions import python3_only
+
+python3_only(__file__)
+
+
+ASE_LOG = logging.getLogger(__name__ + '.AsyncioSocketEngine')
+ASE_LOG.addHandler(logging.NullHandler())
+
+
+class AsyncioSocketEngine(threading.Thread):
+    """Thread that runs an asyncio event loop, which serves any number of UDP socket
+    servers
+    """
+
+    def __init__(self):
+        """Initialize the engine and its (not yet running) event loop"""
+        ASE_LOG.info('Initialize')
+        super(AsyncioSocketEngine, self).__init__()
+        self.daemon = True
+        self.loop = asyncio.new_event_loop()
+
+    def run(self):
+        """Run the event loop until stopped"""
+        ASE_LOG.info('Run')
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+        ASE_LOG.info('Run ended')
+
+    def stop(self):
+        """Stop the event loop and wait for the thread to exit"""
+        ASE_LOG.debug('Stop requested')
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.join()
+        self.loop.close()
+        ASE_LOG.info('Stopped')
+
+    def udp_server(self, server_address, handler_class):
+        """Return a UDP server, served by this engine
+
+        Args:
+            server_address (tuple): The (host, port) address to bind to
+            handler_class (Sub-class of SocketServer.BaseRequestHandler): The handler to
+                use for the requests
+
+        Returns:
+            AsyncioUDPServer: The server
+        """
+        return AsyncioUDPServer(self, server_address, handler_class)
+
+
+AUS_LOG = logging.getLogger(__name__ + '.AsyncioUDPServer')
+AUS_LOG.addHandler(logging.NullHandler())
+
+
+class AsyncioUDPServer(object):
+    """UDP server served by an :class:`.AsyncioSocketEngine`
+
+    The server implements the parts of the :py:class:`SocketServer.UDPServer` interface
+    that are used by the socket servers, i.e. ``server_address``, ``socket``,
+    :meth:`serve_forever`, :meth:`shutdown` and :meth:`server_close`. The server socket
+    is bound at instantiation, to raise the same errors at the same time as
+    :py:class:`SocketServer.UDPServer`. It does not serve requests until
+    :meth:`serve_forever` is called.
+    """
+
+    def __init__(self, engine, server_address, handler_class):
+        """Initialize the server and bind the server socket
+
+        Args:
+            engine (AsyncioSocketEngine): The engine that serves this server
+            server_address (tuple): The (host, port) address to bind to
+            handler_class (Sub-class of SocketServer.BaseRequestHandler): The handler to
+                use for the requests
+        """
+        AUS_LOG.info('Initialize on %s with handler %s', server_address, handler_class)
+        self.engine = engine
+        self.handler_class = handler_class
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # Follow the same setting as the thread based server, so that the advice in
+        # PortStillReserved also applies for this server
+        if SocketServer.UDPServer.allow_reuse_address:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            self.socket.bind(server_address)
+        except socket.error:
+            self.socket.close()
+            raise
+        self.socket.setblocking(False)
+        self.server_address = self.socket.getsockname()
+        self._transport = None
+
+    def serve_forever(self):
+        """Start serving requests in the engine event loop
+
+        Contrary to the :py:class:`SocketServer.UDPServer` equivalent, this method
+        returns immediately, since the requests are served by the engine thread.
+        """
+        AUS_LOG.info('Serve on %s', self.server_address)
+        future = asyncio.run_coroutine_threadsafe(self._serve(), self.engine.loop)
+        # If the engine is already running, wait for the endpoint, to surface any errors
+        if self.engine.loop.is_running():
+            future.result()
+
+    async def _serve(self):
+        """Create the datagram endpoint on the already bound socket"""
+        self._transport, _ = await self.engine.loop.create_datagram_endpoint(
+            lambda: _HandlerProtocol(self), sock=self.socket,
+        )
+
+    def shutdown(self):
+        """Stop serving requests"""
+        AUS_LOG.debug('Shutdown requested for %s', self.server_address)
+        if self.engine.loop.is_running():
+            future = asyncio.run_coroutine_threadsafe(self._shutdown(), self.engine.loop)
+            future.result()
+        else:
+            self.server_close()
+        AUS_LOG.info('Shut down %s', self.server_address)
+
+    async def _shutdown(self):
+        """Close the transport from inside the event loop"""
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+        self.server_close()
+
+    def server_close(self):
+        """Close the server socket"""
+        self.socket.close()
+
+
+class _HandlerProtocol(asyncio.DatagramProtocol):
+    """Datagram protocol that dispatches each datagram to a request handler"""
+
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        """Handle the request with the server's request handler
+
+        The transport is handed to the handler in place of the server socket, since they
+        share the ``sendto(data, address)`` signature.
+        """
+        try:
+            self.server.handler_class((data, self.transport), addr, self.server)
+        except Exception:  # pylint: disable=broad-except
+            AUS_LOG.exception('Exception while handling request from %s on %s',
+                              addr, self.server.server_address)
+
+    def error_received(self, exc):
+        AUS_LOG.warning('Error received on %s: %s', self.server.server_address, exc)
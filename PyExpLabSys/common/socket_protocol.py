@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""The socket_protocol module contains the constants of the wire protocol of the socket
+servers in :mod:`PyExpLabSys.common.sockets`
+
+The constants are shared by the socket servers and the clients in
+:mod:`PyExpLabSys.common.socket_clients`, so they are only defined here. They are also
+available from :mod:`PyExpLabSys.common.sockets`.
+
+This module is Python 2 and 3 compatible.
+"""
+
+from __future__ import unicode_literals
+
+import os
+import struct
+import tempfile
+
+from .supported_versions import python2_and_3
+python2_and_3(__file__)
+
+
+#: The string returned if an unknown command is sent to the socket
+UNKNOWN_COMMAND = 'UNKNOWN_COMMMAND'
+#: The string used to indicate old or obsoleted data
+OLD_DATA = 'OLD_DATA'
+#: The prefix for points streamed to subscribed clients
+STREAM = 'STREAM'
+#: The reply prefix for a successful subscription
+SUBSCRIBED = 'SUBSCRIBED'
+#: The reply to an unsubscribe command
+UNSUBSCRIBED = 'UNSUBSCRIBED'
+#: The largest possible UDP payload
+MAX_DATAGRAM_SIZE = 65507
+#: The character that encloses the optional request ID, which consists of digits, in
+#: front of a request
+REQUEST_ID_MARK = '&'
+#: The maximum length of a request ID
+MAX_REQUEST_ID_LENGTH = 32
+#: The struct for the length in front of each command and reply over TCP
+TCP_LENGTH = struct.Struct('>I')
+
+#: The struct for the header of the binary format: magic, version and number of points
+BINARY_HEADER = struct.Struct('<2sBH')
+#: The magic bytes that start the binary format
+BINARY_MAGIC = b'PX'
+#: The version of the binary format
+BINARY_VERSION = 1
+#: Binary format point flag, that indicates that the data is too old
+BINARY_FLAG_OLD_DATA = 1
+#: Binary format point flag, that indicates that the point could not be packed as floats
+BINARY_FLAG_NOT_NUMERIC = 2
+
+#: The directory of the shared memory segments
+SHARED_MEMORY_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+#: The file name template, formatted with the port, of the shared memory segments
+SHARED_MEMORY_NAME = 'PyExpLabSys_pull_socket_{}'
+#: The struct for the shared memory header: magic, version, number of points and the
+#: length of the codenames
+SHM_HEADER = struct.Struct('<2sBxII')
+#: The magic bytes that start the shared memory segment
+SHM_MAGIC = b'PM'
+#: The version of the shared memory layout
+SHM_VERSION = 1
+#: The struct for the sequence number of the shared memory seqlock
+SHM_SEQUENCE = struct.Struct('<Q')
+#: The offset of the sequence number in the shared memory segment
+SHM_SEQUENCE_OFFSET = 16
+#: The offset of the codenames in the shared memory segment
+SHM_CODENAMES_OFFSET = 24
+#: The struct for a point in the shared memory segment: flags, x, y, timestamp and
+#: timeout
+SHM_POINT = struct.Struct('<B7xdddd')
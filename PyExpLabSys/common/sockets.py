@@ -30,16 +30,27 @@ Presently the module contains the following socket servers:
  * **LiveSocket** (:class:`.LiveSocket`) This socket is used only for serving
    data to the live socket server. It also is not actually a socket server
    like the others, but it has a similar interface.
+ * **SocketDirectory** (:class:`.SocketDirectory`) This socket server lists all the
+   other socket servers in the process, with their ports and codenames, and serves
+   the values of all the pull socket servers from one well known port.
+
+All the socket servers can optionally be served from a single asyncio event loop,
+instead of from a thread each, by giving them an
+:class:`~PyExpLabSys.common.socket_engine.AsyncioSocketEngine` via the ``engine``
+argument. See :mod:`PyExpLabSys.common.socket_engine` for details.
 
 .. note:: The module variable :data:`.DATA` is a dict shared for all socket
  servers started from this module. It contains all the data, queues, settings
  etc. It can be a good place to look if, to get a behind the scenes look at
- what is happening.
+ what is happening. For the pull socket servers, the value is a
+ :class:`.PullSocketState`, which can be read like a dict, but not written to.
 """
 
 from __future__ import print_function, unicode_literals
 
+import os
 import sys
+import mmap
 import threading
 import socket
 try:
@@ -49,14 +60,34 @@ except ImportError:
     import socketserver as SocketServer
 import time
 import json
+import struct
+import bisect
 try:
     import Queue
 except ImportError:
     # Queue was renamed to queue in Python 3
     import queue as Queue
+try:
+    from collections.abc import Mapping
+except ImportError:
+    # Python 2
+    from collections import Mapping
 import logging
 import six
+try:
+    import numpy
+except ImportError:
+    numpy = None  # pylint: disable=invalid-name
 from .utilities import call_spec_string
+from .serialization import dumps, loads, packb, unpackb
+# The wire protocol constants are also part of the interface of this module
+from .socket_protocol import (  # pylint: disable=unused-import
+    UNKNOWN_COMMAND, OLD_DATA, STREAM, SUBSCRIBED, UNSUBSCRIBED, MAX_DATAGRAM_SIZE,
+    REQUEST_ID_MARK, MAX_REQUEST_ID_LENGTH, TCP_LENGTH, BINARY_HEADER, BINARY_MAGIC,
+    BINARY_VERSION, BINARY_FLAG_OLD_DATA, BINARY_FLAG_NOT_NUMERIC, SHARED_MEMORY_DIR,
+    SHARED_MEMORY_NAME, SHM_HEADER, SHM_MAGIC, SHM_VERSION, SHM_SEQUENCE,
+    SHM_SEQUENCE_OFFSET, SHM_CODENAMES_OFFSET, SHM_POINT,
+)
 from .system_status import SystemStatus
 from ..settings import Settings
 from .supported_versions import python2_and_3
@@ -86,12 +117,39 @@ def bool_translate(string):
     return True if str(string) == 'True' else False
 
 
+def split_request_id(request):
+    """Splits the optional request ID prefix off a request
+
+    A request can be prefixed with a request ID on the form ``&id&`` (see
+    :data:`.REQUEST_ID_MARK`), e.g. ``'&17&json_wn'``, in which case the socket servers
+    prefix the reply with the same, so that the client can tell which request a reply
+    belongs to. The ID consists of digits only and is only recognized at the start of
+    the request, so the mark is still allowed in codenames.
+
+    Args:
+        request (bytes): The request as received
+
+    Returns:
+        tuple: The prefix (bytes), which is empty if there is no request ID, and the
+            request without the prefix (bytes)
+    """
+    mark = REQUEST_ID_MARK.encode('ascii')
+    if request.startswith(mark):
+        end = request.find(mark, 1)
+        if 1 < end <= MAX_REQUEST_ID_LENGTH + 1 and request[1:end].isdigit():
+            return request[:end + 1], request[end + 1:]
+    return b'', request
+
+
 def socket_server_status():
     """Returns the status of all socket servers
 
     Returns:
         dict: Dict with port to status dict mapping. The status dict has the following keys:
-            name, type, status (with str values) and since_last_activity with float value.
+            name, type, status (with str values) and since_last_activity with float value
+            and, for socket servers that record metrics, metrics with the
+            :meth:`.SocketMetrics.summary` of the request metrics and, for push socket
+            servers with a bounded queue, queue with the :meth:`.PushQueue.status`.
     """
     status_dict = {}
     for port, data in DATA.items():
@@ -112,9 +170,185 @@ def socket_server_status():
             'status': status,
             'since_last_activity': since_last_activity
         }
+        metrics = data.get('metrics')
+        if metrics is not None:
+            status_dict[port]['metrics'] = metrics.summary()
+        queue = data.get('queue')
+        if isinstance(queue, PushQueue):
+            status_dict[port]['queue'] = queue.status()
     return status_dict
 
 
+def _histogram_percentile(histogram, fraction):
+    """Returns the upper bound of the :data:`.METRICS_BUCKETS` bucket that contains the
+    fraction percentile of a histogram
+
+    Args:
+        histogram (list): Counts per bucket
+        fraction (float): The percentile as a fraction e.g. 0.99
+
+    Returns:
+        float: The upper bound in seconds or None if there are no counts or the
+            percentile is beyond the last bucket
+    """
+    total = sum(histogram)
+    if total == 0:
+        return None
+    accumulated = 0
+    for bound, count in zip(METRICS_BUCKETS, histogram):
+        accumulated += count
+        if accumulated >= fraction * total:
+            return bound
+    return None
+
+
+SMLOG = logging.getLogger(__name__ + '.SocketMetrics')
+SMLOG.addHandler(logging.NullHandler())
+class SocketMetrics(object):
+    """Request metrics for a socket server
+
+    For each command, the number of requests, the number of error replies, the bytes
+    received and sent, and a histogram of handling times are recorded. The
+    histogram counts the requests in the buckets delimited by the upper bounds in
+    :data:`.METRICS_BUCKETS`, with a last bucket for the slower ones. To keep the
+    metrics bounded, at most :data:`.MAX_METRICS_COMMANDS` different commands are
+    recorded, and the rest are recorded as ``'other'``.
+    """
+
+    def __init__(self):
+        """Initialize the metrics"""
+        SMLOG.debug('Initialize')
+        self.since = time.time()
+        self._commands = {}
+        self._lock = threading.Lock()
+
+    def record(self, command, bytes_in, bytes_out, duration, error=False):
+        """Records a request
+
+        Args:
+            command (str): The command, without any data or codenames
+            bytes_in (int): The size of the request
+            bytes_out (int): The size of the reply
+            duration (float): The handling time in seconds
+            error (bool): Whether the reply was an error
+        """
+        with self._lock:
+            entry = self._commands.get(command)
+            if entry is None:
+                if len(self._commands) >= MAX_METRICS_COMMANDS:
+                    command = 'other'
+                entry = self._commands.setdefault(command, {
+                    'count': 0, 'errors': 0, 'bytes_in': 0, 'bytes_out': 0,
+                    'histogram': [0] * (len(METRICS_BUCKETS) + 1),
+                })
+            entry['count'] += 1
+            entry['errors'] += int(error)
+            entry['bytes_in'] += bytes_in
+            entry['bytes_out'] += bytes_out
+            entry['histogram'][bisect.bisect_left(METRICS_BUCKETS, duration)] += 1
+
+    def as_dict(self):
+        """Returns a copy of all the metrics
+
+        Returns:
+            dict: With the keys ``since`` (unix time the recording started),
+                ``buckets`` (:data:`.METRICS_BUCKETS`) and ``commands``, which is a
+                dict of command to dicts with the keys ``count``, ``errors``,
+                ``bytes_in``, ``bytes_out`` and ``histogram``
+        """
+        with self._lock:
+            commands = {command: dict(entry, histogram=list(entry['histogram']))
+                        for command, entry in self._commands.items()}
+        return {'since': self.since, 'buckets': list(METRICS_BUCKETS),
+                'commands': commands}
+
+    def summary(self):
+        """Returns a summary of the metrics for all commands
+
+        Returns:
+            dict: With the keys ``requests``, ``errors``, ``bytes_in`` and
+                ``bytes_out`` and the approximate handling time percentiles ``p50``
+                and ``p99`` (see :func:`._histogram_percentile`)
+        """
+        summary = {'requests': 0, 'errors': 0, 'bytes_in': 0, 'bytes_out': 0}
+        histogram = [0] * (len(METRICS_BUCKETS) + 1)
+        with self._lock:
+            for entry in self._commands.values():
+                summary['requests'] += entry['count']
+                summary['errors'] += entry['errors']
+                summary['bytes_in'] += entry['bytes_in']
+                summary['bytes_out'] += entry['bytes_out']
+                histogram = [total + count for total, count
+                             in zip(histogram, entry['histogram'])]
+        summary['p50'] = _histogram_percentile(histogram, 0.5)
+        summary['p99'] = _histogram_percentile(histogram, 0.99)
+        return summary
+
+
+RCLOG = logging.getLogger(__name__ + '.ResponseCache')
+RCLOG.addHandler(logging.NullHandler())
+class ResponseCache(object):
+    """Cache of pre-rendered (encoded) responses for a pull socket server
+
+    The cache is invalidated when a point is set and when a point that was served as
+    up-to-date passes its timeout. To prevent a response rendered from data that was
+    changed while rendering from being stored, responses are stored along with the
+    generation of the cache they were rendered in, and only stored if the cache has
+    not been invalidated in the mean time.
+
+    Attributes:
+        generation (int): The generation of the cache, incremented on invalidation
+    """
+
+    def __init__(self):
+        """Initialize the cache"""
+        RCLOG.info('Initialize')
+        self._lock = threading.Lock()
+        self._responses = {}
+        self._valid_until = float('inf')
+        self.generation = 0
+
+    def get(self, command):
+        """Return a cached response or None
+
+        Args:
+            command (str): The command to return the cached response for
+
+        Returns:
+            bytes: The cached response or None if there is no valid cached response
+        """
+        if self._valid_until != float('inf') and time.time() >= self._valid_until:
+            RCLOG.debug('Cache expired')
+            self.invalidate()
+            return None
+        return self._responses.get(command)
+
+    def set(self, command, response, generation, valid_until=float('inf')):
+        """Store a response in the cache
+
+        Args:
+            command (str): The command the response is for
+            response (bytes): The encoded response
+            generation (int): The generation of the cache (read before rendering the
+                response)
+            valid_until (float): Unix time after which the response is no longer
+                valid, because a point will have timed out
+        """
+        with self._lock:
+            if generation != self.generation:
+                RCLOG.debug('Cache generation changed, skip storing response')
+                return
+            self._responses[command] = response
+            self._valid_until = min(self._valid_until, valid_until)
+
+    def invalidate(self):
+        """Invalidate all cached responses"""
+        with self._lock:
+            self.generation += 1
+            self._responses = {}
+            self._valid_until = float('inf')
+
+
 PULLUHLOG = logging.getLogger(__name__ + '.PullUDPHandler')
 PULLUHLOG.addHandler(logging.NullHandler())
 class PullUDPHandler(SocketServer.BaseRequestHandler):
@@ -123,6 +357,10 @@ class PullUDPHandler(SocketServer.BaseRequestHandler):
     handler understands are documented in the :meth:`.handle` method.
     """
 
+    # The view of the socket data (see PullSocketState.view) a cached reply is rendered
+    # from, or None to read the current data
+    _view = None
+
     def handle(self):
         """Returns data corresponding to the request
 
@@ -147,6 +385,28 @@ class PullUDPHandler(SocketServer.BaseRequestHandler):
            form ``x,y``
          * **codename#json** (*str*): Return the value for ``codename`` as a
            list (e.g ``[x1, y1]``) contained in a :py:mod:`json` string
+         * **codename#binary** (*str*): Return the value for ``codename`` in the
+           binary format, see ``binary`` below
+         * **codename#msgpack** (*str*): Return the value for ``codename`` as a
+           list (e.g ``[x1, y1]``) encoded as MessagePack
+         * **codename1,codename2#format** (*str*): Return the values for only the
+           listed codenames, in the listed order, in one of the formats ``raw``,
+           ``json``, ``raw_wn``, ``json_wn``, ``binary``, ``msgpack`` or ``msgpack_wn``
+           e.g.
+           ``'codename1,codename3#json_wn'``. If one of the codenames is unknown, the
+           command is unknown.
+         * **binary** (*str*): Return all values in a compact binary format, in
+           the same order as ``raw``. The format is a header packed with
+           :data:`.BINARY_HEADER` (magic :data:`.BINARY_MAGIC`, version
+           :data:`.BINARY_VERSION` and the number of points ``n``), followed by
+           ``n`` bytes of flags (:data:`.BINARY_FLAG_OLD_DATA` and
+           :data:`.BINARY_FLAG_NOT_NUMERIC`) and ``2n`` little endian float64 values
+           ``x1, y1, x2, y2, ...``. Points that are flagged have NaN as values.
+           :func:`PyExpLabSys.common.socket_clients.decode_binary` decodes it.
+         * **msgpack** (*str*): Return all values as a list of points, like ``json``,
+           but encoded as MessagePack (see :mod:`PyExpLabSys.common.serialization`)
+         * **msgpack_wn** (*str*): Return all values as a dict, like ``json_wn``, but
+           encoded as MessagePack
          * **codenames_raw** (*str*): Return the list of codenames on the form
            ``name1,name2``
          * **codenames_json** (*str*): Return a list of the codenames contained
@@ -154,22 +414,185 @@ class PullUDPHandler(SocketServer.BaseRequestHandler):
          * **name** (*str*): Return the name of the socket server
          * **status** (*str*): Return the system status and status for all
            socket servers.
+         * **metrics** (*str*): Return the request metrics for this socket server
+           (see :meth:`.SocketMetrics.as_dict`) encoded as :py:mod:`json`
+         * **subscribe** (*str*): Subscribe to all points. For the duration of the
+           subscription lease, every point that is set is sent to the subscribing
+           client as ``STREAM#{"codename": [x, y]}`` (see :data:`.STREAM`), without
+           the client having to poll for it. The reply is ``SUBSCRIBED#lease``, where
+           lease is the lease duration in seconds (:data:`.SUBSCRIPTION_LEASE`).
+           Sending the subscribe command again before the lease expires renews it.
+         * **codename1,codename2#subscribe** (*str*): Subscribe to only the listed
+           codenames. Otherwise the same as ``subscribe``.
+         * **unsubscribe** (*str*): Cancel the subscription for this client. The reply
+           is ``UNSUBSCRIBED``.
+         * **history_json#since** (*str*): Only for socket servers with a history (see
+           the ``history_size`` argument to :meth:`.CommonDataPullSocket.__init__`).
+           Return a dict of codenames to lists of all the points in the history that
+           are newer than ``since`` (unix time), encoded as :py:mod:`json` e.g.
+           ``{"codename1": [[x1, y1], [x2, y2]], "codename2": []}``. If the reply
+           would exceed the size of a datagram, an ``ERROR`` is returned instead.
+
+        The responses to all commands except **status**, **metrics**, the subscription
+        and the history commands are cached per socket server (see :class:`.ResponseCache`), so
+        repeated requests are served without re-rendering, until a point is set or times out.
+
+        All commands can be prefixed with a request ID, which is then echoed in front of
+        the reply, e.g. ``'&17&codename#json'`` is answered with ``'&17&[x1, y1]'``. See
+        :func:`.split_request_id`.
         """
-        command = self.request[0].decode('ascii')
+        start = time.time()
+        prefix, request = split_request_id(self.request[0])
+        command = request.decode('ascii')
         # pylint: disable=attribute-defined-outside-init
         self.port = self.server.server_address[1]
         sock = self.request[1]
         PULLUHLOG.debug('Request \'%s\' received from %s on port %s',
                         command, self.client_address, self.port)
 
-        if command.count('#') == 1:
-            data = self._single_value(command)
+        data = prefix + self._reply(command)
+        sock.sendto(data, self.client_address)
+        PULLUHLOG.debug('Sent back \'%.100s\' to %s', data, self.client_address)
+
+        self._record(command, len(self.request[0]), data[len(prefix):], len(data), start)
+
+    def _record(self, command, bytes_in, reply, bytes_out, start):
+        """Records a handled request in the metrics
+
+        Args:
+            command (str): Complete command
+            bytes_in (int): The size of the request
+            reply (bytes): The reply without request ID
+            bytes_out (int): The size of the reply as sent
+            start (float): The time the request was received
+        """
+        error = reply == UNKNOWN_COMMAND.encode('ascii') or\
+            reply.startswith(PUSH_ERROR.encode('ascii') + b'#')
+        self.state.metrics.record(self._metrics_key(command), bytes_in, bytes_out,
+                                  time.time() - start, error)
+
+    def _reply(self, command):
+        """Returns the encoded reply for a command
+
+        Args:
+            command (str): Complete command
+
+        Returns:
+            bytes: The reply to be sent back
+        """
+        if command in ('subscribe', 'unsubscribe') or command.endswith('#subscribe'):
+            return self._subscription(command).encode('ascii')
+        if command.startswith('history_json#'):
+            return self._history(command).encode('ascii')
+        if command == 'metrics':
+            return json.dumps(self.state.metrics.as_dict()).encode('ascii')
+
+        cache = self.state.cache
+        data = cache.get(command)
+        if data is None:
+            generation = cache.generation
+            # Render the reply and work out how long it is valid from the same view, so
+            # that a point cannot time out unnoticed in between
+            self._view = self.state.view()
+            try:
+                if command.count('#') == 1:
+                    out = self._single_value(command)
+                else:
+                    # The "name" and "status" commands are also handled here
+                    out = self._all_values(command)
+                data = out if isinstance(out, bytes) else out.encode('ascii')
+                if command != 'status' and out != UNKNOWN_COMMAND:
+                    cache.set(command, data, generation, self._valid_until())
+            finally:
+                self._view = None
+        return data
+
+    @staticmethod
+    def _metrics_key(command):
+        """Returns the command with the codenames and arguments stripped, to use as
+        key in the metrics
+
+        Args:
+            command (str): Complete command
+
+        Returns:
+            str: The metrics key e.g. ``'codename#json'`` for ``'my_codename#json'``
+        """
+        if '#' not in command:
+            return command
+        name, argument = command.split('#', 1)
+        if name == 'history_json':
+            return 'history_json#since'
+        if ',' in name:
+            return 'codenames#' + argument
+        return 'codename#' + argument
+
+    @property
+    def state(self):
+        """The :class:`.PullSocketState` of the socket server that received the
+        request
+        """
+        return DATA[self.port]
+
+    @property
+    def max_reply_size(self):
+        """The maximum size of a reply"""
+        return MAX_DATAGRAM_SIZE
+
+    def _subscription(self, command):
+        """Adds, renews or removes the subscription for the client
+
+        Args:
+            command (str): Complete command
+
+        Returns:
+            str: The reply to be sent back
+        """
+        PULLUHLOG.debug('Parsing subscription command: %s', command)
+        subscriptions = self.state.subscriptions
+        if command == 'unsubscribe':
+            subscriptions.pop(self.client_address, None)
+            return UNSUBSCRIBED
+
+        if command == 'subscribe':
+            codenames = None
         else:
-            # The "name" and "status" commands are also handled here
-            data = self._all_values(command)
+            codenames = set(command.split('#')[0].split(','))
+            if not codenames.issubset(self.state.index):
+                return UNKNOWN_COMMAND
+
+        if self.client_address not in subscriptions and\
+           len(subscriptions) >= MAX_SUBSCRIPTIONS:
+            return '{}#Too many subscriptions'.format(PUSH_ERROR)
+        subscriptions[self.client_address] =\
+            (time.time() + SUBSCRIPTION_LEASE, codenames)
+        return '{}#{}'.format(SUBSCRIBED, SUBSCRIPTION_LEASE)
 
-        sock.sendto(data.encode('ascii'), self.client_address)
-        PULLUHLOG.debug('Sent back \'%s\' to %s', data, self.client_address)
+    def _history(self, command):
+        """Returns the points in the history that are newer than the requested time
+
+        Args:
+            command (str): Complete command
+
+        Returns:
+            str: The data as a string (or an error) to be sent back
+        """
+        PULLUHLOG.debug('Parsing history command: %s', command)
+        history = self.state.history
+        try:
+            since = float(command.split('#')[1])
+        except ValueError:
+            return UNKNOWN_COMMAND
+        if history is None:
+            return '{}#No history kept for this socket server'.format(PUSH_ERROR)
+
+        out = six.text_type(json.dumps(
+            {codename: buffer_.since(since).tolist() for codename, buffer_ in history.items()}
+        ))
+        if len(out) > self.max_reply_size:
+            return '{}#The history since {} is too large for a reply'.format(
+                PUSH_ERROR, since)
+        return out
 
     def _single_value(self, command):
         """Returns a string for a single point
@@ -182,83 +605,158 @@ class PullUDPHandler(SocketServer.BaseRequestHandler):
         """
         PULLUHLOG.debug('Parsing single value command: %s', command)
         name, command = command.split('#')
+        # Several codenames, separated by ',' (which cannot be part of a codename)
+        if ',' in name:
+            out = self._selected_values(name.split(','), command)
+        elif name not in self.state.index:
+            out = UNKNOWN_COMMAND
         # Return as raw string
-        if command == 'raw' and name in DATA[self.port]['data']:
-            if self._old_data(name):
-                out = OLD_DATA
-            else:
-                out = '{},{}'.format(*DATA[self.port]['data'][name])
-
-        elif command == 'json' and name in DATA[self.port]['data']:
-            if self._old_data(name):
-                out = six.text_type(json.dumps(OLD_DATA))
-            else:
-                out = six.text_type(json.dumps(DATA[self.port]['data'][name]))
+        elif command == 'raw':
+            point = self._points([name])[0]
+            out = OLD_DATA if point is OLD_DATA else '{},{}'.format(*point)
+        elif command == 'json':
+            out = six.text_type(dumps(self._points([name])[0]))
+        elif command == 'msgpack':
+            out = packb(self._points([name])[0])
+        # Return in the binary format
+        elif command == 'binary':
+            out = self._binary_values([name])
         # The command is unknown
         else:
             out = UNKNOWN_COMMAND
 
         return out
 
-    # pylint: disable=too-many-branches
-    def _all_values(self, command):
-        """Returns a string for all points or names
+    def _selected_values(self, codenames, data_format):
+        """Returns a string for a selection of points
 
         Args:
-            command (str): Complete command
+            codenames (list): The codenames of the points to return
+            data_format (str): One of the formats in :data:`.VALUE_FORMATS`
 
         Returns:
             str: The data as a string (or an error) to be sent back
         """
-        PULLUHLOG.debug('Parsing all-values command: %s', command)
-        # Return a raw string with all measurements in codenames order
-        if command == 'raw':
-            strings = []
-            for codename in DATA[self.port]['codenames']:
-                if self._old_data(codename):
-                    string = OLD_DATA
-                else:
-                    string = '{},{}'.format(*DATA[self.port]['data'][codename])
-                strings.append(string)
-            out = ';'.join(strings)
-        # Return a json encoded string with list of all measurements
-        elif command == 'json':
-            points = []
-            for codename in DATA[self.port]['codenames']:
-                if self._old_data(codename):
-                    data = OLD_DATA
-                else:
-                    data = DATA[self.port]['data'][codename]
-                points.append(data)
-            out = six.text_type(json.dumps(points))
-        # Return a raw string with all measurements in codenames order including names
-        elif command == 'raw_wn':
+        PULLUHLOG.debug('Parsing selected values command for %s in format: %s',
+                        codenames, data_format)
+        if data_format not in VALUE_FORMATS:
+            return UNKNOWN_COMMAND
+        index = self.state.index
+        for codename in codenames:
+            if codename not in index:
+                return UNKNOWN_COMMAND
+        return self._values(codenames, data_format)
+
+    def _points(self, codenames):
+        """Returns the points for codenames, with the points that are too old replaced
+        by :data:`.OLD_DATA`
+
+        All the points are taken from the same consistent snapshot of the socket data,
+        the view the reply is rendered from if there is one.
+
+        Args:
+            codenames (list): The codenames of the points to return, in order
+
+        Returns:
+            list: The points (or :data:`.OLD_DATA`) in codenames order
+        """
+        return self.state.current_points(codenames, self._view)
+
+    def _values(self, codenames, data_format):
+        """Returns a string with the points for codenames in one of the value formats
+
+        Args:
+            codenames (list): The codenames of the points to return, in order
+            data_format (str): One of the formats in :data:`.VALUE_FORMATS`
+
+        Returns:
+            str or bytes: The data to be sent back (bytes for the binary and MessagePack
+                formats)
+        """
+        # Return the measurements in codenames order packed in the binary format
+        if data_format == 'binary':
+            return self._binary_values(codenames)
+
+        points = self._points(codenames)
+        # Return a raw string with the measurements in codenames order
+        if data_format == 'raw':
+            out = ';'.join(
+                OLD_DATA if point is OLD_DATA else '{},{}'.format(*point)
+                for point in points
+            )
+        # Return a json encoded string with list of the measurements
+        elif data_format == 'json':
+            out = six.text_type(dumps(points))
+        # Return the list of the measurements or a dict of them encoded as MessagePack
+        elif data_format == 'msgpack':
+            out = packb(points)
+        elif data_format == 'msgpack_wn':
+            out = packb(dict(zip(codenames, points)))
+        # Return a raw string with the measurements in codenames order including names
+        elif data_format == 'raw_wn':
             strings = []
-            for codename in DATA[self.port]['codenames']:
-                if self._old_data(codename):
+            for codename, point in zip(codenames, points):
+                if point is OLD_DATA:
                     string = '{}:{}'.format(codename, OLD_DATA)
                 else:
-                    string = '{}:{},{}'.format(
-                        codename, *DATA[self.port]['data'][codename]
-                        )
+                    string = '{}:{},{}'.format(codename, *point)
                 strings.append(string)
             out = ';'.join(strings)
-        # Return a copy of the data dict encoded as a json string
-        elif command == 'json_wn':
-            datacopy = dict(DATA[self.port]['data'])
-            for codename in DATA[self.port]['codenames']:
-                if self._old_data(codename):
-                    datacopy[codename] = OLD_DATA
-            out = six.text_type(json.dumps(datacopy))
+        # Return the measurements in a dict encoded as a json string
+        else:
+            out = six.text_type(dumps(dict(zip(codenames, points))))
+        return out
+
+    def _binary_values(self, codenames):
+        """Returns the points for codenames packed in the binary format
+
+        See :meth:`handle` for a description of the format.
+
+        Args:
+            codenames (list): The codenames of the points to return, in order
+
+        Returns:
+            bytes: The packed points
+        """
+        flags = bytearray(len(codenames))
+        values = []
+        for index, point in enumerate(self._points(codenames)):
+            if point is OLD_DATA:
+                flags[index] = BINARY_FLAG_OLD_DATA
+                values.extend(NAN_POINT)
+                continue
+            try:
+                if isinstance(point[1], six.string_types):
+                    raise ValueError('strings are not numeric')
+                values.extend((float(point[0]), float(point[1])))
+            except (TypeError, ValueError):
+                flags[index] = BINARY_FLAG_NOT_NUMERIC
+                values.extend(NAN_POINT)
+        header = BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, len(codenames))
+        return header + bytes(flags) + struct.pack('<{}d'.format(len(values)), *values)
+
+    def _all_values(self, command):
+        """Returns a string for all points or names
+
+        Args:
+            command (str): Complete command
+
+        Returns:
+            str: The data as a string (or an error) to be sent back
+        """
+        PULLUHLOG.debug('Parsing all-values command: %s', command)
+        # Return all measurements in codenames order in one of the value formats
+        if command in VALUE_FORMATS:
+            out = self._values(self.state.codenames, command)
         # Return all codesnames in a raw string
         elif command == 'codenames_raw':
-            out = ','.join(DATA[self.port]['codenames'])
+            out = ','.join(self.state.codenames)
         # Return a list with all codenames encoded as a json string
         elif command == 'codenames_json':
-            out = six.text_type(json.dumps(DATA[self.port]['codenames']))
+            out = six.text_type(json.dumps(self.state.codenames))
         # Return the socket server name
         elif command == 'name':
-            out = DATA[self.port]['name']
+            out = self.state.name
         # Return status of system and all socket servers
         elif command == 'status':
             out = six.text_type(json.dumps({
@@ -271,40 +769,455 @@ class PullUDPHandler(SocketServer.BaseRequestHandler):
 
         return out
 
-    def _old_data(self, codename):
-        """Checks if the data for codename has timed out
+    def _valid_until(self):
+        """Returns the time at which the first of the points that were not too old in
+        the view the reply was rendered from, will become too old
+
+        Returns:
+            float: Unix time of the first timeout or inf if no points will time out
+        """
+        state = self.state
+        valid_until = float('inf')
+        if state.timeouts is None:
+            return valid_until
+        _, timestamps, now = self._view
+        for timeout, point_time in zip(state.timeouts, timestamps):
+            if timeout is None:
+                continue
+            expiry = point_time + timeout
+            if now < expiry < valid_until:
+                valid_until = expiry
+        return valid_until
+
+
+PULLTHLOG = logging.getLogger(__name__ + '.PullTCPHandler')
+PULLTHLOG.addHandler(logging.NullHandler())
+class PullTCPHandler(PullUDPHandler):
+    """Request handler for the TCP listener of the :class:`.DateDataPullSocket` and
+    :class:`.DataPullSocket` socket servers
+
+    The commands and replies are the same as for the :class:`.PullUDPHandler`, except
+    that the replies are not limited to the size of a datagram and that subscriptions
+    are not available. Over TCP, each command and each reply is framed by its length,
+    packed with :data:`.TCP_LENGTH`, in front of it. Several commands can be sent over
+    the same connection, and they are answered in order.
+    """
+
+    def handle(self):
+        """Answers the commands on the connection until it is closed"""
+        # pylint: disable=attribute-defined-outside-init
+        self.port = self.server.data_port
+        PULLTHLOG.debug('Connection from %s for port %s', self.client_address, self.port)
+        while True:
+            request = self._receive_frame()
+            if request is None:
+                break
+            start = time.time()
+            prefix, request = split_request_id(request)
+            command = request.decode('ascii')
+            PULLTHLOG.debug('Request \'%s\' received from %s', command, self.client_address)
+            data = prefix + self._reply(command)
+            self.request.sendall(TCP_LENGTH.pack(len(data)) + data)
+            self._record(command, TCP_LENGTH.size + len(request) + len(prefix),
+                         data[len(prefix):], TCP_LENGTH.size + len(data), start)
+        PULLTHLOG.debug('Connection from %s closed', self.client_address)
+
+    def _receive_exactly(self, size):
+        """Returns size bytes from the connection or None if it was closed first"""
+        received = b''
+        while len(received) < size:
+            chunk = self.request.recv(size - len(received))
+            if not chunk:
+                return None
+            received += chunk
+        return received
+
+    def _receive_frame(self):
+        """Returns the next request or None if the connection is closed"""
+        header = self._receive_exactly(TCP_LENGTH.size)
+        if header is None:
+            return None
+        length = TCP_LENGTH.unpack(header)[0]
+        if length > MAX_TCP_REQUEST_SIZE:
+            PULLTHLOG.warning('Request of %s bytes from %s is too large, closing',
+                              length, self.client_address)
+            return None
+        return self._receive_exactly(length)
+
+    @property
+    def max_reply_size(self):
+        """The maximum size of a reply"""
+        return MAX_TCP_REPLY_SIZE
+
+    def _subscription(self, command):
+        """Subscriptions are not available over TCP"""
+        return '{}#Subscriptions are not available over TCP'.format(PUSH_ERROR)
+
+
+HBLOG = logging.getLogger(__name__ + '.HistoryBuffer')
+HBLOG.addHandler(logging.NullHandler())
+
+
+class HistoryBuffer(object):
+    """Fixed size, numpy backed, ring buffer with the history of points for a codename
+
+    Along with each point a timestamp is stored, which is used to select the points
+    that are newer than a given time. For date data the timestamp is the x value.
+    """
+
+    def __init__(self, size):
+        """Initialize the buffer
+
+        Args:
+            size (int): The number of points to keep
+        """
+        HBLOG.info('Initialize with size: %s', size)
+        self.size = size
+        # Columns are: timestamp, x, y
+        self._data = numpy.zeros((size, 3))
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def append(self, timestamp, x_value, y_value):
+        """Append a point
+
+        Args:
+            timestamp (float): Unix time of the point
+            x_value (float): The x value
+            y_value (float): The y value. Points whose values are not numbers are not
+                stored.
+        """
+        try:
+            row = (float(timestamp), float(x_value), float(y_value))
+        except (TypeError, ValueError):
+            HBLOG.debug('Non numeric point (%s, %s) not stored', x_value, y_value)
+            return
+        with self._lock:
+            self._data[self._count % self.size] = row
+            self._count += 1
+
+    def since(self, timestamp):
+        """Return the points that are newer than timestamp
 
         Args:
-            codename (str): The codename whose data should be checked for
-                timeout
+            timestamp (float): Unix time
 
         Returns:
-            bool: Whether the data is too old or not
+            numpy.ndarray: (n, 2) array of x, y values in chronological order
         """
-        PULLUHLOG.debug('Check if data for \'%s\' is too old', codename)
-        now = time.time()
-        if DATA[self.port]['type'] == 'date':
-            timeout = DATA[self.port]['timeouts'].get(codename)
-            if timeout is None:
-                out = False
-            else:
-                point_time = DATA[self.port]['data'][codename][0]
-                out = now - point_time > timeout
-        elif DATA[self.port]['type'] == 'data':
-            timeout = DATA[self.port]['timeouts'].get(codename)
-            if timeout is None:
-                out = False
+        with self._lock:
+            if self._count <= self.size:
+                ordered = self._data[:self._count]
             else:
-                timestamp = DATA[self.port]['timestamps'][codename]
-                out = now - timestamp > timeout
+                start = self._count % self.size
+                ordered = numpy.concatenate((self._data[start:], self._data[:start]))
+        return ordered[ordered[:, 0] > timestamp, 1:]
+
+
+SMSLOG = logging.getLogger(__name__ + '.SharedMemorySegment')
+SMSLOG.addHandler(logging.NullHandler())
+
+
+class SharedMemorySegment(object):
+    """Shared memory segment with the latest points of a pull socket server
+
+    The segment is a file in :data:`.SHARED_MEMORY_DIR` (named from
+    :data:`.SHARED_MEMORY_NAME` and the port), which is memory mapped, so that
+    readers on the same host can read the points without any system calls per read,
+    see :class:`PyExpLabSys.common.socket_clients.SharedMemoryReader`.
+
+    The layout is:
+
+     * A header packed with :data:`.SHM_HEADER`: magic :data:`.SHM_MAGIC`, version
+       :data:`.SHM_VERSION`, the number of points ``n`` and the length of the codenames
+     * At offset :data:`.SHM_SEQUENCE_OFFSET`, the sequence number of the seqlock packed
+       with :data:`.SHM_SEQUENCE`
+     * From offset :data:`.SHM_CODENAMES_OFFSET`, the codenames as a json encoded list,
+       padded with spaces to a multiple of 8 bytes
+     * ``n`` points packed with :data:`.SHM_POINT`: flags (as in the binary format),
+       x, y, the timestamp to evaluate whether the point is too old from and the
+       timeout (NaN for no timeout)
+
+    The points are protected by a seqlock. The writer makes the sequence number odd
+    before it writes and even after, so a reader that sees the same even sequence
+    number before and after copying the points, has copied a consistent snapshot.
+    There must only be one writer, which the lock of the :class:`.PullSocketState`
+    ensures. Writes after the segment is closed are ignored, so that acquisition
+    threads that still set points while the socket server is stopped do not fail.
+    """
+
+    def __init__(self, port, codenames, timeouts):
+        """Create the segment
+
+        Args:
+            port (int): The port of the socket server
+            codenames (list): The codenames
+            timeouts (list or None): The timeouts in codenames order, or None if the
+                points never time out
+        """
+        SMSLOG.info('Create for port %s', port)
+        self.path = shared_memory_path(port)
+        codenames_json = json.dumps(codenames).encode('utf-8')
+        codenames_json += b' ' * (-len(codenames_json) % 8)
+        self._points_offset = SHM_CODENAMES_OFFSET + len(codenames_json)
+        if timeouts is None:
+            timeouts = [None] * len(codenames)
+        self._timeouts = [float('nan') if timeout is None else float(timeout)
+                          for timeout in timeouts]
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+        # Create the file under a temporary name and move it in place when it is
+        # initialized, so that readers never see a partial header
+        size = self._points_offset + SHM_POINT.size * len(codenames)
+        temporary_path = '{}.{}'.format(self.path, os.getpid())
+        try:
+            with open(temporary_path, 'w+b') as file_:
+                file_.write(b'\x00' * size)
+                file_.flush()
+                self._mmap = mmap.mmap(file_.fileno(), size)
+        except (EnvironmentError, ValueError):
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+        SHM_HEADER.pack_into(self._mmap, 0, SHM_MAGIC, SHM_VERSION, len(codenames),
+                             len(codenames_json))
+        self._mmap[SHM_CODENAMES_OFFSET:self._points_offset] = codenames_json
+        os.rename(temporary_path, self.path)
+
+    def _pack_point(self, position, point, timestamp):
+        """Packs a point into the segment, without taking the seqlock"""
+        offset = self._points_offset + position * SHM_POINT.size
+        timeout = self._timeouts[position]
+        try:
+            if isinstance(point[1], six.string_types):
+                raise ValueError('strings are not numeric')
+            SHM_POINT.pack_into(self._mmap, offset, 0, float(point[0]), float(point[1]),
+                                float(timestamp), timeout)
+        except (TypeError, ValueError, IndexError):
+            SHM_POINT.pack_into(self._mmap, offset, BINARY_FLAG_NOT_NUMERIC,
+                                NAN_POINT[0], NAN_POINT[1], float(timestamp), timeout)
+
+    def _set_sequence(self):
+        """Increments and writes the sequence number"""
+        self._sequence += 1
+        SHM_SEQUENCE.pack_into(self._mmap, SHM_SEQUENCE_OFFSET, self._sequence)
+
+    def write(self, position, point, timestamp):
+        """Writes a point
+
+        Args:
+            position (int): The position of the codename
+            point (tuple): The point
+            timestamp (float): The time to evaluate if the point is too old from
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._set_sequence()
+            self._pack_point(position, point, timestamp)
+            self._set_sequence()
+
+    def write_all(self, points, timestamps):
+        """Writes all the points
+
+        Args:
+            points (sequence): The points in codenames order
+            timestamps (sequence): The timestamps in codenames order
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._set_sequence()
+            for position, (point, timestamp) in enumerate(zip(points, timestamps)):
+                self._pack_point(position, point, timestamp)
+            self._set_sequence()
+
+    def close(self):
+        """Closes and removes the segment"""
+        SMSLOG.info('Close %s', self.path)
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._mmap.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            SMSLOG.warning('Unable to remove %s', self.path)
+
+
+def shared_memory_path(port):
+    """Returns the path of the shared memory segment for the socket server on port
+
+    Args:
+        port (int): The port of the socket server
+
+    Returns:
+        str: The path
+    """
+    return os.path.join(SHARED_MEMORY_DIR, SHARED_MEMORY_NAME.format(port))
+
+
+PSSLOG = logging.getLogger(__name__ + '.PullSocketState')
+PSSLOG.addHandler(logging.NullHandler())
+
+
+class PullSocketState(Mapping):
+    """The state of a pull socket server
+
+    The points are kept in a list in codenames order, along with a precomputed index
+    from codename to position, and all updates and reads of the points happen under a
+    lock, so a request always sees a consistent snapshot. For :data:`.DATA`
+    compatibility, the state can also be read (but not written to) as a dict with
+    the keys shown in the :data:`.DATA` documentation. The ``'data'``, ``'timeouts'``
+    and ``'timestamps'`` values are built from the state on each access, so they
+    should not be used in performance critical code.
+
+    The timestamps are the times used to evaluate whether the points are too old,
+    i.e. the x values for date data.
+    """
+
+    __slots__ = ('name', 'type', 'codenames', 'index', 'points', 'timestamps',
+                 'timeouts', 'cache', 'subscriptions', 'history', 'activity', 'metrics',
+                 'shared_memory', '_lock')
+
+    def __init__(self, name, codenames, default_point, timeouts, activity, history_size):
+        """Initialize the state
+
+        Args:
+            name (str): The name of the socket server
+            codenames (list): The codenames
+            default_point (tuple): The point all the codenames are initialized with
+            timeouts (list or None): The timeouts in codenames order, or None if the
+                points never time out
+            activity (dict): The activity dict
+            history_size (int): The size of the :class:`.HistoryBuffer` for each
+                codename or None for no history
+        """
+        PSSLOG.debug('Initialize for %s', name)
+        self.name = name
+        self.type = None
+        self.codenames = list(codenames)
+        self.index = {codename: position for position, codename in enumerate(codenames)}
+        self.points = [default_point] * len(codenames)
+        self.timestamps = [default_point[0]] * len(codenames)
+        self.timeouts = timeouts
+        self.cache = ResponseCache()
+        self.subscriptions = {}
+        if history_size is None:
+            self.history = None
         else:
-            message = 'Checking for timeout is not yet implemented for type '\
-                '\'{}\''.format(DATA[self.port]['type'])
-            PULLUHLOG.error(message)
-            raise NotImplementedError(message)
+            self.history = {codename: HistoryBuffer(history_size) for codename in codenames}
+        self.activity = activity
+        self.metrics = SocketMetrics()
+        self.shared_memory = None
+        self._lock = threading.Lock()
+
+    def set_point(self, codename, point, timestamp):
+        """Sets the point for codename
 
+        Args:
+            codename (str): The codename
+            point (tuple): The point
+            timestamp (float): The time to evaluate if the point is too old from
+        """
+        position = self.index[codename]
+        with self._lock:
+            self.points[position] = point
+            self.timestamps[position] = timestamp
+            if self.shared_memory is not None:
+                self.shared_memory.write(position, point, timestamp)
+        self.cache.invalidate()
+        if self.history is not None:
+            self.history[codename].append(timestamp, *point)
+
+    def write_shared_memory(self):
+        """Writes all the points to the :class:`.SharedMemorySegment`, if there is one"""
+        with self._lock:
+            if self.shared_memory is not None:
+                self.shared_memory.write_all(self.points, self.timestamps)
+
+    def snapshot(self):
+        """Returns a consistent copy of the points and timestamps
+
+        Returns:
+            tuple: (points, timestamps) where both are tuples in codenames order
+        """
+        with self._lock:
+            return tuple(self.points), tuple(self.timestamps)
+
+    def view(self):
+        """Returns a consistent copy of the points and timestamps and the time it was
+        taken
+
+        Returns:
+            tuple: (points, timestamps, now) where points and timestamps are as returned
+                by :meth:`snapshot` and now is the unix time used to evaluate whether the
+                points are too old
+        """
+        points, timestamps = self.snapshot()
+        return points, timestamps, time.time()
+
+    def current_points(self, codenames, view=None):
+        """Returns the points for codenames, with the points that are too old replaced
+        by :data:`.OLD_DATA`
+
+        All the points are taken from the same consistent snapshot.
+
+        Args:
+            codenames (list): The codenames of the points to return, in order
+            view (tuple): A view returned by :meth:`view` to take the points from, or
+                None to take a new one
+
+        Returns:
+            list: The points (or :data:`.OLD_DATA`) in codenames order
+        """
+        positions = [self.index[codename] for codename in codenames]
+        points, timestamps, now = self.view() if view is None else view
+        timeouts = self.timeouts
+        if timeouts is None:
+            return [points[position] for position in positions]
+
+        out = []
+        for position in positions:
+            timeout = timeouts[position]
+            if timeout is not None and now - timestamps[position] > timeout:
+                out.append(OLD_DATA)
+            else:
+                out.append(points[position])
         return out
 
+    def _keys(self):
+        """Returns the keys of the dict view"""
+        keys = ['activity', 'cache', 'codenames', 'data', 'history', 'metrics', 'name',
+                'subscriptions']
+        if self.timeouts is not None:
+            keys.append('timeouts')
+        if self.type is not None:
+            keys.append('type')
+        if self.type == 'data':
+            keys.append('timestamps')
+        return keys
+
+    def __getitem__(self, key):
+        if key not in self._keys():
+            raise KeyError(key)
+        if key == 'data':
+            return dict(zip(self.codenames, self.snapshot()[0]))
+        if key == 'timeouts':
+            return dict(zip(self.codenames, self.timeouts))
+        if key == 'timestamps':
+            return dict(zip(self.codenames, self.snapshot()[1]))
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(self._keys())
+
+    def __len__(self):
+        return len(self._keys())
+
 
 CDPULLSLOG = logging.getLogger(__name__ + '.CommonDataPullSocket')
 CDPULLSLOG.addHandler(logging.NullHandler())
@@ -316,14 +1229,15 @@ class CommonDataPullSocket(threading.Thread):
      * Initializing the thread
      * Checking the inputs
      * Starting the socket server with the correct handler
-     * Initializing DATA with common attributes
+     * Initializing the :class:`.PullSocketState` in DATA
     """
 
     # pylint: disable=too-many-branches
     def __init__(self, name, codenames, port, default_x, default_y, timeouts,
                  check_activity, activity_timeout, init_timeouts=True,
-                 handler_class=PullUDPHandler):
-        """Initializes internal variables and data structure in the
+                 handler_class=PullUDPHandler, engine=None, history_size=None,
+                 shared_memory=False, tcp_port=None):
+        """Initializes internal variables and the :class:`.PullSocketState` in the
         :data:`.DATA` module variable
 
         Args:
@@ -352,6 +1266,17 @@ class CommonDataPullSocket(threading.Thread):
                 socket servers.
             activity_timeout (float or int): The timespan in seconds which
                 constitutes in-activity
+            engine (AsyncioSocketEngine): If given, the UDP server will be served by
+                this :class:`.AsyncioSocketEngine` instead of by a
+                :py:class:`SocketServer.UDPServer` in this thread
+            history_size (int): If given, the last ``history_size`` points for each
+                codename are kept in a :class:`.HistoryBuffer`, so they can be
+                retrieved with the ``history_json`` command. Requires numpy.
+            shared_memory (bool): Whether to also publish the points in a
+                :class:`.SharedMemorySegment` for readers on the same host
+            tcp_port (int): If given, the commands are also served over TCP on this
+                port, with the :class:`.PullTCPHandler`. The TCP listener is always
+                served by threads, also if an ``engine`` is given.
         """
         CDPULLSLOG.info('Initialize with: %s', call_spec_string())
         # Init thread
@@ -376,42 +1301,44 @@ class CommonDataPullSocket(threading.Thread):
         else:
             # If only a single value is given turn it into a list
             timeouts = [timeouts] * len(codenames)
+        if history_size is not None and numpy is None:
+            message = 'numpy is required to keep a history'
+            CDPULLSLOG.error(message)
+            raise ValueError(message)
 
-        # Prepare DATA
-        DATA[port] = {
-            'codenames': list(codenames),
-            'data': {},
-            'name': name,
-            'activity': {
-                'check_activity': check_activity,
-                'activity_timeout': activity_timeout,
-                'last_activity': time.time()
-            }
-        }
-        if init_timeouts:
-            DATA[port]['timeouts'] = {}
-        for name, timeout in zip(codenames, timeouts):
+        for codename in codenames:
             # Check for duplicates
-            if codenames.count(name) > 1:
+            if codenames.count(codename) > 1:
                 message = 'Codenames must be unique; \'{}\' is present more '\
-                    'than once'.format(name)
+                    'than once'.format(codename)
                 CDPULLSLOG.error(message)
                 raise ValueError(message)
             # Check for bad characters in the name
             for char in BAD_CHARS:
-                if char in name:
+                if char in codename:
                     message = 'The character \'{}\' is not allowed in the '\
                         'codenames'.format(char)
                     CDPULLSLOG.error(message)
                     raise ValueError(message)
-            # Init the point
-            DATA[port]['data'][name] = (default_x, default_y)
-            if init_timeouts:
-                DATA[port]['timeouts'][name] = timeout
+
+        # Prepare DATA
+        activity = {
+            'check_activity': check_activity,
+            'activity_timeout': activity_timeout,
+            'last_activity': time.time()
+        }
+        self.state = PullSocketState(
+            name, codenames, (default_x, default_y),
+            timeouts if init_timeouts else None, activity, history_size,
+        )
+        DATA[port] = self.state
 
         # Setup server
         try:
-            self.server = SocketServer.UDPServer(('', port), handler_class)
+            if engine is None:
+                self.server = SocketServer.UDPServer(('', port), handler_class)
+            else:
+                self.server = engine.udp_server(('', port), handler_class)
         except socket.error as error:
             if error.errno == 98:
                 # See custom exception message to understand this
@@ -419,11 +1346,44 @@ class CommonDataPullSocket(threading.Thread):
                 raise PortStillReserved()
             else:
                 raise error
+
+        self.tcp_server = None
+        if tcp_port is not None:
+            try:
+                self.tcp_server = SocketServer.ThreadingTCPServer(('', tcp_port),
+                                                                  PullTCPHandler)
+            except socket.error:
+                self.server.server_close()
+                del DATA[port]
+                raise
+            self.tcp_server.daemon_threads = True
+            # The TCP handler finds the state from the port of the UDP server
+            self.tcp_server.data_port = port
+
+        if shared_memory:
+            try:
+                self.state.shared_memory = SharedMemorySegment(port, codenames,
+                                                               self.state.timeouts)
+            except (EnvironmentError, ValueError):
+                self.server.server_close()
+                if self.tcp_server is not None:
+                    self.tcp_server.server_close()
+                del DATA[port]
+                raise
+            self.state.write_shared_memory()
         CDPULLSLOG.debug('Initialized')
 
     def run(self):
-        """Starts the UPD socket server"""
+        """Starts the UPD socket server
+
+        .. note:: If the socket server is served by an :class:`.AsyncioSocketEngine`, this
+            method returns as soon as the server is registered with the engine
+        """
         CDPULLSLOG.info('Run')
+        if self.tcp_server is not None:
+            tcp_thread = threading.Thread(target=self.tcp_server.serve_forever)
+            tcp_thread.daemon = True
+            tcp_thread.start()
         self.server.serve_forever()
         CDPULLSLOG.info('Run ended')
 
@@ -435,9 +1395,14 @@ class CommonDataPullSocket(threading.Thread):
         """
         CDPULLSLOG.debug('Stop requested')
         self.server.shutdown()
+        if self.tcp_server is not None:
+            self.tcp_server.shutdown()
+            self.tcp_server.server_close()
         # Wait 0.1 sec to prevent the interpreter from destroying the
         # environment before we are done if this is the last thread
         time.sleep(0.1)
+        if self.state.shared_memory is not None:
+            self.state.shared_memory.close()
         # Delete the data, to allow forming another socket on this port
         #print(DATA)
         del DATA[self.port]
@@ -446,8 +1411,38 @@ class CommonDataPullSocket(threading.Thread):
 
     def poke(self):
         """Pokes the socket server to let it know that there is activity"""
-        if DATA[self.port]['activity']['check_activity']:
-            DATA[self.port]['activity']['last_activity'] = time.time()
+        if self.state.activity['check_activity']:
+            self.state.activity['last_activity'] = time.time()
+
+    def _stream(self, codename, point):
+        """Sends a newly set point to the subscribed clients
+
+        Expired subscriptions are removed.
+
+        Args:
+            codename (str): The codename of the point
+            point (tuple): The point
+        """
+        subscriptions = self.state.subscriptions
+        if not subscriptions:
+            return
+        now = time.time()
+        message = None
+        # Iterate over a copy, since the request handler may add subscriptions
+        for address, (expires, codenames) in list(subscriptions.items()):
+            if expires < now:
+                CDPULLSLOG.debug('Subscription for %s expired', address)
+                subscriptions.pop(address, None)
+                continue
+            if codenames is not None and codename not in codenames:
+                continue
+            if message is None:
+                message = '{}#{}'.format(STREAM, dumps({codename: point}))
+                message = message.encode('ascii')
+            try:
+                self.server.socket.sendto(message, address)
+            except socket.error as error:
+                CDPULLSLOG.warning('Unable to stream to %s: %s', address, error)
 
 
 DPULLSLOG = logging.getLogger(__name__ + '.DataPullSocket')
@@ -461,12 +1456,15 @@ class DataPullSocket(CommonDataPullSocket):
 
     def __init__(self, name, codenames, port=9010, default_x=0.0,
                  default_y=0.0, timeouts=None, check_activity=True,
-                 activity_timeout=900, poke_on_set=True):
+                 activity_timeout=900, poke_on_set=True, engine=None,
+                 history_size=None, shared_memory=False, tcp_port=None):
         """Initializes internal variables and UPD server
 
         For parameter description of ``name``, ``codenames``, ``port``,
-        ``default_x``, ``default_y``, ``timeouts``, ``check_activity`` and
-        ``activity_timeout`` see :meth:`.CommonDataPullSocket.__init__`.
+        ``default_x``, ``default_y``, ``timeouts``, ``check_activity``,
+        ``activity_timeout``, ``engine``, ``history_size``, ``shared_memory`` and
+        ``tcp_port`` see
+        :meth:`.CommonDataPullSocket.__init__`.
 
         Args:
             poke_on_set (bool): Whether to poke the socket server when a point
@@ -477,13 +1475,14 @@ class DataPullSocket(CommonDataPullSocket):
         super(DataPullSocket, self).__init__(
             name, codenames, port=port, default_x=default_x,
             default_y=default_y, timeouts=timeouts,
-            check_activity=check_activity, activity_timeout=activity_timeout
+            check_activity=check_activity, activity_timeout=activity_timeout,
+            engine=engine, history_size=history_size, shared_memory=shared_memory,
+            tcp_port=tcp_port,
         )
-        DATA[port]['type'] = 'data'
+        self.state.type = 'data'
         # Init timestamps
-        DATA[port]['timestamps'] = {}
-        for name in codenames:
-            DATA[port]['timestamps'][name] = 0.0
+        self.state.timestamps = [0.0] * len(codenames)
+        self.state.write_shared_memory()
         DPULLSLOG.debug('Initialized')
         # Init poke_on_set
         self.poke_on_set = poke_on_set
@@ -501,13 +1500,14 @@ class DataPullSocket(CommonDataPullSocket):
                 value is used to evaluate if the point is new enough if
                 timeouts are set.
         """
-        DATA[self.port]['data'][codename] = tuple(point)
+        point = tuple(point)
         if timestamp is None:
             timestamp = time.time()
-        DATA[self.port]['timestamps'][codename] = timestamp
-        DPULLSLOG.debug('Point %s for \'%s\' set', tuple(point), codename)
+        self.state.set_point(codename, point, timestamp)
+        DPULLSLOG.debug('Point %s for \'%s\' set', point, codename)
+        self._stream(codename, point)
         # Poke if required
-        if DATA[self.port]['activity']['check_activity'] and self.poke_on_set:
+        if self.state.activity['check_activity'] and self.poke_on_set:
             self.poke()
 
 
@@ -523,12 +1523,15 @@ class DateDataPullSocket(CommonDataPullSocket):
 
     def __init__(self, name, codenames, port=9000, default_x=0.0,
                  default_y=0.0, timeouts=None, check_activity=True,
-                 activity_timeout=900, poke_on_set=True):
+                 activity_timeout=900, poke_on_set=True, engine=None,
+                 history_size=None, shared_memory=False, tcp_port=None):
         """Init internal variavles and UPD server
 
         For parameter description of ``name``, ``codenames``, ``port``,
-        ``default_x``, ``default_y``, ``timeouts``, ``check_activity`` and
-        ``activity_timeout`` see :meth:`.CommonDataPullSocket.__init__`.
+        ``default_x``, ``default_y``, ``timeouts``, ``check_activity``,
+        ``activity_timeout``, ``engine``, ``history_size``, ``shared_memory`` and
+        ``tcp_port`` see
+        :meth:`.CommonDataPullSocket.__init__`.
 
         Args:
             poke_on_set (bool): Whether to poke the socket server when a point
@@ -539,10 +1542,12 @@ class DateDataPullSocket(CommonDataPullSocket):
         super(DateDataPullSocket, self).__init__(
             name, codenames, port=port, default_x=default_x,
             default_y=default_y, timeouts=timeouts,
-            check_activity=check_activity, activity_timeout=activity_timeout
+            check_activity=check_activity, activity_timeout=activity_timeout,
+            engine=engine, history_size=history_size, shared_memory=shared_memory,
+            tcp_port=tcp_port,
         )
         # Set the type
-        DATA[port]['type'] = 'date'
+        self.state.type = 'date'
         DDPULLSLOG.debug('Initialized')
         # Init poke_on_set
         self.poke_on_set = poke_on_set
@@ -567,10 +1572,12 @@ class DateDataPullSocket(CommonDataPullSocket):
             point (iterable): Current point as a list (or tuple) of 2 floats:
                 [x, y]
         """
-        DATA[self.port]['data'][codename] = tuple(point)
-        DDPULLSLOG.debug('Point %s for \'%s\' set', tuple(point), codename)
+        point = tuple(point)
+        self.state.set_point(codename, point, point[0])
+        DDPULLSLOG.debug('Point %s for \'%s\' set', point, codename)
+        self._stream(codename, point)
         # Poke if required
-        if DATA[self.port]['activity']['check_activity'] and self.poke_on_set:
+        if self.state.activity['check_activity'] and self.poke_on_set:
             self.poke()
 
 
@@ -600,13 +1607,38 @@ class PushUDPHandler(SocketServer.BaseRequestHandler):
            there is more than one, they will be put in a list. An example of a
            complete raw_wn string could look like:\n
            ``'raw_wn#greeting:str:Live long and prosper;numbers:int:47,42'``
+         * **msgpack_wn#data** (*str*): MessagePack with names. The same as
+           ``json_wn``, except that the data (everything after the first ``#``) is a
+           dict encoded as MessagePack (see :mod:`PyExpLabSys.common.serialization`)
+         * **batch_json#data** (*str*): A batch of data sets. The data should be a
+           JSON encoded list of ``[timestamp, dict]`` entries, where the dicts are the
+           same as for ``json_wn`` and the timestamp may be null, for the time the
+           batch is received. The data sets are handled in order as if they had been
+           sent one by one (if the socket server is ``timestamped``, each data set is
+           enqueued or called back with the timestamp of its entry), and the reply
+           is :data:`.PUSH_ACK` followed by a json encoded list with a reply for each
+           data set. A complete command could look like:\n
+           ``'batch_json#[[1414150015.6, {"setpoint": 1.0}], [null, {"setpoint": 2.0}]]'``
          * **name** (*str*): Return the name of the PushSocket server
          * **status** (*str*): Return the system status and status for all
            socket servers.
+         * **metrics** (*str*): Return the request metrics for this socket server (see
+           :meth:`.SocketMetrics.as_dict`) encoded as :py:mod:`json`. The return value
+           is prefixed with :data:`.PUSH_RET` and '#'
          * **commands** (*str*): Return a json encoded list of commands. The returns value is
            is prefixed with :data:`.PUSH_RET` and '#' so e.g. 'RET#actual_date'
+
+        All commands can be prefixed with a request ID, which is then echoed in front of
+        the reply, e.g. ``'&17&json_wn#{"number": 47}'`` is answered with
+        ``'&17&ACK#{"number": 47}'``. See :func:`.split_request_id`.
         """
-        request = self.request[0].decode('ascii')
+        start = time.time()
+        prefix, request = split_request_id(self.request[0])
+        # The data for msgpack_wn is binary, so only the command can be decoded
+        payload = None
+        if request.startswith(b'msgpack_wn#'):
+            request, payload = request.split(b'#', 1)
+        request = request.decode('ascii')
         PUSHUHLOG.debug('Request \'%s\'received', request)
         # pylint: disable=attribute-defined-outside-init
         self.port = self.server.server_address[1]
@@ -616,13 +1648,23 @@ class PushUDPHandler(SocketServer.BaseRequestHandler):
         if request == 'name':
             return_value = '{}#{}'.format(PUSH_RET, DATA[self.port]['name'])
         elif request == 'commands':
-            commands = ['json_wn#', 'raw_wn#', 'name', 'status', 'commands']
+            commands = ['json_wn#', 'raw_wn#', 'msgpack_wn#', 'batch_json#', 'name',
+                        'status', 'metrics', 'commands']
             return_value = '{}#{}'.format(PUSH_RET, json.dumps(commands))
+        elif request == 'metrics':
+            return_value = '{}#{}'.format(
+                PUSH_RET, json.dumps(DATA[self.port]['metrics'].as_dict())
+            )
         elif request == 'status':
             return_value = six.text_type(json.dumps({
                 'system_status': SYSTEM_STATUS.complete_status(),
                 'socket_server_status': socket_server_status()
             }))
+        elif payload is not None:
+            try:
+                return_value = self._msgpack_with_names(payload)
+            except ValueError as exception:
+                return_value = '{}#{}'.format(PUSH_ERROR, str(exception))
         elif request.count('#') != 1:
             return_value = '{}#{}'.format(PUSH_ERROR, UNKNOWN_COMMAND)
         else:
@@ -631,6 +1673,8 @@ class PushUDPHandler(SocketServer.BaseRequestHandler):
             try:
                 if command == 'json_wn':
                     return_value = self._json_with_names(data)
+                elif command == 'batch_json':
+                    return_value = self._batch_json(data)
                 elif command == 'raw_wn':
                     return_value = self._raw_with_names(data)
                 else:
@@ -641,7 +1685,15 @@ class PushUDPHandler(SocketServer.BaseRequestHandler):
                 return_value = '{}#{}'.format(PUSH_ERROR, str(exception))
 
         PUSHUHLOG.debug('Send back: %s', return_value)
-        sock.sendto(return_value.encode('ascii'), self.client_address)
+        data = prefix + return_value.encode('ascii')
+        sock.sendto(data, self.client_address)
+
+        # The socket server may be stopped, while the request is handled
+        metrics = DATA.get(self.port, {}).get('metrics')
+        if metrics is not None:
+            error = return_value.startswith((PUSH_ERROR + '#', PUSH_EXCEP + '#'))
+            metrics.record(request.split('#')[0], len(self.request[0]), len(data),
+                           time.time() - start, error)
 
     def _raw_with_names(self, data):
         """Adds raw data to the queue"""
@@ -690,7 +1742,7 @@ class PushUDPHandler(SocketServer.BaseRequestHandler):
         """Adds json encoded data to the data queue"""
         PUSHUHLOG.debug('Parse json with names: %s', data)
         try:
-            data_dict = json.loads(data)
+            data_dict = loads(data)
         except ValueError:
             message = 'The string \'{}\' could not be decoded as JSON'.\
                 format(data)
@@ -706,10 +1758,96 @@ class PushUDPHandler(SocketServer.BaseRequestHandler):
         # Set data and return ACK message
         return self._set_data(data_dict)
 
+    def _msgpack_with_names(self, data):
+        """Adds MessagePack encoded data to the data queue"""
+        PUSHUHLOG.debug('Parse MessagePack with names of %s bytes', len(data))
+        try:
+            data_dict = unpackb(data)
+        except ValueError:
+            message = 'The data could not be decoded as MessagePack'
+            PUSHUHLOG.error(message)
+            raise ValueError(message)
+        if not isinstance(data_dict, dict):
+            message = 'The object \'{}\' returned after decoding the MessagePack '\
+                'data is not a dict'.format(data_dict)
+            PUSHUHLOG.error(message)
+            raise ValueError(message)
+
+        return self._set_data(data_dict)
+
+    def _batch_json(self, data):
+        """Adds a json encoded batch of timestamped data sets to the data queue"""
+        PUSHUHLOG.debug('Parse json batch: %.100s', data)
+        try:
+            entries = loads(data)
+        except ValueError:
+            message = 'The string \'{:.100}\' could not be decoded as JSON'.format(data)
+            PUSHUHLOG.error(message)
+            raise ValueError(message)
+        # Check that it is a non-empty list of [timestamp, dict] entries
+        if not isinstance(entries, list) or not entries:
+            message = 'The batch must be a non-empty list'
+            PUSHUHLOG.error(message)
+            raise ValueError(message)
+        for entry in entries:
+            if not (isinstance(entry, list) and len(entry) == 2 and
+                    isinstance(entry[1], dict) and
+                    (entry[0] is None or (isinstance(entry[0], (int, float)) and
+                                          not isinstance(entry[0], bool)))):
+                message = 'The batch entry \'{:.100}\' is not on the form '\
+                    '[timestamp, dict]'.format(str(entry))
+                PUSHUHLOG.error(message)
+                raise ValueError(message)
+
+        return self._set_batch(entries)
+
+    def _set_batch(self, entries):
+        """Sets a batch of data sets in 'last' and 'updated' and enqueue and/or make
+        callback calls for each of them, if the action requires it
+
+        'last', 'updated' and their times are updated once, for the whole batch, as if
+        the data sets had been set one by one. Entries without a timestamp get the
+        time the batch was received. The timestamp is passed on to the queue or the
+        callback along with the data set, if the socket server is timestamped.
+
+        Args:
+            entries (list): List of [timestamp, data] entries, where data is a dict
+
+        Returns:
+            (str): The request return value, which is :data:`.PUSH_ACK` followed by a
+                json encoded list with a reply for each entry. The reply is the same as
+                for a single data set, except that the data is not repeated in an ACK,
+                e.g. ``'ACK#["ACK", "ACK#DROPPED:1", "ERROR#The queue is full..."]'``
+        """
+        PUSHUHLOG.debug('Set batch of %s data sets', len(entries))
+        now = time.time()
+        port_data = DATA[self.port]
+        updated = port_data['updated']
+        replies = []
+        for timestamp, data in entries:
+            updated.update(data)
+            out, dropped = self._dispatch(data, now if timestamp is None else timestamp)
+            if out is None:
+                out = PUSH_ACK
+                if dropped:
+                    out += '#{}:{}'.format(PUSH_DROPPED, dropped)
+            replies.append(out)
+
+        last_time = now if entries[-1][0] is None else entries[-1][0]
+        port_data['last'] = entries[-1][1]
+        port_data['last_time'] = last_time
+        port_data['updated_time'] = last_time
+        return '{}#{}'.format(PUSH_ACK, dumps(replies))
+
     def _set_data(self, data):
         """Sets the data in 'last' and 'updated' and enqueue and/or make
         callback call if the action requires it
 
+        If the queue is a bounded :class:`.PushQueue` and data had to be dropped to
+        enqueue this data, the ACK message is suffixed with e.g. ``'#DROPPED:2'`` (see
+        :data:`.PUSH_DROPPED`) and if the data could not be enqueued, an error is
+        returned.
+
         Args:
             data (dict): The data set to set/enqueue/callback
 
@@ -723,37 +1861,67 @@ class PushUDPHandler(SocketServer.BaseRequestHandler):
         DATA[self.port]['updated'].update(data)
         DATA[self.port]['updated_time'] = timestamp
 
+        out, dropped = self._dispatch(data, timestamp)
+        if out is None:
+            # Return the ACK message with the interpreted data
+            out = '{}#{}'.format(PUSH_ACK, data)
+            if dropped:
+                out += '#{}:{}'.format(PUSH_DROPPED, dropped)
+        return out
+
+    def _dispatch(self, data, timestamp):
+        """Enqueue data and/or make the callback call if the action requires it
+
+        If the socket server is timestamped, the data set is enqueued/called back as a
+        ``(timestamp, data)`` tuple.
+
+        Args:
+            data (dict): The data set to enqueue/callback
+            timestamp (float): The time of the data set
+
+        Returns:
+            tuple: The request return value, or None if the data should just be
+                acknowledged, and the number of data sets dropped from the queue
+        """
+        if DATA[self.port].get('timestamped'):
+            data = (timestamp, data)
         # Put the data in queue for actions that require that
+        dropped = 0
         if DATA[self.port]['action'] in ['enqueue', 'callback_async']:
-            DATA[self.port]['queue'].put(data)
+            queue = DATA[self.port]['queue']
+            if isinstance(queue, PushQueue):
+                try:
+                    dropped = queue.put_data(data)
+                except Queue.Full:
+                    return '{}#The queue is full, the data was not enqueued'.format(
+                        PUSH_ERROR), 0
+            else:
+                queue.put(data)
 
         # Execute the callback for actions that require that. Notice, the
         # different branches determines which output format gets send back
         # ACKnowledge or RETurn (value on callback)
-        if DATA[self.port]['action'] == 'callback_direct':
-            try:
-                # Call the callback
-                return_value = DATA[self.port]['callback'](data)
-                # Format the return value depending on return_format
-                if DATA[self.port]['return_format'] == 'json':
-                    out = self._format_return_json(return_value)
-                elif DATA[self.port]['return_format'] == 'raw':
-                    out = self._format_return_raw(return_value)
-                elif DATA[self.port]['return_format'] == 'string':
-                    out = self._format_return_string(return_value)
-                else:
-                    # The return format values should be checked on
-                    # instantiation
-                    message = 'Bad return format. REPORT AS BUG.'
-                    out = '{}#{}'.format(PUSH_ERROR, message)
-            # pylint: disable=broad-except
-            except Exception as exception:  # Catch anything it might raise
-                out = '{}#{}'.format(PUSH_EXCEP, str(exception))
-        else:
-            # Return the ACK message with the interpreted data
-            out = '{}#{}'.format(PUSH_ACK, data)
-
-        return out
+        if DATA[self.port]['action'] != 'callback_direct':
+            return None, dropped
+        try:
+            # Call the callback
+            return_value = DATA[self.port]['callback'](data)
+            # Format the return value depending on return_format
+            if DATA[self.port]['return_format'] == 'json':
+                out = self._format_return_json(return_value)
+            elif DATA[self.port]['return_format'] == 'raw':
+                out = self._format_return_raw(return_value)
+            elif DATA[self.port]['return_format'] == 'string':
+                out = self._format_return_string(return_value)
+            else:
+                # The return format values should be checked on
+                # instantiation
+                message = 'Bad return format. REPORT AS BUG.'
+                out = '{}#{}'.format(PUSH_ERROR, message)
+        # pylint: disable=broad-except
+        except Exception as exception:  # Catch anything it might raise
+            out = '{}#{}'.format(PUSH_EXCEP, str(exception))
+        return out, dropped
 
     @staticmethod
     def _format_return_json(value):
@@ -946,7 +2114,8 @@ class DataPushSocket(threading.Thread):
     # pylint: disable=too-many-branches
     def __init__(self, name, port=8500, action='store_last', queue=None,
                  callback=None, return_format='json', check_activity=False,
-                 activity_timeout=900):
+                 activity_timeout=900, engine=None, queue_size=0, overflow='nak',
+                 executor=None, timestamped=False):
         """Initializes the DataPushSocket
 
         Arguments:
@@ -1003,6 +2172,32 @@ class DataPushSocket(threading.Thread):
                    call back returns will be sent back. NOTE: These string
                    representations may differ between Python 2 and 3, so do not parse
                    them
+            check_activity (bool): Whether the socket server should monitor activity
+            activity_timeout (float or int): The timespan in seconds which constitutes
+                in-activity
+            engine (AsyncioSocketEngine): If given, the UDP server will be served by this
+                :class:`.AsyncioSocketEngine` instead of by a
+                :py:class:`SocketServer.UDPServer` in this thread
+            queue_size (int): If larger than 0, the queue used with the ``'enqueue'``
+                (when ``queue`` is not given) and ``'callback_async'`` actions is a
+                :class:`.PushQueue` bounded to this size, instead of an unbounded
+                :py:class:`Queue.Queue`
+            overflow (str): What to do when the bounded queue is full. One of
+                :data:`.QUEUE_OVERFLOW_POLICIES`, see :class:`.PushQueue`. With an
+                ``engine``, ``'nak'`` rejects data sets right away instead of waiting
+                for room in the queue.
+            executor (callable): Used with the ``'callback_async'`` action to create the
+                object that calls the callback with the queued data. It is called
+                with the queue and the callback as arguments and must return an
+                object with ``start`` and ``stop`` methods. The default is
+                :class:`.CallBackThread`, which calls back one data set at a time. To
+                call back in parallel use e.g.
+                ``functools.partial(CallBackPool, workers=4)``, see
+                :class:`.CallBackPool`
+            timestamped (bool): If True, the data sets are enqueued and called back as
+                ``(timestamp, data)`` tuples, where the timestamp is the one given for
+                the entry in a ``batch_json`` command or otherwise the time the data
+                set was received
 
         """
         DPUSHSLOG.info('Initialize with: %s', call_spec_string())
@@ -1034,12 +2229,28 @@ class DataPushSocket(threading.Thread):
             message = 'The \'return_format\' argument may only be one of the '\
                 '\'json\', \'raw\' or \'string\' values'
             raise ValueError(message)
+        if queue_size > 0 and (queue is not None or
+                               action not in ['enqueue', 'callback_async']):
+            message = 'The \'queue_size\' argument can only be used when the action '\
+                'is \'enqueue\' (without a custom queue) or \'callback_async\''
+            raise ValueError(message)
+        if overflow not in QUEUE_OVERFLOW_POLICIES:
+            message = 'The \'overflow\' argument must be one of: {}'.format(
+                QUEUE_OVERFLOW_POLICIES)
+            raise ValueError(message)
+        if executor is not None and action != 'callback_async':
+            message = 'The \'executor\' argument can only be used when the action is '\
+                '\'callback_async\''
+            raise ValueError(message)
 
-        # Set callback and queue depending on action
+        # Set callback and queue depending on action. Under the engine, waiting for room
+        # in a full queue would block every socket server on the event loop
         self._callback_thread = None
+        put_timeout = QUEUE_PUT_TIMEOUT if engine is None else 0
         content = {
             'action': action, 'last': None, 'type': 'push', 'updated': {},
             'last_time': None, 'updated_time': None, 'name': name,
+            'metrics': SocketMetrics(), 'timestamped': timestamped,
             'activity': {
                 'check_activity': check_activity,
                 'activity_timeout': activity_timeout,
@@ -1049,13 +2260,20 @@ class DataPushSocket(threading.Thread):
         if action == 'store_last':
             pass
         elif action == 'enqueue':
-            if queue is None:
-                content['queue'] = Queue.Queue()
-            else:
+            if queue is not None:
                 content['queue'] = queue
+            elif queue_size > 0:
+                content['queue'] = PushQueue(queue_size, overflow, put_timeout)
+            else:
+                content['queue'] = Queue.Queue()
         elif action == 'callback_async':
-            content['queue'] = Queue.Queue()
-            self._callback_thread = CallBackThread(content['queue'], callback)
+            if queue_size > 0:
+                content['queue'] = PushQueue(queue_size, overflow, put_timeout)
+            else:
+                content['queue'] = Queue.Queue()
+            if executor is None:
+                executor = CallBackThread
+            self._callback_thread = executor(content['queue'], callback)
         elif action == 'callback_direct':
             content['callback'] = callback
             content['return_format'] = return_format
@@ -1066,7 +2284,10 @@ class DataPushSocket(threading.Thread):
 
         # Setup server
         try:
-            self.server = SocketServer.UDPServer(('', port), PushUDPHandler)
+            if engine is None:
+                self.server = SocketServer.UDPServer(('', port), PushUDPHandler)
+            else:
+                self.server = engine.udp_server(('', port), PushUDPHandler)
         except socket.error as error:
             if error.errno == 98:
                 # See custom exception message to understand this
@@ -1080,7 +2301,11 @@ class DataPushSocket(threading.Thread):
         DPUSHSLOG.debug('DPS: Initialized')
 
     def run(self):
-        """Starts the UPD socket server"""
+        """Starts the UPD socket server
+
+        .. note:: If the socket server is served by an :class:`.AsyncioSocketEngine`, this
+            method returns as soon as the server is registered with the engine
+        """
         DPUSHSLOG.info('DPS: Start')
         if self._callback_thread is not None:
             self._callback_thread.start()
@@ -1166,6 +2391,162 @@ class DataPushSocket(threading.Thread):
             DATA[self.port]['activity']['last_activity'] = time.time()
 
 
+def _data_set(item):
+    """Returns the data set of a queued item, which is either the data set or, from
+    a timestamped :class:`.DataPushSocket`, a ``(timestamp, data)`` tuple
+    """
+    return item[1] if isinstance(item, tuple) else item
+
+
+def _replace_data_set(item, data):
+    """Returns item with the data set replaced by data, see :func:`_data_set`"""
+    return (item[0], data) if isinstance(item, tuple) else data
+
+
+PQLOG = logging.getLogger(__name__ + '.PushQueue')
+PQLOG.addHandler(logging.NullHandler())
+class PushQueue(Queue.Queue):
+    """Bounded queue for the data sets received by a :class:`.DataPushSocket`
+
+    When the queue is full, :meth:`put_data` handles the new data set according to
+    the overflow policy, which is one of:
+
+     * ``'nak'``: Block for up to ``put_timeout`` seconds for a free slot and
+       otherwise raise :py:class:`Queue.Full`, in which case the push is answered
+       with an error (NAK)
+     * ``'drop_oldest'``: Drop the oldest data set in the queue
+     * ``'coalesce'``: Remove the values for the codenames in the new data set from
+       the data sets already in the queue, since they are superseded, and drop the
+       data sets that become empty. If the queue is still full, the new data set is
+       merged into the newest one in the queue. Only superseded values are lost.
+
+    The data sets may also be ``(timestamp, data)`` tuples, as put by a timestamped
+    :class:`.DataPushSocket`. A merged data set gets the timestamp of the new one.
+
+    The number of dropped data sets (``'nak'`` and ``'drop_oldest'``) or superseded
+    values (``'coalesce'``) is counted in :attr:`dropped`.
+    """
+
+    def __init__(self, maxsize, overflow='nak', put_timeout=None):
+        """Initialize the queue
+
+        Args:
+            maxsize (int): The maximum number of data sets in the queue
+            overflow (str): The overflow policy, one of :data:`.QUEUE_OVERFLOW_POLICIES`
+            put_timeout (float): The number of seconds to wait for a free slot with the
+                ``'nak'`` policy. Defaults to :data:`.QUEUE_PUT_TIMEOUT`. With 0, the
+                data set is rejected right away, which must be used when the socket
+                server is served by an :class:`.AsyncioSocketEngine`, since waiting
+                would block the event loop.
+        """
+        PQLOG.info('Initialize with: %s', call_spec_string())
+        if overflow not in QUEUE_OVERFLOW_POLICIES:
+            message = 'The \'overflow\' argument must be one of: {}'.format(
+                QUEUE_OVERFLOW_POLICIES)
+            raise ValueError(message)
+        # Queue.Queue is an old style class in Python 2, so super cannot be used
+        Queue.Queue.__init__(self, maxsize)
+        self.overflow = overflow
+        self.put_timeout = QUEUE_PUT_TIMEOUT if put_timeout is None else put_timeout
+        self.dropped = 0
+
+    def put_data(self, data):
+        """Puts a data set in the queue, handling a full queue according to the
+        overflow policy
+
+        Args:
+            data (dict): The data set
+
+        Returns:
+            int: The number of data sets or values dropped to make room for data
+
+        Raises:
+            Queue.Full: If the overflow policy is ``'nak'`` and the queue stays full
+        """
+        if self.overflow == 'nak':
+            try:
+                if self.put_timeout > 0:
+                    self.put(data, True, self.put_timeout)
+                else:
+                    self.put_nowait(data)
+            except Queue.Full:
+                with self.mutex:
+                    self.dropped += 1
+                PQLOG.warning('Queue full, data set not enqueued')
+                raise
+            return 0
+
+        with self.mutex:
+            dropped = 0
+            if self._qsize() >= self.maxsize > 0:
+                if self.overflow == 'drop_oldest':
+                    self._get()
+                    self._remove_tasks(1)
+                    dropped = 1
+                else:
+                    dropped = self._remove_superseded(data)
+                    if self._qsize() >= self.maxsize:
+                        merged = dict(_data_set(self.queue[-1]))
+                        merged.update(_data_set(data))
+                        self.queue[-1] = _replace_data_set(data, merged)
+                        self.dropped += dropped
+                        return dropped
+            self._put(data)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+            self.dropped += dropped
+        if dropped:
+            PQLOG.debug('Dropped %s to enqueue data set', dropped)
+        return dropped
+
+    def _remove_superseded(self, data):
+        """Removes the values for the codenames in data from the queued data sets and
+        removes the data sets that become empty. Must be called with the mutex held.
+
+        Args:
+            data (dict or tuple): The new data set
+
+        Returns:
+            int: The number of superseded values removed
+        """
+        new = _data_set(data)
+        superseded = 0
+        remaining = []
+        for item in self.queue:
+            # The queued data sets are also used elsewhere (e.g. as last), so do not
+            # change them in place
+            old = _data_set(item)
+            kept = {codename: value for codename, value in old.items()
+                    if codename not in new}
+            superseded += len(old) - len(kept)
+            if kept:
+                remaining.append(_replace_data_set(item, kept) if len(kept) < len(old)
+                                 else item)
+        self._remove_tasks(len(self.queue) - len(remaining))
+        self.queue.clear()
+        self.queue.extend(remaining)
+        return superseded
+
+    def _remove_tasks(self, count):
+        """Removes count dropped data sets from the unfinished tasks and wakes up the
+        threads in :meth:`join`, like :meth:`task_done`, if there are none left. Must be
+        called with the mutex held.
+        """
+        self.unfinished_tasks -= count
+        if self.unfinished_tasks <= 0:
+            self.all_tasks_done.notify_all()
+
+    def status(self):
+        """Returns the status of the queue
+
+        Returns:
+            dict: With the keys ``size``, ``maxsize``, ``overflow`` and ``dropped``
+        """
+        with self.mutex:
+            return {'size': self._qsize(), 'maxsize': self.maxsize,
+                    'overflow': self.overflow, 'dropped': self.dropped}
+
+
 CBTLOG = logging.getLogger(__name__ + '.CallBackThread')
 CBTLOG.addHandler(logging.NullHandler())
 class CallBackThread(threading.Thread):
@@ -1213,6 +2594,154 @@ class CallBackThread(threading.Thread):
         CBTLOG.info('CBT: Stopped')
 
 
+CBPLOG = logging.getLogger(__name__ + '.CallBackPool')
+CBPLOG.addHandler(logging.NullHandler())
+class CallBackPool(object):
+    """Pool of worker threads that call back with the data sets in a queue
+
+    This is an alternative to :class:`.CallBackThread` for the ``'callback_async'``
+    action of the :class:`.DataPushSocket`, where the data sets are called back in
+    parallel, so that a slow callback for one device does not delay the commands for
+    the others. Use it with :class:`.DataPushSocket` like this::
+
+        executor = functools.partial(CallBackPool, workers=4, coalesce=True)
+        DataPushSocket(name, action='callback_async', callback=callback,
+                       executor=executor)
+
+    With ``ordered`` (the default), the callbacks for data sets that share a codename
+    are never run at the same time and are run in the order the data sets were
+    received. Data sets with no codenames in common are run in parallel.
+
+    With ``coalesce``, values in data sets that are waiting to be called back, are
+    removed when a newer value for the same codename is received, since they are
+    superseded (e.g. a setpoint that is overwritten before it is applied). Data
+    sets that become empty are dropped. The number of removed values is counted in
+    :attr:`coalesced`.
+
+    The data sets may also be ``(timestamp, data)`` tuples, as put by a timestamped
+    :class:`.DataPushSocket`, in which case the codenames are those of ``data``.
+    """
+
+    def __init__(self, queue, callback, workers=4, ordered=True, coalesce=False):
+        """Initialize the pool
+
+        Args:
+            queue (Queue.Queue): The queue with the data sets
+            callback (callable): The callable that will be called with each data set
+            workers (int): The number of worker threads
+            ordered (bool): Whether to call back data sets with codenames in common in
+                order and one at a time
+            coalesce (bool): Whether to remove superseded values from the data sets
+                that are waiting
+        """
+        CBPLOG.info('Initialize with: %s', call_spec_string())
+        if workers < 1:
+            raise ValueError('There must be at least 1 worker')
+        self.queue = queue
+        self.callback = callback
+        self.ordered = ordered
+        self.coalesce = coalesce
+        self.coalesced = 0
+        self._pending = []
+        self._busy = set()
+        self._condition = threading.Condition()
+        self._stop = False
+        self._threads = [threading.Thread(target=self._feed)]
+        self._threads += [threading.Thread(target=self._work) for _ in range(workers)]
+        for thread in self._threads:
+            thread.daemon = True
+
+    def start(self):
+        """Starts the feeder and the worker threads"""
+        CBPLOG.info('Start')
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """Stops the calling back"""
+        CBPLOG.debug('Stop requested')
+        with self._condition:
+            self._stop = True
+            self._condition.notify_all()
+        CBPLOG.info('Stopped')
+
+    def _feed(self):
+        """Moves the data sets from the queue to the pending data sets"""
+        while not self._stop:
+            try:
+                # The get times out every second, to make sure that the thread can be
+                # shut down
+                item = self.queue.get(True, 1)
+            except Queue.Empty:
+                continue
+            with self._condition:
+                if self.coalesce:
+                    self._remove_superseded(item)
+                self._pending.append(item)
+                self._condition.notify_all()
+
+    def _remove_superseded(self, item):
+        """Removes the values for the codenames in item from the pending data sets. Must
+        be called with the condition held.
+
+        Args:
+            item (dict or tuple): The new data set
+        """
+        new = _data_set(item)
+        remaining = []
+        for pending in self._pending:
+            # The data sets are also used elsewhere (e.g. as last), so do not change
+            # them in place
+            old = _data_set(pending)
+            kept = {codename: value for codename, value in old.items()
+                    if codename not in new}
+            self.coalesced += len(old) - len(kept)
+            if kept:
+                remaining.append(_replace_data_set(pending, kept) if len(kept) < len(old)
+                                 else pending)
+        self._pending = remaining
+
+    def _next_index(self):
+        """Returns the index of the next pending data set that can be called back or
+        None. Must be called with the condition held.
+        """
+        if not self.ordered:
+            return 0 if self._pending else None
+        # A data set must wait for running and earlier data sets with common codenames
+        blocked = set(self._busy)
+        for index, item in enumerate(self._pending):
+            codenames = _data_set(item)
+            if blocked.isdisjoint(codenames):
+                return index
+            blocked.update(codenames)
+        return None
+
+    def _work(self):
+        """Calls back with the pending data sets"""
+        while True:
+            with self._condition:
+                index = self._next_index()
+                while index is None and not self._stop:
+                    self._condition.wait()
+                    index = self._next_index()
+                if self._stop:
+                    return
+                item = self._pending.pop(index)
+                if self.ordered:
+                    self._busy.update(_data_set(item))
+
+            try:
+                self.callback(item)
+                CBPLOG.debug('Callback called with arg: %s', item)
+            except Exception:  # pylint: disable=broad-except
+                CBPLOG.exception('Exception in callback with arg: %s', item)
+            finally:
+                if self.ordered:
+                    with self._condition:
+                        self._busy.difference_update(_data_set(item))
+                        self._condition.notify_all()
+
+
 class PortStillReserved(Exception):
     """Custom exception to explain socket server port still reserved even after
     closing the port
@@ -1243,10 +2772,17 @@ class LiveSocket(object):
      2. There is now support for generic xy data. Simply use :meth:`.set_point` or
         :meth:`set_batch` and give it x, y values.
 
+    Per default, every call to one of the set methods sends a datagram to the live
+    server. For programs that set many points in a loop, the points can instead be
+    coalesced and sent at a fixed interval, by giving the ``flush_interval`` argument.
+    In that mode only the newest point for each codename is sent, and the points are
+    split over as many datagrams as necessary to keep each of them below
+    :data:`.LIVE_MAX_DATAGRAM_SIZE`.
+
     """
 
     def __init__(self, name, codenames, live_server=None, no_internal_data_pull_socket=False,
-                 internal_data_pull_socket_port=8000):
+                 internal_data_pull_socket_port=8000, flush_interval=None):
         """Intialize the LiveSocket
 
         Args:
@@ -1260,6 +2796,10 @@ class LiveSocket(object):
                 DataPullSocket. Defaults to False. See note below.
             internal_data_pull_socket_port (int): Port for the internal DataPullSocket.
                 Defaults to 8000. See note below.
+            flush_interval (float): If given, the interval in seconds at which the
+                points are sent to the live server. Points set in between are coalesced,
+                so that only the newest point for each codename is sent. Defaults to
+                None, meaning that points are sent as they are set.
 
         .. note:: In general, any socket should also work as a status socket. But since
             the new design of the live socket, it no longers runs a UDP server, as would
@@ -1270,6 +2810,8 @@ class LiveSocket(object):
 
         """
         LSLOG.info('Init')
+        if flush_interval is not None and flush_interval <= 0:
+            raise ValueError('The flush interval must be positive')
         self.codename_set = set(codenames)
         if live_server is None:
             live_server = (SETTINGS.common_liveserver_host, SETTINGS.common_liveserver_port)
@@ -1292,16 +2834,99 @@ class LiveSocket(object):
                 name, codenames, port=internal_data_pull_socket_port
             )
 
+        # The points waiting to be sent in flush interval mode
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._flush_stop = threading.Event()
+        self._flush_thread = None
+        if flush_interval is not None:
+            self._flush_thread = threading.Thread(target=self._flush_loop)
+            self._flush_thread.daemon = True
+
     def start(self):
-        """Starts the internal DataPullSocket"""
+        """Starts the internal DataPullSocket and the flush thread"""
         if self._internal_pull_socket:
             self._internal_pull_socket.start()
+        if self._flush_thread:
+            self._flush_thread.start()
 
     def stop(self):
-        """Stop the internal DataPullSocket"""
+        """Stop the internal DataPullSocket and the flush thread
+
+        In flush interval mode, the pending points are sent before returning.
+        """
+        if self._flush_thread:
+            self._flush_stop.set()
+            if self._flush_thread.is_alive():
+                self._flush_thread.join()
+            self.flush()
         if self._internal_pull_socket:
             self._internal_pull_socket.stop()
 
+    def _flush_loop(self):
+        """Sends the pending points every flush interval until stopped"""
+        LSLOG.info('Flush loop started with interval %s', self.flush_interval)
+        while not self._flush_stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except socket.error:
+                LSLOG.exception('Error while sending points to the live server')
+        LSLOG.info('Flush loop stopped')
+
+    def flush(self):
+        """Send the pending points to the live server now
+
+        This is only needed in flush interval mode, where it is called every flush
+        interval.
+        """
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        if pending:
+            self._send(pending)
+
+    def _send(self, data):
+        """Send data to the live server, split over as few datagrams as possible
+
+        The datagrams are assembled from the JSON encoded items, to produce the same
+        bytes as ``json.dumps({'host': hostname, 'data': data})``, but split, so that
+        each datagram stays below :data:`.LIVE_MAX_DATAGRAM_SIZE`. An item that on its
+        own exceeds the size is sent alone.
+
+        Args:
+            data (dict): Batch of data, as for :meth:`.set_batch`
+
+        Returns:
+            int: The number of datagrams sent
+        """
+        start = '{{"host": {}, "data": {{'.format(json.dumps(self.hostname))
+        start = start.encode('utf-8')
+        end = b'}}'
+        items = []
+        size = len(start) + len(end)
+        datagrams = 0
+        for key, value in data.items():
+            item = '{}: {}'.format(dumps(key), dumps(value)).encode('utf-8')
+            # 2 is the length of the item separator
+            if items and size + 2 + len(item) > LIVE_MAX_DATAGRAM_SIZE:
+                self._sendto(start + b', '.join(items) + end)
+                datagrams += 1
+                items = []
+                size = len(start) + len(end)
+            size += len(item) + (2 if items else 0)
+            items.append(item)
+        if items:
+            if size > LIVE_MAX_DATAGRAM_SIZE:
+                LSLOG.warning('Sending datagram of size %s, which exceeds %s', size,
+                              LIVE_MAX_DATAGRAM_SIZE)
+            self._sendto(start + b', '.join(items) + end)
+            datagrams += 1
+        return datagrams
+
+    def _sendto(self, datagram):
+        """Send a single datagram to the live server"""
+        self.socket.sendto(datagram, (self.liveserver_ip, self.liveserver_port))
+
     def set_batch(self, data):
         """Set a batch of points now
 
@@ -1314,10 +2939,28 @@ class LiveSocket(object):
 
         .. note:: All data is sent to the live socket proxy and onwards to the web browser
             clients as batches, so if the data is on batch form, might as well send it as
-            such and reduce the number of transmissions.
+            such and reduce the number of transmissions. In flush interval mode, the
+            data is not sent right away, but at the next flush.
 
         """
-        # Set the values on the DataPullSocket
+        self._set_internal(data)
+        if self.flush_interval is not None:
+            with self._pending_lock:
+                self._pending.update(data)
+            return
+
+        # Send the data to the live socket proxy
+        self._send(data)
+
+    def _set_internal(self, data):
+        """Check the codenames and set the values on the internal DataPullSocket
+
+        Args:
+            data (dict): Batch of data, as for :meth:`.set_batch`
+
+        Raises:
+            RuntimeError: If a codename is not registered
+        """
         for key, value in data.items():
             if key not in self.codename_set:
                 message = 'The codename: \'{}\' is not registered'.format(key)
@@ -1326,10 +2969,6 @@ class LiveSocket(object):
             if self._internal_pull_socket:
                 self._internal_pull_socket.set_point(key, value)
 
-        # Send the data to the live socket proxy
-        dump = json.dumps({'host': self.hostname, 'data': data})
-        self.socket.sendto(dump.encode('utf-8'), (self.liveserver_ip, self.liveserver_port))
-
     def set_batch_now(self, data):
         """Set a batch of point now
 
@@ -1373,17 +3012,281 @@ class LiveSocket(object):
 
         Args:
             codenames (list): List of codenames
+
+        In flush interval mode, the pending points are sent before the reset signal,
+        which is sent right away, so that points set after the reset are not coalesced
+        with it.
         """
-        self.set_batch({codename: 'RESET' for codename in codenames})
+        if self.flush_interval is None:
+            self.set_batch({codename: 'RESET' for codename in codenames})
+            return
+
+        reset = {codename: 'RESET' for codename in codenames}
+        self._set_internal(reset)
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+            if pending:
+                self._send(pending)
+            self._send(reset)
+
+
+DIRUHLOG = logging.getLogger(__name__ + '.DirectoryUDPHandler')
+DIRUHLOG.addHandler(logging.NullHandler())
+class DirectoryUDPHandler(SocketServer.BaseRequestHandler):
+    """Request handler for the :class:`.SocketDirectory` socket server. The commands
+    this request handler understands are documented in the :meth:`.handle` method.
+    """
+
+    def handle(self):
+        """Returns the directory or values from the socket servers in :data:`.DATA`
+
+        The handler understands the following commands:
+
+        **COMMANDS**
+
+         * **directory_json** (*str*): Return a list of all the socket servers, sorted
+           by port, encoded as :py:mod:`json`. Each socket server is described by a
+           dict with the keys ``port``, ``name``, ``type``, ``codenames`` (null for
+           push socket servers) and ``shared_memory``, e.g.
+           ``[{"port": 9000, "name": "Moon laser", "type": "date", "codenames":
+           ["power"], "shared_memory": false}]``
+         * **json_wn** (*str*): Return the points of all the pull socket servers, as a
+           dict of ports (as strings) to dicts of codenames to points, encoded as
+           :py:mod:`json` e.g. ``{"9000": {"power": [x1, y1]}}``
+         * **codename1,codename2#json_wn** (*str*): Return the points for only the
+           listed codenames, from any of the pull socket servers, as a dict of the
+           codenames, as given, to points, encoded as :py:mod:`json`. A codename can
+           be qualified with the port of its socket server, e.g.
+           ``'9000:power,9001:power#json_wn'``, which is required if the codename is
+           served by more than one socket server. If one of the codenames is
+           unknown, the command is unknown.
+         * **codename1,codename2#json** (*str*): The same as ``json_wn``, but return
+           a list of the points in the order of the codenames
+         * **name** (*str*): Return the name of the directory socket server
+         * **status** (*str*): Return the system status and status for all socket
+           servers.
+         * **commands** (*str*): Return a list of the commands encoded as
+           :py:mod:`json`
+
+        Points that are too old are returned as :data:`.OLD_DATA`, like from the
+        socket servers themselves. If a reply would exceed the size of a datagram, an
+        ``ERROR`` is returned instead. All commands can be prefixed with a request ID,
+        see :func:`.split_request_id`.
+        """
+        prefix, request = split_request_id(self.request[0])
+        command = request.decode('ascii')
+        sock = self.request[1]
+        DIRUHLOG.debug('Request \'%s\' received from %s', command, self.client_address)
+
+        out = self._reply(command)
+        if len(out) > MAX_DATAGRAM_SIZE:
+            out = '{}#The reply to \'{:.100}\' is too large for a datagram'.format(
+                PUSH_ERROR, command)
+        data = prefix + out.encode('ascii')
+        sock.sendto(data, self.client_address)
+        DIRUHLOG.debug('Sent back \'%.100s\' to %s', data, self.client_address)
+
+    def _reply(self, command):
+        """Returns the reply for a command
+
+        Args:
+            command (str): Complete command
+
+        Returns:
+            str: The reply to be sent back
+        """
+        if command == 'directory_json':
+            return six.text_type(json.dumps(self._directory()))
+        if command == 'json_wn':
+            return six.text_type(dumps({
+                six.text_type(port): dict(zip(state.codenames,
+                                              state.current_points(state.codenames)))
+                for port, state in self._pull_states()
+            }))
+        if command.count('#') == 1:
+            return self._selected_values(*command.split('#'))
+        if command == 'name':
+            return self.server.directory_name
+        if command == 'status':
+            return six.text_type(json.dumps({
+                'system_status': SYSTEM_STATUS.complete_status(),
+                'socket_server_status': socket_server_status()
+            }))
+        if command == 'commands':
+            return six.text_type(json.dumps(
+                ['directory_json', 'json_wn', 'codenames#json_wn', 'codenames#json',
+                 'name', 'status', 'commands']
+            ))
+        return UNKNOWN_COMMAND
+
+    @staticmethod
+    def _pull_states():
+        """Returns a list of (port, :class:`.PullSocketState`) for the pull socket
+        servers, sorted by port
+        """
+        # Copy, since socket servers may be started or stopped in other threads
+        return sorted((port, state) for port, state in list(DATA.items())
+                      if isinstance(state, PullSocketState))
+
+    @staticmethod
+    def _directory():
+        """Returns the list of dicts that describe the socket servers"""
+        out = []
+        for port, data in sorted(list(DATA.items())):
+            pull = isinstance(data, PullSocketState)
+            out.append({
+                'port': port,
+                'name': data['name'],
+                'type': data['type'],
+                'codenames': data.codenames if pull else None,
+                'shared_memory': pull and data.shared_memory is not None,
+            })
+        return out
+
+    def _selected_values(self, names, data_format):
+        """Returns the points for a selection of codenames from any of the pull socket
+        servers
+
+        Args:
+            names (str): The comma separated codenames, optionally on the form
+                ``port:codename``
+            data_format (str): ``'json'`` or ``'json_wn'``
+
+        Returns:
+            str: The data as a string (or an error) to be sent back
+        """
+        DIRUHLOG.debug('Parsing selected values command for %s in format: %s',
+                       names, data_format)
+        if data_format not in ('json', 'json_wn'):
+            return UNKNOWN_COMMAND
+        names = names.split(',')
+        pull_states = self._pull_states()
+
+        # Group the codenames by socket server, to take the points of each from one
+        # consistent snapshot
+        requested = {}
+        for position, name in enumerate(names):
+            port, _, codename = name.rpartition(':')
+            if port:
+                matches = [state for state_port, state in pull_states
+                           if six.text_type(state_port) == port]
+            else:
+                matches = [state for _, state in pull_states]
+            matches = [state for state in matches if codename in state.index]
+            if not matches:
+                return UNKNOWN_COMMAND
+            if len(matches) > 1:
+                return '{}#The codename \'{}\' is served on more than one port, '\
+                    'qualify it as port:codename'.format(PUSH_ERROR, codename)
+            requested.setdefault(id(matches[0]), (matches[0], []))[1].append(
+                (position, codename))
+
+        points = [None] * len(names)
+        for state, positions_codenames in requested.values():
+            positions, codenames = zip(*positions_codenames)
+            for position, point in zip(positions, state.current_points(codenames)):
+                points[position] = point
+
+        if data_format == 'json':
+            return six.text_type(dumps(points))
+        return six.text_type(dumps(dict(zip(names, points))))
+
+
+SDLOG = logging.getLogger(__name__ + '.SocketDirectory')
+SDLOG.addHandler(logging.NullHandler())
+class SocketDirectory(threading.Thread):
+    """This class implements a directory socket server for all the socket servers in
+    this process
+
+    The directory lists the socket servers in :data:`.DATA` with their names, types,
+    ports and codenames, and serves the points of all the pull socket servers, so that
+    a client can discover and read all the codenames from one well known port in a
+    single request. It does not know about socket servers in other processes on the
+    same host. The commands are documented in :meth:`.DirectoryUDPHandler.handle`.
+    """
+
+    def __init__(self, name=None, port=8999, engine=None):
+        """Initializes the SocketDirectory
+
+        Args:
+            name (str): The name of the directory socket server. Defaults to
+                ``'Socket directory on <hostname>'``
+            port (int): The network port to start the socket server on (default
+                is 8999)
+            engine (AsyncioSocketEngine): If given, the UDP server will be served by
+                this :class:`.AsyncioSocketEngine` instead of by a
+                :py:class:`SocketServer.UDPServer` in this thread
+        """
+        SDLOG.info('Initialize with: %s', call_spec_string())
+        super(SocketDirectory, self).__init__()
+        self.daemon = True
+        if name is None:
+            name = 'Socket directory on {}'.format(socket.gethostname())
+        self.name = name
+        self.port = port
+
+        if port in DATA:
+            message = 'A UDP server already exists on port: {}'.format(port)
+            SDLOG.error(message)
+            raise ValueError(message)
+
+        try:
+            if engine is None:
+                self.server = SocketServer.UDPServer(('', port), DirectoryUDPHandler)
+            else:
+                self.server = engine.udp_server(('', port), DirectoryUDPHandler)
+        except socket.error as error:
+            if error.errno == 98:
+                # See custom exception message to understand this
+                SDLOG.error('Port \'%s\' still reserved', port)
+                raise PortStillReserved()
+            else:
+                raise error
+        self.server.directory_name = name
+        SDLOG.debug('Initialized')
+
+    def run(self):
+        """Starts the UPD socket server
+
+        .. note:: If the socket server is served by an :class:`.AsyncioSocketEngine`, this
+            method returns as soon as the server is registered with the engine
+        """
+        SDLOG.info('Run')
+        self.server.serve_forever()
+        SDLOG.info('Run ended')
+
+    def stop(self):
+        """Stops the UDP server"""
+        SDLOG.debug('Stop requested')
+        self.server.shutdown()
+        self.server.server_close()
+        SDLOG.info('Stopped')
 
 
 ### Module variables
 #: The list of characters that are not allowed in code names
-BAD_CHARS = ['#', ',', ';', ':', '&']
-#: The string returned if an unknown command is sent to the socket
-UNKNOWN_COMMAND = 'UNKNOWN_COMMMAND'
-#: The string used to indicate old or obsoleted data
-OLD_DATA = 'OLD_DATA'
+BAD_CHARS = ['#', ',', ';', ':']
+#: The duration in seconds of a subscription lease
+SUBSCRIPTION_LEASE = 30.0
+#: The maximum size of a command over TCP
+MAX_TCP_REQUEST_SIZE = 65536
+#: The maximum size of a reply over TCP
+MAX_TCP_REPLY_SIZE = 64 * 1024 * 1024
+#: The maximum size of the datagrams sent by a :class:`.LiveSocket` in flush interval
+#: mode, which is the Ethernet MTU minus the IP and UDP headers
+LIVE_MAX_DATAGRAM_SIZE = 1472
+#: The upper bounds, in seconds, of the buckets in the handling time histograms of
+#: :class:`SocketMetrics`
+METRICS_BUCKETS = (1E-5, 2E-5, 5E-5, 1E-4, 2E-4, 5E-4, 1E-3, 2E-3, 5E-3, 1E-2, 2E-2,
+                   5E-2, 0.1, 0.2, 0.5, 1.0)
+#: The maximum number of different commands recorded in :class:`SocketMetrics`
+MAX_METRICS_COMMANDS = 32
+#: The maximum number of subscriptions per pull socket server
+MAX_SUBSCRIPTIONS = 64
+#: The formats the values of a pull socket can be requested in
+VALUE_FORMATS = ('raw', 'json', 'raw_wn', 'json_wn', 'binary', 'msgpack', 'msgpack_wn')
+#: The values used in the binary format for a point that is flagged
+NAN_POINT = (float('nan'), float('nan'))
 #: The answer prefix used when a push failed
 PUSH_ERROR = 'ERROR'
 #: The answer prefix used when a push succeds
@@ -1393,13 +3296,22 @@ PUSH_ACK = 'ACK'
 PUSH_EXCEP = 'EXCEP'
 #: The answer prefix for a callback return value
 PUSH_RET = 'RET'
+#: The suffix (followed by ':' and the number) added to a push ACK when data was
+#: dropped from a bounded queue, to enqueue the pushed data
+PUSH_DROPPED = 'DROPPED'
+#: The overflow policies for :class:`PushQueue`
+QUEUE_OVERFLOW_POLICIES = ('nak', 'drop_oldest', 'coalesce')
+#: The default number of seconds to wait for room in a full :class:`PushQueue` with the
+#: ``'nak'`` overflow policy before answering with an error
+QUEUE_PUT_TIMEOUT = 0.1
 #:The variable used to contain all the data.
 #:
 #:The format of the DATA variable is the following. The DATA variable is a
 #:dict, where each key is an integer port number and the value is the data for
 #:the socket server on that port. The data for each individual socket server is
-#:always a dict, but the contained values will depend on which kind of socket
-#:server it is, Examples below.
+#:a dict (for the pull socket servers a read-only dict view of a
+#::class:`PullSocketState`), but the contained values will depend on which kind
+#:of socket server it is, Examples below.
 #:
 #:For a :class:`DateDataPullSocket` the dict will resemble this example:
 #:
@@ -1408,8 +3320,12 @@ PUSH_RET = 'RET'
 #:  {'activity': {'activity_timeout': 900,
 #:                'check_activity': True,
 #:                'last_activity': 1413983209.82526},
+#:   'cache': <ResponseCache object>,
 #:   'codenames': ['var1'],
 #:   'data': {'var1': (0.0, 0.0)},
+#:   'history': None,
+#:   'metrics': <SocketMetrics object>,
+#:   'subscriptions': {},
 #:   'name': 'my_socket',
 #:   'timeouts': {'var1': None},
 #:   'type': 'date'}
@@ -1421,8 +3337,12 @@ PUSH_RET = 'RET'
 #:  {'activity': {'activity_timeout': 900,
 #:                'check_activity': True,
 #:                'last_activity': 1413983209.825451},
+#:   'cache': <ResponseCache object>,
 #:   'codenames': ['var1'],
 #:   'data': {'var1': (0.0, 0.0)},
+#:   'history': None,
+#:   'metrics': <SocketMetrics object>,
+#:   'subscriptions': {},
 #:   'name': 'my_data_socket',
 #:   'timeouts': {'var1': None},
 #:   'timestamps': {'var1': 0.0},
@@ -1438,6 +3358,7 @@ PUSH_RET = 'RET'
 #:                'last_activity': 1413983209.825681},
 #:   'last': None,
 #:   'last_time': None,
+#:   'metrics': <SocketMetrics object>,
 #:   'name': 'my_push_socket',
 #:   'type': 'push',
 #:   'updated': {},
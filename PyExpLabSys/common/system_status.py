@@ -1,5 +1,15 @@
 """This module contains the SystemStatus class
 
+The status items are cached, each for its own time to live (TTL), so that repeated
+calls to :meth:`SystemStatus.complete_status` e.g. from a fleet wide status sweep,
+does not re-read ``/proc``, probe the network etc. every time. Static items, like
+the purpose and the MAC address, are cached for the lifetime of the process, except
+for the fallback values of items that could not be determined, e.g. because the
+network was not up yet, which are only cached for :data:`UNKNOWN_TTL`. To
+move the fetching of the items that do expire out of the calls to
+:meth:`SystemStatus.complete_status` altogether, a background refresher can be
+started with :meth:`SystemStatus.start_refresher`.
+
 This module is Python 2 and 3 compatible.
 """
 
@@ -14,7 +24,9 @@ try:
     import fcntl
 except ImportError:
     fcntl = None  # pylint: disable=invalid-name
+import time
 import struct
+import logging
 import threading
 import subprocess
 try:
@@ -23,6 +35,9 @@ except ImportError:
     resource = None  # pylint: disable=C0103
 
 
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler())
+
 # Source: http://www.raspberrypi-spy.co.uk/2012/09/checking-your-raspberry-pi-board-version/
 RPI_REVISIONS = {
     '0002': 'Model B Revision 1.0',
@@ -46,6 +61,14 @@ RPI_REVISIONS = {
 }
 # Temperature regular expression
 RPI_TEMP_RE = re.compile(r"temp=([0-9\.]*)'C")
+# TTL for items that do not change for the lifetime of the process
+STATIC = float('inf')
+# TTL for items that are not decorated with a TTL
+DEFAULT_TTL = 1.0
+# The longest TTL for the fallback value of an item that could not be determined
+UNKNOWN_TTL = 60.0
+# The fallback value of the mac_address item
+MAC_ADDRESS_UNKNOWN = 'MAC ADDRESS UNKNOWN'
 
 
 def works_on(platform):
@@ -57,6 +80,23 @@ def works_on(platform):
     return decorator
 
 
+def cache_for(ttl, unknown=None):
+    """Return a decorator that attaches a _ttl (time to live in seconds) attribute to
+    methods
+
+    Args:
+        ttl (float): The time to live in seconds
+        unknown: The fallback value the method returns if the item could not be
+            determined, which is only cached for up to :data:`UNKNOWN_TTL`, or None
+    """
+    def decorator(function):
+        """Decorate a method with a _ttl and an _unknown attribute"""
+        function._ttl = ttl  # pylint: disable=protected-access
+        function._unknown = unknown  # pylint: disable=protected-access
+        return function
+    return decorator
+
+
 class SystemStatus(object):
     """Class that fetches set of system status information"""
 
@@ -81,6 +121,11 @@ class SystemStatus(object):
 
         # Cache for fairly static information like purpose
         self._cache = {}
+        # Cache for the status items; name -> (expiry unix time, value)
+        self._item_cache = {}
+        # The names of the items that failed in the last refresh
+        self._failing = set()
+        self._refresher = None
 
         # Form the list methods that work in this platform, using the _works_on attribute
         # that is appended with a decorator
@@ -92,12 +137,104 @@ class SystemStatus(object):
                 self.methods_on_this_platform.append(method)
 
     def complete_status(self):
-        """Returns all system status information items as a dictionary"""
-        return {method.__name__: method() for method in self.methods_on_this_platform}
+        """Returns all system status information items as a dictionary
+
+        Items whose cached values are still within their TTL are not fetched again.
+        """
+        now = time.time()
+        return {method.__name__: self._item(method, now)
+                for method in self.methods_on_this_platform}
+
+    def _item(self, method, now):
+        """Returns the cached value for the item, fetching it if it has expired
+
+        Args:
+            method (callable): The status item method
+            now (float): The current unix time
+
+        Returns:
+            object: The status item value
+        """
+        cached = self._item_cache.get(method.__name__)
+        if cached is not None and now < cached[0]:
+            return cached[1]
+        return self._fetch(method, now)
+
+    def _fetch(self, method, now):
+        """Fetches the value for the item and caches it
+
+        Args:
+            method (callable): The status item method
+            now (float): The current unix time
+
+        Returns:
+            object: The status item value
+        """
+        value = method()
+        ttl = getattr(method, '_ttl', DEFAULT_TTL)
+        # Try again soon to determine items that could not be determined
+        unknown = getattr(method, '_unknown', None)
+        if unknown is not None and value == unknown:
+            ttl = min(ttl, UNKNOWN_TTL)
+        # Replace the entry as a whole, so readers see either the old or the new one
+        self._item_cache[method.__name__] = (now + ttl, value)
+        return value
+
+    def refresh(self, horizon=0.0):
+        """Fetches all the items that have expired or expire within horizon
+
+        Items that raise an exception are skipped, so they will instead be fetched
+        (and raise) in :meth:`complete_status`. The exception is logged with the
+        traceback the first time the item fails, and at debug level while it keeps
+        failing.
+
+        Args:
+            horizon (float): Also refresh items that expire within this many seconds
+        """
+        now = time.time()
+        for method in self.methods_on_this_platform:
+            cached = self._item_cache.get(method.__name__)
+            if cached is None or cached[0] <= now + horizon:
+                try:
+                    self._fetch(method, now)
+                except Exception:  # pylint: disable=broad-except
+                    if method.__name__ in self._failing:
+                        LOGGER.debug('Status item %s still fails', method.__name__,
+                                     exc_info=True)
+                    else:
+                        LOGGER.exception('Status item %s failed', method.__name__)
+                        self._failing.add(method.__name__)
+                    continue
+                if method.__name__ in self._failing:
+                    LOGGER.info('Status item %s works again', method.__name__)
+                    self._failing.discard(method.__name__)
+
+    def start_refresher(self, interval=DEFAULT_TTL):
+        """Starts a daemon thread that keeps the cached items fresh
+
+        Every interval, the thread fetches all the items that would expire before the
+        next time it runs, so that calls to :meth:`complete_status` are served from
+        the cache. Items with a TTL shorter than the interval may still be fetched in
+        :meth:`complete_status`.
+
+        Args:
+            interval (float): The number of seconds between refreshes
+        """
+        if self._refresher is not None:
+            raise RuntimeError('The refresher is already running')
+        self._refresher = StatusRefresher(self, interval)
+        self._refresher.start()
+
+    def stop_refresher(self):
+        """Stops the background refresher, if it is running"""
+        if self._refresher is not None:
+            self._refresher.stop()
+            self._refresher = None
 
     # All platforms
     @staticmethod
     @works_on('all')
+    @cache_for(60.0)
     def last_git_fetch_unixtime():
         """Returns the unix timestamp and author time zone offset in seconds of
         the last git commit
@@ -124,6 +261,7 @@ class SystemStatus(object):
 
     @staticmethod
     @works_on('all')
+    @cache_for(STATIC)
     def python_version():
         """Returns the Python version"""
         return '{}.{}.{}'.format(*sys.version_info)
@@ -146,6 +284,7 @@ class SystemStatus(object):
 
     @staticmethod
     @works_on('linux2')
+    @cache_for(60.0)
     def last_apt_cache_change_unixtime():
         """Returns the unix timestamp of the last apt-get upgrade"""
         apt_cache_dir = '/var/cache/apt'
@@ -171,6 +310,7 @@ class SystemStatus(object):
 
     @staticmethod
     @works_on('linux2')
+    @cache_for(10.0)
     def filesystem_usage():
         """Return the total and free number of bytes in the current filesystem
         """
@@ -183,6 +323,7 @@ class SystemStatus(object):
 
     @staticmethod
     @works_on('linux2')
+    @cache_for(10.0)
     def max_python_mem_usage_bytes():
         """Returns the python memory usage"""
         pagesize = resource.getpagesize()
@@ -194,6 +335,7 @@ class SystemStatus(object):
 
     @staticmethod
     @works_on('linux2')
+    @cache_for(STATIC, unknown=MAC_ADDRESS_UNKNOWN)
     def mac_address():
         """Return the mac address of the currently connected interface"""
         # This procedure has given us problems in the past, so sorround with try-except
@@ -218,10 +360,11 @@ class SystemStatus(object):
             else:
                 return ':'.join(['%02x' % char for char in info[18:24]])
         except:  # pylint: disable=bare-except
-            return 'MAC ADDRESS UNKNOWN'
+            return MAC_ADDRESS_UNKNOWN
 
     @staticmethod
     @works_on('linux2')
+    @cache_for(STATIC)
     def rpi_model():
         """Return the Raspberry Pi"""
         with open('/proc/cpuinfo') as file_:
@@ -238,6 +381,7 @@ class SystemStatus(object):
 
     @staticmethod
     @works_on('linux2')
+    @cache_for(10.0)
     def rpi_temperature():
         """Return the temperature of a Raspberry Pi"""
         #Firmware bug in Broadcom chip craches raspberry pi when reading temperature
@@ -260,6 +404,7 @@ class SystemStatus(object):
 
     @staticmethod
     @works_on('linux2')
+    @cache_for(STATIC)
     def sd_card_serial():
         """Return the SD card serial number"""
         try:
@@ -270,6 +415,7 @@ class SystemStatus(object):
             return None
 
     @works_on('linux2')
+    @cache_for(STATIC)
     def purpose(self):
         """Returns the information from the purpose file"""
         if 'purpose' in self._cache:
@@ -310,11 +456,40 @@ class SystemStatus(object):
         return purpose
 
     @works_on('linux2')
+    @cache_for(STATIC)
     def machine_name(self):
         """Return the machine name"""
         return self._machinename
 
 
+class StatusRefresher(threading.Thread):
+    """Thread that periodically refreshes the cached items of a :class:`SystemStatus`"""
+
+    def __init__(self, system_status, interval):
+        """Initialize the refresher
+
+        Args:
+            system_status (SystemStatus): The system status object to refresh
+            interval (float): The number of seconds between refreshes
+        """
+        super(StatusRefresher, self).__init__()
+        self.daemon = True
+        self.system_status = system_status
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        """Refresh until stopped"""
+        while not self._stop_event.is_set():
+            self.system_status.refresh(horizon=self.interval)
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        """Stop the refresher and wait for it to finish"""
+        self._stop_event.set()
+        self.join()
+
+
 if __name__ == '__main__':
     from pprint import pprint
     SYSTEM_STATUS = SystemStatus()
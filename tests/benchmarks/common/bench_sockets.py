@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""Load test and latency benchmark for the socket servers in PyExpLabSys.common.sockets
+
+The benchmark starts a socket server on localhost, drives it with a number of concurrent
+clients, that each send requests drawn from a command mix as fast as the replies come
+back, and reports the throughput and the latency percentiles. Run it before and after a
+change to sockets.py to compare them, e.g.::
+
+    python bench_sockets.py --socket date --channels 100 --clients 4
+    python bench_sockets.py --socket push --clients 8 --duration 10 --json results.json
+
+The command mix is given as command=weight pairs. In the commands, ``codename`` is
+replaced with a random codename and ``json_wn#`` without data with a push of a random
+codename, e.g.::
+
+    python bench_sockets.py --socket data --mix raw=1,json_wn=1,codename#json=4
+
+The clients run in threads per default, which means that they compete with the server
+for the GIL. Use ``--processes`` to run them in separate processes instead.
+"""
+
+from __future__ import print_function, division
+
+import argparse
+import json
+import random
+import socket
+import sys
+import time
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+
+try:
+    import SocketServer
+except ImportError:
+    import socketserver as SocketServer
+# Allow for fast restart of a socket on the same port between runs
+SocketServer.UDPServer.allow_reuse_address = True
+
+from PyExpLabSys.common.sockets import DateDataPullSocket, DataPullSocket, DataPushSocket
+
+
+HOST = '127.0.0.1'
+PORT = 9500
+NAME = 'Benchmark socket'
+SOCKET_TYPES = {'date': DateDataPullSocket, 'data': DataPullSocket, 'push': DataPushSocket}
+DEFAULT_MIXES = {
+    'date': 'raw=1,json_wn=1,codename#json=2',
+    'data': 'raw=1,json_wn=1,codename#json=2',
+    'push': 'json_wn#=1',
+}
+PERCENTILES = (50, 90, 99)
+# Perf counter is not available in Python 2
+TIMER = getattr(time, 'perf_counter', time.time)
+
+
+def parse_mix(mix):
+    """Return a list of (command, weight) from a command=weight,... string"""
+    out = []
+    for part in mix.split(','):
+        command, weight = part.rsplit('=', 1)
+        out.append((command, float(weight)))
+    return out
+
+
+def make_requests(mix, codenames, number, seed):
+    """Return number requests drawn from the command mix
+
+    Args:
+        mix (list): (command, weight) tuples
+        codenames (list): The codenames to substitute in the commands
+        number (int): The number of requests
+        seed (int): The seed for the random choices
+
+    Returns:
+        list: The requests as bytes
+    """
+    random_ = random.Random(seed)
+    commands = [command for command, _ in mix]
+    weights = [weight for _, weight in mix]
+    total = sum(weights)
+    requests = []
+    for _ in range(number):
+        # Weighted choice, random.choices is not available in Python 2
+        pick = random_.random() * total
+        for command, weight in zip(commands, weights):
+            pick -= weight
+            if pick < 0:
+                break
+        codename = random_.choice(codenames)
+        if command == 'json_wn#':
+            command = 'json_wn#' + json.dumps({codename: random_.random()})
+        else:
+            command = command.replace('codename', codename)
+        requests.append(command.encode('ascii'))
+    return requests
+
+
+def run_client(port, requests, duration, timeout):
+    """Send the requests, one at a time, for duration seconds
+
+    Args:
+        port (int): The port of the socket server
+        requests (list): The requests, which are sent over and over
+        duration (float): The duration in seconds
+        timeout (float): The timeout in seconds for each reply
+
+    Returns:
+        tuple: The latencies in seconds (list) and the number of timeouts
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(timeout)
+    latencies = []
+    timeouts = 0
+    end = TIMER() + duration
+    index = 0
+    while TIMER() < end:
+        request = requests[index % len(requests)]
+        index += 1
+        start = TIMER()
+        sock.sendto(request, (HOST, port))
+        try:
+            sock.recv(65507)
+        except socket.timeout:
+            timeouts += 1
+            continue
+        latencies.append(TIMER() - start)
+    sock.close()
+    return latencies, timeouts
+
+
+def percentile(sorted_values, percent):
+    """Return the percentile (nearest rank) of sorted values"""
+    if not sorted_values:
+        return float('nan')
+    rank = int(round(percent / 100 * (len(sorted_values) - 1)))
+    return sorted_values[rank]
+
+
+def start_server(socket_type, channels):
+    """Start the socket server and set a point for each channel
+
+    Returns:
+        tuple: The socket server and the codenames
+    """
+    codenames = ['channel{}'.format(index) for index in range(channels)]
+    if socket_type == 'push':
+        server = DataPushSocket(NAME, port=PORT)
+        server.start()
+        return server, codenames
+
+    server = SOCKET_TYPES[socket_type](NAME, codenames, port=PORT)
+    server.start()
+    now = time.time()
+    for index, codename in enumerate(codenames):
+        server.set_point(codename, (now, float(index)))
+    return server, codenames
+
+
+def benchmark(args):
+    """Run the benchmark and return the results"""
+    mix = parse_mix(args.mix or DEFAULT_MIXES[args.socket])
+    server, codenames = start_server(args.socket, args.channels)
+    pool_class = Pool if args.processes else ThreadPool
+    pool = pool_class(args.clients)
+    try:
+        results = [
+            pool.apply_async(run_client, (
+                PORT, make_requests(mix, codenames, 1000, seed),
+                args.duration, args.timeout,
+            ))
+            for seed in range(args.clients)
+        ]
+        results = [result.get() for result in results]
+    finally:
+        pool.close()
+        pool.join()
+        server.stop()
+
+    latencies = sorted(latency for client_latencies, _ in results
+                       for latency in client_latencies)
+    out = {
+        'socket': args.socket,
+        'channels': args.channels,
+        'clients': args.clients,
+        'processes': args.processes,
+        'mix': args.mix or DEFAULT_MIXES[args.socket],
+        'duration': args.duration,
+        'requests': len(latencies),
+        'timeouts': sum(timeouts for _, timeouts in results),
+        'throughput': len(latencies) / args.duration,
+    }
+    for percent in PERCENTILES:
+        out['p{}'.format(percent)] = percentile(latencies, percent)
+    return out
+
+
+def print_results(results):
+    """Print the results in a human readable form"""
+    print('{socket} socket, {channels} channels, {clients} clients, mix: {mix}'
+          .format(**results))
+    print('  Requests:   {requests} in {duration} s ({timeouts} timeouts)'.format(**results))
+    print('  Throughput: {:.0f} requests/s'.format(results['throughput']))
+    for percent in PERCENTILES:
+        key = 'p{}'.format(percent)
+        print('  {:<11} {:.1f} us'.format(key + ':', results[key] * 1E6))
+
+
+def main():
+    """Parse the arguments and run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--socket', choices=sorted(SOCKET_TYPES), default='date',
+                        help='the type of socket server (default: date)')
+    parser.add_argument('--channels', type=int, default=10,
+                        help='the number of codenames on pull sockets (default: 10)')
+    parser.add_argument('--clients', type=int, default=1,
+                        help='the number of concurrent clients (default: 1)')
+    parser.add_argument('--processes', action='store_true',
+                        help='run the clients in processes instead of threads')
+    parser.add_argument('--mix', help='the command mix as command=weight,... (default '
+                        'depends on the socket type)')
+    parser.add_argument('--duration', type=float, default=5.0,
+                        help='the duration in seconds (default: 5)')
+    parser.add_argument('--timeout', type=float, default=1.0,
+                        help='the timeout in seconds for each reply (default: 1)')
+    parser.add_argument('--json', metavar='FILE',
+                        help='also write the results as json to FILE')
+    args = parser.parse_args()
+
+    results = benchmark(args)
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as file_:
+            json.dump(results, file_, indent=4)
+    return 0 if results['requests'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
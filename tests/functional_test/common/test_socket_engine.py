@@ -0,0 +1,83 @@
+"""Functional tests for the PyExpLabSys.common.socket_engine module"""
+
+import json
+import socket
+try:
+    import SocketServer
+except ImportError:
+    import socketserver as SocketServer
+# Allow for fast restart of a socket on a port for test purposes
+SocketServer.UDPServer.allow_reuse_address = True
+
+import mock
+import pytest
+import PyExpLabSys.common.sockets
+from PyExpLabSys.common.sockets import DateDataPullSocket, DataPushSocket
+from PyExpLabSys.common.socket_engine import AsyncioSocketEngine
+from PyExpLabSys.common.supported_versions import python3_only
+python3_only(__file__)
+
+
+HOST = '127.0.0.1'
+NAME = 'Usage statistics from giant moon laser'
+
+
+@pytest.yield_fixture
+def sock():
+    """Client socket fixture"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(1)
+    yield sock
+    sock.close()
+
+
+@pytest.yield_fixture
+def engine():
+    """Running engine fixture"""
+    engine = AsyncioSocketEngine()
+    engine.start()
+    yield engine
+    engine.stop()
+
+
+def send_and_resc(sock, command, port):
+    """Helper UPD socket send and receive"""
+    sock.sendto(command.encode('ascii'), (HOST, port))
+    data, _ = sock.recvfrom(1024)
+    return data.decode('ascii')
+
+
+def test_many_sockets_one_engine(engine, sock):
+    """Test serving several pull and push sockets from a single engine"""
+    pull_sockets = []
+    for index in range(5):
+        pull_socket = DateDataPullSocket(NAME + str(index), ['meas'], port=9000 + index,
+                                         engine=engine)
+        pull_socket.start()
+        pull_socket.set_point('meas', (index, index * 2.0))
+        pull_sockets.append(pull_socket)
+    push_socket = DataPushSocket(NAME, port=8500, engine=engine)
+    push_socket.start()
+
+    for index in range(5):
+        assert send_and_resc(sock, 'name', 9000 + index) == NAME + str(index)
+        assert json.loads(send_and_resc(sock, 'json_wn', 9000 + index)) ==\
+            {'meas': [index, index * 2.0]}
+    assert send_and_resc(sock, 'json_wn#{"a": 1}', 8500).startswith('ACK#')
+    assert push_socket.last[1] == {'a': 1}
+
+    with mock.patch('time.sleep'):
+        for pull_socket in pull_sockets:
+            pull_socket.stop()
+        push_socket.stop()
+    assert PyExpLabSys.common.sockets.DATA == {}
+
+
+def test_port_reuse_after_stop(engine, sock):
+    """Test that a port is freed when a socket served by the engine is stopped"""
+    for _ in range(2):
+        pull_socket = DateDataPullSocket(NAME, ['meas'], port=9000, engine=engine)
+        pull_socket.start()
+        assert send_and_resc(sock, 'codenames_json', 9000) == '["meas"]'
+        with mock.patch('time.sleep'):
+            pull_socket.stop()
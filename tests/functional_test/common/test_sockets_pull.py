@@ -4,6 +4,7 @@
 import time
 import json
 import socket
+import threading
 try:
     import SocketServer
 except ImportError:
@@ -17,7 +18,13 @@ import pytest
 # Own imports
 import PyExpLabSys.common.sockets
 DATA = PyExpLabSys.common.sockets.DATA
-from PyExpLabSys.common.sockets import DataPullSocket, DateDataPullSocket
+from PyExpLabSys.common.sockets import (
+    DataPullSocket, DateDataPullSocket, DataPushSocket, SocketDirectory
+)
+from PyExpLabSys.common.socket_clients import (
+    decode_binary, MAX_DATAGRAM_SIZE, DateDataPullSubscriber, DateDataPullClient,
+    MultiPullClient, SharedMemoryReader, SocketDirectoryClient, OLD_DATA
+)
 from PyExpLabSys.common.supported_versions import python2_and_3
 python2_and_3(__file__)
 
@@ -229,6 +236,283 @@ def test_multiple_variables(sockettype, sock):
     assert port not in PyExpLabSys.common.sockets.DATA
 
 
+def test_binary(sockettype, sock):
+    """Test the binary format and the decoding of it"""
+    codenames = ['meas{}'.format(index) for index in range(150)]
+    data_socket = sockettype(NAME, codenames, port=9000, timeouts=[None] * 149 + [0.1])
+    data_socket.start()
+    for index, codename in enumerate(codenames[:-1]):
+        data_socket.set_point(codename, (time.time(), float(index)))
+    # Make the last point too old
+    if sockettype is DataPullSocket:
+        data_socket.set_point(codenames[-1], (0.0, 0.0), timestamp=0.0)
+    else:
+        data_socket.set_point(codenames[-1], (0.0, 0.0))
+
+    sock.sendto(b'binary', (HOST, 9000))
+    points = decode_binary(sock.recv(MAX_DATAGRAM_SIZE))
+    assert len(points) == 150
+    assert [point[1] for point in points[:-1]] == [float(index) for index in range(149)]
+    assert points[-1] == 'OLD_DATA'
+
+    sock.sendto(b'meas3,meas1#binary', (HOST, 9000))
+    assert [point[1] for point in decode_binary(sock.recv(1024))] == [3.0, 1.0]
+
+    with mock.patch('time.sleep'):
+        data_socket.stop()
+
+
+def test_msgpack(sockettype):
+    """Test getting the points encoded as MessagePack"""
+    data_socket = sockettype(NAME, ['one', 'two'], port=9000)
+    data_socket.start()
+    data_socket.set_point('one', (1.0, 47.0))
+    data_socket.set_point('two', (2.0, 'on'))
+
+    client = DateDataPullClient(HOST, NAME, port=9000, timeout=1.0)
+    assert client.get_all_fields_msgpack() == {'one': [1.0, 47.0], 'two': [2.0, 'on']}
+
+    with mock.patch('time.sleep'):
+        data_socket.stop()
+
+
+def test_subscribe(sockettype):
+    """Test that subscribed clients get points streamed as they are set"""
+    data_socket = sockettype(NAME, ['one', 'two'], port=9000)
+    data_socket.start()
+    subscriber_all = DateDataPullSubscriber(HOST, 9000)
+    subscriber_two = DateDataPullSubscriber(HOST, 9000, fieldnames=['two'])
+
+    data_socket.set_point('one', (1.0, 47.0))
+    data_socket.set_point('two', (2.0, 42.0))
+    assert subscriber_all.get_update(timeout=1) == {'one': [1.0, 47.0]}
+    assert subscriber_all.get_update(timeout=1) == {'two': [2.0, 42.0]}
+    assert subscriber_two.get_update(timeout=1) == {'two': [2.0, 42.0]}
+    assert subscriber_two.get_update(timeout=0.1) is None
+
+    # After unsubscribing, nothing is sent
+    subscriber_all.close()
+    subscriber_two.close()
+    time.sleep(0.1)
+    assert DATA[9000]['subscriptions'] == {}
+
+    with mock.patch('time.sleep'):
+        data_socket.stop()
+
+
+def test_history(sockettype):
+    """Test getting the history of points newer than a given time"""
+    data_socket = sockettype(NAME, ['one', 'two'], port=9000, history_size=3)
+    data_socket.start()
+    for index in range(5):
+        if sockettype is DataPullSocket:
+            data_socket.set_point('one', (index, index * 2.0), timestamp=100.0 + index)
+        else:
+            data_socket.set_point('one', (100.0 + index, index * 2.0))
+
+    client = DateDataPullClient(HOST, NAME, port=9000)
+    history = client.get_history(since=102.5)
+    assert history['two'] == []
+    if sockettype is DataPullSocket:
+        assert history['one'] == [[3.0, 6.0], [4.0, 8.0]]
+    else:
+        assert history['one'] == [[103.0, 6.0], [104.0, 8.0]]
+    assert len(client.get_history()['one']) == 3
+
+    with mock.patch('time.sleep'):
+        data_socket.stop()
+
+
+def test_tcp(sockettype):
+    """Test the TCP listener with a reply larger than a datagram"""
+    codenames = ['codename{}'.format(index) for index in range(3000)]
+    data_socket = sockettype(NAME, codenames, port=9000, tcp_port=9001)
+    data_socket.start()
+    for index, codename in enumerate(codenames):
+        data_socket.set_point(codename, (1E9 + index, index * 0.5))
+
+    # Over UDP, the reply does not fit in a datagram, but it does over TCP
+    client = DateDataPullClient(HOST, NAME, port=9000, tcp_port=9001, timeout=1.0)
+    assert client.codenames == codenames
+    assert len(client._communicate('json_wn')) > MAX_DATAGRAM_SIZE
+    data = client.get_all_fields()
+    assert data['codename2999'] == [1E9 + 2999, 1499.5]
+    name, point, subscribe = client.communicate_many(['name', 'codename1#json',
+                                                      'subscribe'])
+    assert (name, json.loads(point), subscribe) ==\
+        (NAME, [1000000001.0, 0.5], 'ERROR#Subscriptions are not available over TCP')
+    assert DATA[9000].metrics.as_dict()['commands']['name']['count'] == 2
+    client.socket_.close()
+
+    # Replies that fit in a datagram, but are larger than 1024 bytes, are received
+    # whole over UDP
+    udp_client = DateDataPullClient(HOST, NAME, port=9000, timeout=1.0)
+    assert udp_client.get_fields(codenames[:200]) == {codename: data[codename]
+                                                      for codename in codenames[:200]}
+
+    with mock.patch('time.sleep'):
+        data_socket.stop()
+
+
+def test_shared_memory(sockettype):
+    """Test reading the points from shared memory"""
+    data_socket = sockettype(NAME, ['one', 'two', 'three'], port=9000, timeouts=[None, 1, 1],
+                             shared_memory=True)
+    data_socket.start()
+    reader = SharedMemoryReader(9000, exception_on_old_data=False)
+    assert reader.codenames == ['one', 'two', 'three']
+    assert reader.get_all_fields() == {'one': (0.0, 0.0), 'two': OLD_DATA, 'three': OLD_DATA}
+
+    now = time.time()
+    data_socket.set_point('one', (now, 47.0))
+    data_socket.set_point('two', (now, 'on'))
+    assert reader.get_all_fields() == {'one': (now, 47.0), 'two': None, 'three': OLD_DATA}
+    reader.exception_on_old_data = True
+    assert reader.get_field('one') == (now, 47.0)
+    with pytest.raises(ValueError):
+        reader.get_field('three')
+    reader.close()
+
+    with mock.patch('time.sleep'):
+        data_socket.stop()
+    with pytest.raises(IOError):
+        SharedMemoryReader(9000)
+
+
+def test_client_request_ids(sockettype):
+    """Test pipelined requests and that late replies are discarded with request IDs"""
+    data_socket = sockettype(NAME, ['one', 'two'], port=9000)
+    data_socket.start()
+    data_socket.set_point('one', (1.0, 47.0))
+    data_socket.set_point('two', (2.0, 42.0))
+
+    client = DateDataPullClient(HOST, NAME, port=9000, request_ids=True, timeout=1.0)
+    replies = client.communicate_many(['one#json', 'two#json', 'name', 'codenames_json'])
+    assert [json.loads(reply) for reply in replies[:2]] == [[1.0, 47.0], [2.0, 42.0]]
+    assert replies[2:] == [NAME, '["one", "two"]']
+
+    # A reply to a request that is no longer in flight is not taken for the next one
+    client._send('two#json')
+    client._in_flight.clear()
+    assert client.get_field('one') == [1.0, 47.0]
+    assert client._replies == {}
+
+    with mock.patch('time.sleep'):
+        data_socket.stop()
+
+
+def test_multi_pull_client(sockettype):
+    """Test polling several sockets concurrently, with one that does not answer"""
+    data_sockets = []
+    for port in (9000, 9001):
+        data_socket = sockettype(NAME, ['one', 'two'], port=port)
+        data_socket.start()
+        data_socket.set_point('one', (1.0, port))
+        data_sockets.append(data_socket)
+
+    # Nothing answers on port 9002
+    targets = [(HOST, 9000, 'one#json'), (HOST, 9000, 'name'), (HOST, 9001, 'one#json'),
+               (HOST, 9002, 'name', 0.2)]
+    client = MultiPullClient(timeout=1.0, retries=1)
+    start = time.time()
+    results = client.poll(targets)
+    # The dead target is retried once with its own timeout and does not delay the others
+    assert 0.4 <= time.time() - start < 1.0
+    assert set(results) == set(targets)
+    assert json.loads(results[targets[0]]) == [1.0, 9000]
+    assert results[targets[1]] == NAME
+    assert json.loads(results[targets[2]]) == [1.0, 9001]
+    assert isinstance(results[targets[3]], socket.timeout)
+    assert client.poll([]) == {}
+
+    with mock.patch('time.sleep'):
+        for data_socket in data_sockets:
+            data_socket.stop()
+
+
+def test_multi_pull_client_replies():
+    """Test that late, unknown and undecodable replies do not mix up the results"""
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind((HOST, 9003))
+    server.settimeout(5.0)
+
+    def serve():
+        """Answer late to 'slow', with an unknown request ID before the reply to
+        'fast' and with invalid UTF-8 to 'binary'
+        """
+        for _ in range(3):
+            request, address = server.recvfrom(1024)
+            prefix, command = request[:request.index(b'&', 1) + 1], request.split(b'&')[2]
+            if command == b'slow':
+                time.sleep(0.3)
+                server.sendto(prefix + b'slow reply', address)
+            elif command == b'fast':
+                server.sendto(b'&9999&fast reply to unknown ID', address)
+                server.sendto(prefix + b'fast reply', address)
+            else:
+                server.sendto(prefix + b'\xff\x00', address)
+
+    thread = threading.Thread(target=serve)
+    thread.start()
+    targets = [(HOST, 9003, 'slow', 0.1), (HOST, 9003, 'fast'), (HOST, 9003, 'binary')]
+    try:
+        results = MultiPullClient(timeout=1.0).poll(targets)
+    finally:
+        thread.join()
+        server.close()
+    assert isinstance(results[targets[0]], socket.timeout)
+    assert results[targets[1]] == 'fast reply'
+    assert isinstance(results[targets[2]], UnicodeDecodeError)
+
+
+def test_socket_directory(sockettype):
+    """Test discovering and reading all the socket servers through the directory"""
+    data_sockets = []
+    for port, codenames in ((9000, ['one', 'two']), (9001, ['one', 'three'])):
+        data_socket = sockettype(NAME + str(port), codenames, port=port, timeouts=1.0)
+        data_socket.start()
+        data_socket.set_point('one', (time.time(), port))
+        data_sockets.append(data_socket)
+    push_socket = DataPushSocket(NAME, port=8500)
+    push_socket.start()
+    directory = SocketDirectory('directory', port=8999)
+    directory.start()
+
+    client = SocketDirectoryClient(HOST, port=8999, exception_on_old_data=False)
+    assert client.name == 'directory'
+    assert client.get_directory() == [
+        {'port': 8500, 'name': NAME, 'type': 'push', 'codenames': None,
+         'shared_memory': False},
+        {'port': 9000, 'name': NAME + '9000', 'type': data_sockets[0].state.type,
+         'codenames': ['one', 'two'], 'shared_memory': False},
+        {'port': 9001, 'name': NAME + '9001', 'type': data_sockets[1].state.type,
+         'codenames': ['one', 'three'], 'shared_memory': False},
+    ]
+
+    fields = client.get_all_fields()
+    assert sorted(fields) == [9000, 9001]
+    assert fields[9000]['one'][1] == 9000
+    assert fields[9001] == {'one': [mock.ANY, 9001], 'three': OLD_DATA}
+    fields = client.get_fields(['two', '9001:one', '9000:one'])
+    assert [fields['9001:one'][1], fields['9000:one'][1]] == [9001, 9000]
+    assert fields['two'] == OLD_DATA
+    # Unqualified codenames must be unique on the host
+    with pytest.raises(ValueError):
+        client.get_fields(['one'])
+    with pytest.raises(ValueError):
+        client.get_fields(['9002:one'])
+    client.exception_on_old_data = True
+    with pytest.raises(ValueError):
+        client.get_fields(['two'])
+    client.close()
+
+    with mock.patch('time.sleep'):
+        directory.stop()
+        push_socket.stop()
+        for data_socket in data_sockets:
+            data_socket.stop()
+
+
 def test_data_timeout(socket_and_use_timestamp, sock):
     """Test the data timeout functionality"""
     sockettype, usetimestamp = socket_and_use_timestamp
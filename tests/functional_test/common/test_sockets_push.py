@@ -323,6 +323,21 @@ class TestDataTransfer(object):
             self.last_test(dps, data, time_sent)
             self.updated_test(dps, data_updated, time_sent)
 
+    def test_batch_json(self, dps, sock, json_data):
+        """Test sending all the data sets at once with the batch_json command"""
+        data_updated = {}
+        for data in json_data:
+            data_updated.update(data)
+        batch = [[1414150015.5 + index, data] for index, data in enumerate(json_data)]
+        command = 'batch_json#{}'.format(json.dumps(batch)).encode('ascii')
+        sock.sendto(command, (HOST, PORT))
+        reply = sock.recv(1024).decode('ascii')
+        response, replies = reply.split('#', 1)
+        assert response == PyExpLabSys.common.sockets.PUSH_ACK
+        assert json.loads(replies) == ['ACK'] * len(json_data)
+        assert dps.last == (batch[-1][0], json_data[-1])
+        assert dps.updated == (batch[-1][0], data_updated)
+
 
 class TestCallBack(object):
     """Test the call back functionality"""
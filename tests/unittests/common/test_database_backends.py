@@ -0,0 +1,134 @@
+# pylint: disable=redefined-outer-name
+
+"""Unit tests for the database_backends module, through the savers in database_saver"""
+
+from __future__ import unicode_literals
+
+import pytest
+
+from PyExpLabSys.common import database_backends
+from PyExpLabSys.common.database_backends import SQLiteBackend, ParquetBackend, ParquetError
+from PyExpLabSys.common.database_saver import (
+    DataSetSaver, ContinuousDataSaver, SqlWriterPool, CustomColumn,
+)
+from PyExpLabSys.common.supported_versions import python2_and_3
+python2_and_3(__file__)
+
+
+@pytest.fixture(params=['sqlite', 'parquet'])
+def backend(request, tmpdir):
+    """Return a backend of each kind in a temporary directory"""
+    if request.param == 'sqlite':
+        return SQLiteBackend(str(tmpdir.join('data.sqlite')))
+    if database_backends.pyarrow is None:
+        pytest.skip('pyarrow is not installed')
+    return ParquetBackend(str(tmpdir.join('parquet')))
+
+
+def select(backend, query):
+    """Return all rows of a query"""
+    connection = backend.connect()
+    cursor = connection.cursor()
+    cursor.execute(query)
+    rows = cursor.fetchall()
+    connection.close()
+    return rows
+
+
+def test_data_set_saver(backend):
+    """Test saving a measurement and its points"""
+    saver = DataSetSaver('measurements_dummy', 'xy_values_dummy', None, None,
+                         backend=backend, batch_size=10)
+    saver.start()
+    metadata = {'type': 5, 'time': CustomColumn(1500000000.5, 'FROM_UNIXTIME(%s)')}
+    saver.add_measurement('M2', metadata)
+    saver.add_measurement('M28', {'type': 5, 'label': 'M28'})
+    saver.save_point('M2', (0.0, 1.0))
+    stats = saver.save_points_batch('M28', [1.0, 2.0, 3.0], [4.0, 5.0, 6.0], batchsize=2)
+    assert stats['batches'] == 2
+    assert saver.get_unique_values_from_measurements('UNIX_TIMESTAMP(time)') \
+        >= {1500000000.5}
+    saver.stop()
+
+    m2_id, m28_id = saver.measurement_ids['M2'], saver.measurement_ids['M28']
+    assert m2_id != m28_id
+    assert sorted(select(backend, 'SELECT label FROM measurements_dummy'),
+                  key=str) == [('M28',), (None,)]
+    rows = set(zip(select(backend, 'SELECT measurement FROM xy_values_dummy'),
+                   select(backend, 'SELECT x FROM xy_values_dummy'),
+                   select(backend, 'SELECT y FROM xy_values_dummy')))
+    assert rows == {((m2_id,), (0.0,), (1.0,)), ((m28_id,), (1.0,), (4.0,)),
+                    ((m28_id,), (2.0,), (5.0,)), ((m28_id,), (3.0,), (6.0,))}
+
+
+def test_continuous_data_saver(backend):
+    """Test saving continuous points with a writer pool"""
+    backend.register_codenames(['dummy_one', 'dummy_two'])
+    backend.register_codenames(['dummy_one'])
+    assert len(select(backend, 'SELECT codename FROM dateplots_descriptions')) == 2
+
+    pool = SqlWriterPool(None, None, connections=2, batch_size=10, backend=backend)
+    saver = ContinuousDataSaver('dateplots_dummy', None, None, backend=backend,
+                                measurement_codenames=['dummy_one', 'dummy_two'],
+                                writer_pool=pool)
+    saver.start()
+    for number in range(20):
+        saver.save_point('dummy_one', (1500000000.0 + number, number))
+        saver.save_point('dummy_two', (1500000000.0 + number, -number))
+    saver.stop()
+
+    type_one = saver.codename_translation['dummy_one']
+    points = zip(select(backend, 'SELECT type FROM dateplots_dummy'),
+                 select(backend, 'SELECT value FROM dateplots_dummy'))
+    assert sorted(value for (type_,), (value,) in points if type_ == type_one) \
+        == list(range(20))
+    times = select(backend, 'SELECT DISTINCT UNIX_TIMESTAMP(time) FROM dateplots_dummy')
+    assert sorted(times) == [(1500000000.0 + number,) for number in range(20)]
+
+    with pytest.raises(ValueError):
+        saver.add_continuous_measurement('dummy_unknown')
+
+
+def test_sqlite_placeholders(tmpdir):
+    """Test the translation of MySQL placeholders and the batch size"""
+    backend = SQLiteBackend(str(tmpdir.join('data.sqlite')))
+    connection = backend.connect()
+    cursor = connection.cursor()
+    cursor.execute('INSERT INTO dummy (a, b) VALUES (%s, %s)', (1, 'one'))
+    cursor.execute('INSERT INTO dummy (a, c) VALUES (%(a)s, %(c)s)', {'a': 2, 'c': 2.5})
+    connection.commit()
+    cursor.execute('SELECT id, a, b, c FROM dummy ORDER BY id')
+    assert cursor.fetchall() == [(1, 1, 'one', None), (2, 2, None, 2.5)]
+    assert 0 < backend.batchsize(cursor) < 32766
+    connection.close()
+
+
+def test_sqlite_errors(tmpdir):
+    """Test that only the errors of a locked database are the OperationalError of the
+    SQLite backend
+    """
+    backend = SQLiteBackend(str(tmpdir.join('data.sqlite')), timeout=0.0)
+    locking = backend.connect()
+    locking.cursor().execute('INSERT INTO dummy (a) VALUES (%s)', (1,))
+    cursor = backend.connect().cursor()
+    # The first connection has not committed, so it holds the write lock
+    with pytest.raises(backend.OperationalError):
+        cursor.execute('INSERT INTO dummy (a) VALUES (%s)', (2,))
+    for query in ('INSERT INTO dummy (a) VALUES (%s', 'SELECT a FROM missing'):
+        with pytest.raises(backend.Error) as exception:
+            cursor.execute(query, (2,) if '%s' in query else None)
+        assert not isinstance(exception.value, backend.OperationalError)
+    locking.close()
+
+
+def test_parquet_errors(tmpdir):
+    """Test that the queries the Parquet backend does not support raise ParquetError"""
+    if database_backends.pyarrow is None:
+        pytest.skip('pyarrow is not installed')
+    backend = ParquetBackend(str(tmpdir))
+    cursor = backend.connect().cursor()
+    for query, args in (('DELETE FROM dummy', None),
+                        ('INSERT INTO dummy (a, b) VALUES (%s, NOW())', (1,)),
+                        ('INSERT INTO dummy (a, b) VALUES (%s, %s)', (1,))):
+        with pytest.raises(ParquetError):
+            cursor.execute(query, args)
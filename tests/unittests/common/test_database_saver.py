@@ -0,0 +1,472 @@
+# pylint: disable=protected-access,redefined-outer-name
+
+"""Unit tests for the database_saver module"""
+
+from __future__ import unicode_literals
+
+import time
+import threading
+import mock
+import numpy
+import pytest
+
+from PyExpLabSys.common import database_saver
+from PyExpLabSys.common.database_backends import SQLiteBackend
+from PyExpLabSys.common.database_saver import (
+    SqlSaver, SqlSpool, LaneQueue, SqlWriterPool, DataSetSaver, ContinuousDataSaver,
+    LANE_CONTINUOUS, LANE_BULK,
+)
+from PyExpLabSys.common.supported_versions import python2_and_3
+python2_and_3(__file__)
+
+
+INSERT = 'INSERT INTO dummy (a, b) VALUES (%s, %s)'
+INSERT_TIME = 'INSERT INTO dummy (a, time) VALUES (%s, FROM_UNIXTIME(%s))'
+
+
+@pytest.fixture
+def backend(tmpdir):
+    """Return a SQLite backend in a temporary directory"""
+    return SQLiteBackend(str(tmpdir.join('data.sqlite')))
+
+
+class FailingBackend(SQLiteBackend):
+    """A SQLite backend, whose connect and execute raise OperationalError while fail
+    is set, and whose execute raises after executes_left more executions
+    """
+
+    fail = False
+    executes_left = None
+
+    def connect(self):
+        if self.fail:
+            raise self.OperationalError('The database is down')
+        return FailingConnection(self, super(FailingBackend, self).connect())
+
+
+class FailingConnection(object):
+    """A connection that returns a FailingCursor"""
+
+    def __init__(self, backend, connection):
+        self.backend = backend
+        self.connection = connection
+
+    def cursor(self):
+        """Return a FailingCursor"""
+        return FailingCursor(self.backend, self.connection.cursor())
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+
+class FailingCursor(object):
+    """A cursor whose execute raises OperationalError while the backend fails"""
+
+    def __init__(self, backend, cursor):
+        self.backend = backend
+        self.cursor = cursor
+
+    def execute(self, query, args=None):
+        """Execute the query, unless the backend fails"""
+        if self.backend.fail or self.backend.executes_left == 0:
+            raise self.backend.OperationalError('The database is down')
+        if self.backend.executes_left is not None:
+            self.backend.executes_left -= 1
+        return self.cursor.execute(query, args)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+@pytest.fixture
+def failing_backend(tmpdir):
+    """Return a FailingBackend in a temporary directory"""
+    return FailingBackend(str(tmpdir.join('data.sqlite')))
+
+
+def select(backend, query):
+    """Return all rows of a query"""
+    connection = backend.connect()
+    cursor = connection.cursor()
+    cursor.execute(query)
+    rows = cursor.fetchall()
+    connection.close()
+    return rows
+
+
+class TestGroupCommit(object):
+    """Test the batching and merging of queries in SqlSaver"""
+
+    def test_single_row_insert(self):
+        """Test which queries SINGLE_ROW_INSERT splits in the prefix and the values"""
+        match = database_saver.SINGLE_ROW_INSERT.match(INSERT_TIME + ';')
+        assert match.groups() == ('INSERT INTO dummy (a, time) VALUES ',
+                                  '(%s, FROM_UNIXTIME(%s))')
+        for query in ('INSERT INTO dummy (a) VALUES (%s), (%s)', 'SELECT a FROM dummy',
+                      'UPDATE dummy SET a=%s'):
+            assert database_saver.SINGLE_ROW_INSERT.match(query) is None
+
+    def test_group_merge(self):
+        """Test that consecutive single row inserts are merged into multi row inserts"""
+        batch = [(INSERT, (1, 2)), (INSERT, [3, 4]), (INSERT_TIME, (5, 6.0)),
+                 (INSERT_TIME, (7, 8.0)), (INSERT, (9, 10))]
+        assert SqlSaver._group(batch) == [
+            ('INSERT INTO dummy (a, b) VALUES (%s, %s), (%s, %s)', [1, 2, 3, 4]),
+            ('INSERT INTO dummy (a, time) VALUES (%s, FROM_UNIXTIME(%s)), '
+             '(%s, FROM_UNIXTIME(%s))', [5, 6.0, 7, 8.0]),
+            (INSERT, (9, 10)),
+        ]
+
+    def test_group_no_merge(self):
+        """Test that queries that cannot be merged are left as they are"""
+        multi_row = 'INSERT INTO dummy (a) VALUES (%s), (%s)'
+        named = 'INSERT INTO dummy (a, b) VALUES (%(a)s, %(b)s)'
+        duplicate = INSERT + ' ON DUPLICATE KEY UPDATE b=b'
+        batch = [(multi_row, (1, 2)), (multi_row, (3, 4)),
+                 ('UPDATE dummy SET a=%s', (1,)), ('UPDATE dummy SET a=%s', (2,)),
+                 (named, {'a': 1, 'b': 2}), (named, {'a': 3, 'b': 4}),
+                 (duplicate, (1, 2)), (duplicate, (3, 4)),
+                 (INSERT, (1,)), (INSERT, (2,))]
+        assert SqlSaver._group(batch) == batch
+
+    def test_get_batch_size(self, backend):
+        """Test that a batch is at most batch_size long and ended by STOP"""
+        saver = SqlSaver(None, None, batch_size=3, backend=backend)
+        for number in range(4):
+            saver.enqueue_query(INSERT, (number, number))
+        saver.queue.put(('STOP', None))
+        saver.enqueue_query(INSERT, (4, 4))
+        assert saver._get_batch() == [(INSERT, (number, number)) for number in range(3)]
+        assert saver._get_batch() == [(INSERT, (3, 3)), ('STOP', None)]
+        assert saver._get_batch() == [(INSERT, (4, 4))]
+
+    def test_get_batch_wait(self, backend):
+        """Test that the batch waits up to batch_wait for more queries"""
+        saver = SqlSaver(None, None, batch_size=3, backend=backend)
+        saver.enqueue_query(INSERT, (0, 0))
+        timer = threading.Timer(0.1, saver.enqueue_query, (INSERT, (1, 1)))
+        timer.start()
+        # Without batch_wait, only the queries already in the queue are batched
+        assert saver._get_batch() == [(INSERT, (0, 0))]
+        timer.join()
+        assert saver._get_batch() == [(INSERT, (1, 1))]
+
+        saver.batch_wait = 0.5
+        saver.enqueue_query(INSERT, (2, 2))
+        timer = threading.Timer(0.1, saver.enqueue_query, (INSERT, (3, 3)))
+        timer.start()
+        start = time.time()
+        assert saver._get_batch() == [(INSERT, (2, 2)), (INSERT, (3, 3))]
+        # The batch is not full, so it waited until the deadline
+        assert time.time() - start >= 0.5
+
+    def test_commit(self, backend):
+        """Test that a batch of single row inserts is written in one commit"""
+        saver = SqlSaver(None, None, batch_size=10, backend=backend)
+        for number in range(5):
+            saver.enqueue_query(INSERT, (number, -number))
+        saver.start()
+        saver.stop()
+        assert saver.commits == 1
+        assert saver.rows == saver.rows_per_commit == 5
+        assert select(backend, 'SELECT a, b FROM dummy ORDER BY id') ==\
+            [(number, -number) for number in range(5)]
+
+
+class TestSpool(object):
+    """Test the spooling of queries in SqlSaver"""
+
+    @staticmethod
+    def _queries(numbers):
+        """Return the (query, args) elements for numbers"""
+        return [(INSERT, (number, number)) for number in numbers]
+
+    def test_spool(self, tmpdir):
+        """Test that the spool keeps the elements in order and survives a reopen"""
+        path = str(tmpdir.join('spool.sqlite'))
+        spool = SqlSpool(path)
+        spool.append(self._queries([3, 4]))
+        spool.prepend(self._queries([1, 2]))
+        spool.append([('DELETE FROM dummy', None)])
+        assert len(spool) == 5
+        elements = spool.read(3)
+        assert [element[1:] for element in elements] == self._queries([1, 2, 3])
+        spool.remove(elements[1][0])
+        spool.close()
+
+        spool = SqlSpool(path)
+        assert [element[1:] for element in spool.read(10)] ==\
+            self._queries([3, 4]) + [('DELETE FROM dummy', None)]
+        spool.close()
+
+    def test_spool_threshold(self, tmpdir, backend):
+        """Test that queries are spooled from the threshold on"""
+        saver = SqlSaver(None, None, spool_path=str(tmpdir.join('spool.sqlite')),
+                         spool_threshold=2, backend=backend)
+        for number in range(5):
+            saver.enqueue_query(INSERT, (number, number))
+        assert saver._spooling
+        assert [saver.queue.get_nowait() for _ in range(2)] == self._queries(range(2))
+        # Once spooling, the queries keep going to the spool, also with an empty queue
+        saver.enqueue_query(INSERT, (5, 5))
+        assert saver.queue.empty()
+        assert [element[1:] for element in saver.spool.read(10)] ==\
+            self._queries(range(2, 6))
+
+    @pytest.mark.parametrize('fail_on', ['connect', 'execute'])
+    def test_spool_batch(self, tmpdir, failing_backend, fail_on):
+        """Test that a failed batch and the rest of the queue are moved, in order, in
+        front of the spool
+        """
+        failing_backend.fail = fail_on == 'connect'
+        saver = SqlSaver(None, None, batch_size=2,
+                         spool_path=str(tmpdir.join('spool.sqlite')), spool_threshold=4,
+                         backend=failing_backend)
+        for number in range(6):
+            saver.enqueue_query(INSERT, (number, number))
+        saver.queue.put(('STOP', None))
+        failing_backend.fail = True
+
+        saver._commit_batch(saver._get_batch())
+        assert [element[1:] for element in saver.spool.read(10)] ==\
+            self._queries(range(6))
+        assert saver._spooling
+        # The STOP is put back in the queue
+        assert saver.queue.get_nowait() == ('STOP', None)
+        assert saver.queue.empty()
+
+    @pytest.mark.parametrize('spool', [True, False], ids=['spool', 'no_spool'])
+    def test_failed_batch_rolled_back(self, tmpdir, failing_backend, spool):
+        """Test that the executed part of a failed batch is rolled back, so that each
+        row is written once on the retry
+        """
+        named = 'INSERT INTO dummy (a, b) VALUES (%(a)s, %(b)s)'
+        saver = SqlSaver(None, None, batch_size=10, backend=failing_backend,
+                         spool_path=str(tmpdir.join('spool.sqlite')) if spool else None)
+        # The named queries are not merged, so the third one fails in the middle
+        batch = [(named, {'a': number, 'b': number}) for number in range(4)]
+        failing_backend.executes_left = 2
+
+        def reconnect():
+            """Let the retry succeed, on the same connection"""
+            failing_backend.executes_left = None
+        with mock.patch.object(saver, '_reconnect', side_effect=reconnect):
+            saver._commit_batch(batch)
+        if spool:
+            # The replay also fails in the middle the first time
+            failing_backend.executes_left = 1
+            with mock.patch.object(saver, '_reconnect'):
+                assert saver._replay_spool() is False
+            failing_backend.executes_left = None
+            while saver._spooling:
+                saver._replay_spool()
+        assert select(failing_backend, 'SELECT a FROM dummy ORDER BY id') ==\
+            [(number,) for number in range(4)]
+
+    @pytest.mark.parametrize('spool', [True, False], ids=['spool', 'no_spool'])
+    def test_bad_query_dropped(self, tmpdir, backend, spool):
+        """Test that a query that raises another error than OperationalError is dropped
+        and the rest of the queries written, instead of retried
+        """
+        saver = SqlSaver(None, None, batch_size=10, backend=backend,
+                         spool_path=str(tmpdir.join('spool.sqlite')) if spool else None,
+                         spool_threshold=0 if spool else 1000)
+        for number in range(4):
+            if number == 2:
+                saver.enqueue_query('INSERT INTO dummy (a, b) VALUES (%s, %s', (9, 9))
+            saver.enqueue_query(INSERT, (number, number))
+        with mock.patch.object(saver, '_reconnect') as reconnect:
+            saver.start()
+            saver.stop()
+        assert reconnect.call_count == 0
+        assert select(backend, 'SELECT a FROM dummy ORDER BY id') ==\
+            [(number,) for number in range(4)]
+        if spool:
+            saver.spool = SqlSpool(str(tmpdir.join('spool.sqlite')))
+            assert len(saver.spool) == 0
+
+    def test_replay_spool(self, tmpdir, failing_backend):
+        """Test that the spool is replayed oldest first and emptied"""
+        saver = SqlSaver(None, None, spool_path=str(tmpdir.join('spool.sqlite')),
+                         spool_threshold=0, backend=failing_backend)
+        for number in range(5):
+            saver.enqueue_query(INSERT, (number, number))
+        failing_backend.fail = True
+        with mock.patch.object(database_saver, 'SPOOL_REPLAY_SIZE', 2):
+            with mock.patch.object(saver, '_reconnect') as reconnect:
+                assert saver._replay_spool() is False
+            assert reconnect.call_count == 1
+            assert len(saver.spool) == 5
+
+            failing_backend.fail = False
+            assert saver._replay_spool() is True
+            assert [element[1:] for element in saver.spool.read(10)] ==\
+                self._queries(range(2, 5))
+            assert select(failing_backend, 'SELECT a FROM dummy ORDER BY id') ==\
+                [(0,), (1,)]
+            while len(saver.spool) > 0:
+                assert saver._replay_spool() is True
+        assert saver._spooling
+        assert saver._replay_spool() is True
+        assert not saver._spooling
+        assert select(failing_backend, 'SELECT a FROM dummy ORDER BY id') ==\
+            [(number,) for number in range(5)]
+
+    def test_restart(self, tmpdir, backend):
+        """Test that a saver started with a non-empty spool spools and replays it"""
+        path = str(tmpdir.join('spool.sqlite'))
+        saver = SqlSaver(None, None, spool_path=path, spool_threshold=0,
+                         backend=backend)
+        for number in range(3):
+            saver.enqueue_query(INSERT, (number, number))
+        saver.spool.close()
+
+        saver = SqlSaver(None, None, spool_path=path, backend=backend)
+        assert saver._spooling
+        saver.enqueue_query(INSERT, (3, 3))
+        assert saver.queue.empty()
+        saver.start()
+        saver.stop()
+        assert select(backend, 'SELECT a FROM dummy ORDER BY id') ==\
+            [(number,) for number in range(4)]
+        assert len(SqlSpool(path)) == 0
+
+
+class TestWriterPool(object):
+    """Test the LaneQueue and the SqlWriterPool"""
+
+    def test_lane_queue(self):
+        """Test that the lowest lane goes first and STOP only when all lanes are empty"""
+        queue = LaneQueue(lanes=2)
+        queue.put(('STOP', None))
+        queue.put(('bulk', 1, LANE_BULK))
+        queue.put(('continuous', 1, LANE_CONTINUOUS))
+        queue.put(('bulk', 2, LANE_BULK))
+        queue.put(('continuous', 2))
+        assert queue.qsize() == 5
+        assert [queue.get_nowait() for _ in range(5)] == [
+            ('continuous', 1), ('continuous', 2), ('bulk', 1), ('bulk', 2),
+            ('STOP', None),
+        ]
+        assert queue.empty()
+
+    def test_enqueue_lane(self, backend):
+        """Test that enqueue_query only accepts the lanes of the queue"""
+        pool = SqlWriterPool(None, None, connections=1, backend=backend)
+        pool.enqueue_query(INSERT, (1, 1), lane=LANE_BULK)
+        assert pool.queue.get_nowait() == (INSERT, (1, 1))
+        for lane in (-1, 2, None):
+            with pytest.raises(ValueError):
+                pool.enqueue_query(INSERT, (1, 1), lane=lane)
+        assert pool.queue.empty()
+
+    def test_stop(self, backend):
+        """Test that stop empties the queue and stops all the savers"""
+        pool = SqlWriterPool(None, None, connections=3, batch_size=5, backend=backend)
+        pool.start()
+        for number in range(50):
+            pool.enqueue_query(INSERT, (number, number), lane=number % 2)
+        pool.stop()
+        assert not any(sql_saver.is_alive() for sql_saver in pool.sql_savers)
+        assert pool.queue.empty()
+        assert sorted(select(backend, 'SELECT a FROM dummy')) ==\
+            [(number,) for number in range(50)]
+        # Stopping again does nothing
+        pool.stop()
+
+    def test_users(self, backend):
+        """Test that the pool runs while it has users and can be restarted"""
+        pool = SqlWriterPool(None, None, connections=2, backend=backend)
+        first, second = pool.handle(), pool.handle()
+        first.start()
+        first.start()
+        second.start()
+        sql_savers = pool.sql_savers
+        assert all(sql_saver.is_alive() for sql_saver in sql_savers)
+        first.stop()
+        first.stop()
+        assert all(sql_saver.is_alive() for sql_saver in sql_savers)
+        second.enqueue_query(INSERT, (1, 1))
+        second.stop()
+        assert not any(sql_saver.is_alive() for sql_saver in sql_savers)
+
+        # A restarted pool gets new savers
+        first.start()
+        assert all(sql_saver.is_alive() for sql_saver in pool.sql_savers)
+        assert not set(pool.sql_savers) & set(sql_savers)
+        first.enqueue_query(INSERT, (2, 2), lane=LANE_BULK)
+        first.stop()
+        assert not any(sql_saver.is_alive() for sql_saver in pool.sql_savers)
+        assert sorted(select(backend, 'SELECT a FROM dummy')) == [(1,), (2,)]
+
+
+    def test_backend(self, tmpdir, backend):
+        """Test that the savers use the backend of the pool"""
+        pool = SqlWriterPool(None, None, connections=1, backend=backend)
+        assert pool.backend is backend
+        assert all(sql_saver.backend is backend for sql_saver in pool.sql_savers)
+        other = SQLiteBackend(str(tmpdir.join('other.sqlite')))
+        for saver_class, args in ((DataSetSaver, ('measurements_dummy',
+                                                  'xy_values_dummy', None, None)),
+                                  (ContinuousDataSaver, ('dateplots_dummy', None, None))):
+            saver = saver_class(*args, writer_pool=pool)
+            assert saver.backend is backend
+            saver = saver_class(*args, writer_pool=pool, backend=backend)
+            assert saver.backend is backend
+            with pytest.raises(ValueError):
+                saver_class(*args, writer_pool=pool, backend=other)
+
+
+class TestSavePointsBatch(object):
+    """Test DataSetSaver.save_points_batch"""
+
+    @pytest.fixture
+    def saver(self, backend):
+        """Return a DataSetSaver with the measurement M2"""
+        saver = DataSetSaver('measurements_dummy', 'xy_values_dummy', None, None,
+                             backend=backend)
+        saver.add_measurement('M2', {'type': 5})
+        return saver
+
+    @staticmethod
+    def _dequeued(saver):
+        """Return the args of the enqueued queries"""
+        queue = saver.sql_saver.queue
+        return [queue.get_nowait()[1] for _ in range(queue.qsize())]
+
+    def test_vectorized(self, saver):
+        """Test that numeric values are converted to floats in bulk and batched"""
+        stats = saver.save_points_batch('M2', numpy.arange(5), range(5, 10), batchsize=2)
+        assert stats['points'] == 5
+        assert stats['batches'] == 3
+        assert stats['batchsize'] == 2
+        assert stats['enqueue_duration'] >= 0
+        args = self._dequeued(saver)
+        assert args == [[0.0, 5.0, 1.0, 6.0], [2.0, 7.0, 3.0, 8.0], [4.0, 9.0]]
+        assert all(isinstance(value, float) for batch in args for value in batch)
+
+    @pytest.mark.parametrize('use_numpy', [True, False], ids=['numpy', 'no_numpy'])
+    def test_fallback(self, saver, use_numpy):
+        """Test that None and non-numeric values are saved point by point as they are"""
+        x_values, y_values = [1, None, 'a'], [2, float('nan'), 3]
+        with mock.patch.object(database_saver, 'numpy', numpy if use_numpy else None):
+            saver.save_points_batch('M2', x_values, y_values, batchsize=10)
+            saver.save_points_batch('M2', x_values[:2], y_values[:2], batchsize=10)
+        args = self._dequeued(saver)
+        assert args[0] == [1, 2, None, y_values[1], 'a', 3]
+        assert args[1] == [1, 2, None, y_values[1]]
+        assert not isinstance(args[1][1], float)
+
+        with pytest.raises(ValueError):
+            saver.save_points_batch('M2', [1, 2], [1])
+        with pytest.raises(ValueError):
+            saver.save_points_batch('M28', [1], [1])
+
+    def test_get_batchsize(self, saver):
+        """Test that the batch size is asked from the backend once and used as default"""
+        with mock.patch.object(saver.backend, 'batchsize', return_value=2) as batchsize:
+            assert saver.get_batchsize() == 2
+            stats = saver.save_points_batch('M2', [1.0, 2.0, 3.0], [4.0, 5.0, 6.0])
+        assert stats['batchsize'] == 2
+        assert stats['batches'] == 2
+        batchsize.assert_called_once_with(saver.cursor)
@@ -0,0 +1,106 @@
+# pylint: disable=protected-access
+
+"""Unit tests for the serialization module"""
+
+from __future__ import unicode_literals
+
+import json
+import math
+import mock
+import pytest
+
+from PyExpLabSys.common import serialization
+from PyExpLabSys.common.serialization import dumps, loads, packb, unpackb
+from PyExpLabSys.common.supported_versions import python2_and_3
+python2_and_3(__file__)
+
+
+SERIALIZATION_PATH = 'PyExpLabSys.common.serialization.{}'
+OBJECTS = [
+    None, True, False, 0, 1, 127, 128, 255, 256, 65536, 2 ** 32, 2 ** 64 - 1, -1, -32,
+    -33, -128, -129, -32768, -32769, -2 ** 31 - 1, -2 ** 63, 1.5, -2.25E300, '', 'a' * 31,
+    'a' * 32, 'a' * 256, 'a' * 65536, 'æøå', b'', b'\x00\xff', b'a' * 256, [], [1] * 15,
+    [1] * 16, [1] * 65536, {}, {'a': 1}, {str(n): n for n in range(16)},
+    {'codename': [1414150015.697648, 47.0], 'status': 'OLD_DATA', 'on': True},
+]
+
+
+def test_json():
+    """Test that the JSON is the same as the standard library produces and reads"""
+    obj = {'codename': [1414150015.697648, 47.0], 'status': 'OLD_DATA', 'nan': None}
+    assert dumps(obj) == json.dumps(obj)
+    assert loads(dumps(obj)) == obj
+    assert loads(dumps(obj).encode('utf-8')) == obj
+    # NaN is valid for the standard library, but not for all fast implementations
+    assert math.isnan(loads('[NaN]')[0])
+    with pytest.raises(ValueError):
+        loads('nonsense')
+
+
+def test_fast_dumps():
+    """Test that the fast encoder is used only where it gives the same objects as the
+    standard library
+    """
+    if serialization.orjson is None:
+        pytest.skip('orjson is not installed')
+    obj = {'codename': [1414150015.697648, 47.0], 'status': 'OLD_DATA', 'on': True}
+    with mock.patch(SERIALIZATION_PATH.format('FAST_DUMPS'), True):
+        assert dumps(obj) == json.dumps(obj, separators=(',', ':'))
+        assert dumps((1, 2.5)) == '[1,2.5]'
+        # NaN, infinity, None, non-ASCII, non-string keys and large ints fall back
+        for special in ([float('nan')], [float('inf')], [None], ['æøå'], {1: 2},
+                        [2 ** 64]):
+            assert dumps(special) == json.dumps(special)
+    with mock.patch(SERIALIZATION_PATH.format('FAST_DUMPS'), False):
+        assert dumps(obj) == json.dumps(obj)
+
+
+@pytest.mark.parametrize('use_msgpack', [False, True], ids=['builtin', 'msgpack'])
+def test_msgpack_round_trip(use_msgpack):
+    """Test encoding and decoding the supported types"""
+    if use_msgpack and serialization.msgpack is None:
+        pytest.skip('msgpack is not installed')
+    msgpack = serialization.msgpack if use_msgpack else None
+    with mock.patch(SERIALIZATION_PATH.format('msgpack'), msgpack):
+        for obj in OBJECTS:
+            assert unpackb(packb(obj)) == obj
+        assert unpackb(packb((1.0, 2.0))) == [1.0, 2.0]
+
+
+def test_msgpack_format():
+    """Test the builtin encoding against known MessagePack data"""
+    with mock.patch(SERIALIZATION_PATH.format('msgpack'), None):
+        assert packb({'a': [1, -1, None]}) == b'\x81\xa1a\x93\x01\xff\xc0'
+        assert packb(1.0) == b'\xcb\x3f\xf0\x00\x00\x00\x00\x00\x00'
+        assert packb(200) == b'\xcc\xc8'
+        assert packb(-200) == b'\xd1\xff\x38'
+        assert packb('a' * 32)[:2] == b'\xd9\x20'
+        assert packb(b'ab') == b'\xc4\x02ab'
+        # float32 is decoded, although it is never encoded
+        assert unpackb(b'\xca\x3f\xc0\x00\x00') == 1.5
+
+
+def test_msgpack_errors():
+    """Test encoding and decoding errors"""
+    with mock.patch(SERIALIZATION_PATH.format('msgpack'), None):
+        with pytest.raises(TypeError):
+            packb(object())
+        with pytest.raises(ValueError):
+            packb(2 ** 64)
+        for data in (b'', b'\x92\x01', b'\xa5abc', b'\x01\x02', b'\xc1', b'\x81\x90\x01'):
+            with pytest.raises(ValueError):
+                unpackb(data)
+
+
+def test_msgpack_depth():
+    """Test that the builtin decoder rejects too deeply nested data with ValueError"""
+    depth = serialization.MSGPACK_MAX_DEPTH
+    with mock.patch(SERIALIZATION_PATH.format('msgpack'), None):
+        nested = unpackb(b'\x91' * depth + b'\x01')
+        for _ in range(depth):
+            nested, = nested
+        assert nested == 1
+        for data in (b'\x91' * (depth + 1) + b'\x01', b'\x91' * 2000,
+                     b'\x81\x01' * 2000):
+            with pytest.raises(ValueError):
+                unpackb(data)
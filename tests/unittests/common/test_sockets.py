@@ -6,18 +6,24 @@
 from __future__ import unicode_literals, print_function
 
 import sys
+import math
 import time
+import struct
 import mock
 import json
 import collections
 import socket
+import threading
+import functools
 import pytest
 from numpy import isclose
 from PyExpLabSys.common import sockets
 from PyExpLabSys.common.sockets import (
     bool_translate, socket_server_status, PullUDPHandler, CommonDataPullSocket, DataPullSocket,
-    DateDataPullSocket, PushUDPHandler, DataPushSocket, CallBackThread
+    DateDataPullSocket, PushUDPHandler, DataPushSocket, CallBackThread, LiveSocket
 )
+from PyExpLabSys.common import serialization
+from PyExpLabSys.common.serialization import packb, unpackb
 from PyExpLabSys.common.supported_versions import python2_and_3
 python2_and_3(__file__)
 
@@ -34,19 +40,25 @@ SOCKET_NAME = 'my_socket'
 FIRTS_MEASUREMENT_NAME = 'my_measurement'
 SECOND_MEASUREMENT_NAME = 'my_measurement2'
 CODENAMES = [FIRTS_MEASUREMENT_NAME, SECOND_MEASUREMENT_NAME]
-SINGLE_DATA = {PORT: {'data': {FIRTS_MEASUREMENT_NAME: (42.0, 47.0)}}}
-ALL_DATA = {PORT: {
-    'data': {
-        FIRTS_MEASUREMENT_NAME: (42.0, 47.0),
-        SECOND_MEASUREMENT_NAME: (17.0, 1.0),
-    },
-    'name': NAME,
-    'codenames': [FIRTS_MEASUREMENT_NAME, SECOND_MEASUREMENT_NAME],
-}}
+SINGLE_POINTS = {FIRTS_MEASUREMENT_NAME: (42.0, 47.0)}
+ALL_POINTS = {
+    FIRTS_MEASUREMENT_NAME: (42.0, 47.0),
+    SECOND_MEASUREMENT_NAME: (17.0, 1.0),
+}
 SOCKETS_PATH = 'PyExpLabSys.common.sockets.{}'
 ANY_RETURN = 'any_return_value'
 
 
+### Helpers
+def pull_socket_state(codenames, points, timeouts=None):
+    """Return a PullSocketState with points set"""
+    state = sockets.PullSocketState(NAME, codenames, (0.0, 0.0), timeouts,
+                                    {'check_activity': False}, None)
+    for codename in codenames:
+        state.set_point(codename, points[codename], points[codename][0])
+    return state
+
+
 ### Fixtures
 @pytest.fixture
 def mocket():
@@ -56,18 +68,18 @@ def mocket():
 
 @pytest.yield_fixture
 def sockets_data_single():
-    """A fixture for replaced sockets.DATA with SINGLE_DATA"""
+    """A fixture for replaced sockets.DATA with a state with SINGLE_POINTS"""
     old_data = sockets.DATA
-    sockets.DATA = SINGLE_DATA
+    sockets.DATA = {PORT: pull_socket_state([FIRTS_MEASUREMENT_NAME], SINGLE_POINTS)}
     yield sockets.DATA
     sockets.DATA = old_data
 
 
 @pytest.yield_fixture
 def sockets_data_all():
-    """A fixture for replaced sockets.DATA with ALL_DATA"""
+    """A fixture for replaced sockets.DATA with a state with ALL_POINTS"""
     old_data = sockets.DATA
-    sockets.DATA = ALL_DATA
+    sockets.DATA = {PORT: pull_socket_state(CODENAMES, ALL_POINTS)}
     yield sockets.DATA
     sockets.DATA = old_data
 
@@ -140,6 +152,16 @@ def test_bool_translate():
             bool_translate(non_valid)
 
 
+def test_split_request_id():
+    """Test the split_request_id function"""
+    assert sockets.split_request_id(b'&17&json_wn') == (b'&17&', b'json_wn')
+    assert sockets.split_request_id(b'&5&a&b#raw') == (b'&5&', b'a&b#raw')
+    # Only digits at the start of the request are an ID, codenames may contain the mark
+    for request in (b'json_wn', b'&&json_wn', b'&17json_wn', b'&' + b'1' * 33 + b'&name',
+                    b'&abc&a#raw', b'a&1&b#raw'):
+        assert sockets.split_request_id(request) == (b'', request)
+
+
 def test_socket_server_status():
     """Test the socket_server_status function"""
     # Save the current value of DATA
@@ -177,6 +199,19 @@ def test_socket_server_status():
     })
     status = socket_server_status()
     assert status[9876]['status'] == 'INACTIVE'
+    assert 'metrics' not in status[9876]
+
+    # Test that the metrics summary is included
+    sockets.DATA[9876]['metrics'] = sockets.SocketMetrics()
+    sockets.DATA[9876]['metrics'].record('name', 4, 10, 0.001)
+    summary = socket_server_status()[9876]['metrics']
+    assert summary['requests'] == 1
+    assert summary['bytes_out'] == 10
+
+    # Test that the status of a bounded queue is included
+    sockets.DATA[9876]['queue'] = sockets.PushQueue(5, 'coalesce')
+    assert socket_server_status()[9876]['queue'] ==\
+        {'size': 0, 'maxsize': 5, 'overflow': 'coalesce', 'dropped': 0}
 
     # Clean up DATA
     sockets.DATA = old_data
@@ -185,7 +220,7 @@ def test_socket_server_status():
 class TestPullUDPHandler(object):
     """Test the PullUDPHandler"""
 
-    def test_handle_single_val_and_port(self, mocket, server):
+    def test_handle_single_val_and_port(self, mocket, server, sockets_data_all):
         """Test the handle method single value case"""
         request = b'dummy#request'
         mock_return_value = 'mock return value'
@@ -206,7 +241,7 @@ class TestPullUDPHandler(object):
 
         assert handler.port == PORT
 
-    def test_handle_all_value(self, mocket, server):
+    def test_handle_all_value(self, mocket, server, sockets_data_all):
         """Test the handle method all values case"""
         request = b'dummy_request'
         mock_return_value = 'mock return value'
@@ -227,80 +262,136 @@ class TestPullUDPHandler(object):
 
     def test_single_raw(self, pull_udp_handler, sockets_data_single):
         """Test the _single_value raw case"""
-        with mock.patch(SOCKETS_PATH.format('PullUDPHandler._old_data')) as _old_data:
-            _old_data.return_value = False
+        with mock.patch(SOCKETS_PATH.format('PullUDPHandler._points')) as _points:
+            _points.return_value = [(42.0, 47.0)]
             assert pull_udp_handler._single_value(FIRTS_MEASUREMENT_NAME + '#raw')\
                 == '42.0,47.0'
-            _old_data.assert_called_once_with(FIRTS_MEASUREMENT_NAME)
+            _points.assert_called_once_with([FIRTS_MEASUREMENT_NAME])
 
     def test_single_json(self, pull_udp_handler, sockets_data_single):
         """Test the _single_value json case"""
-        with mock.patch(SOCKETS_PATH.format('PullUDPHandler._old_data')) as _old_data:
-            _old_data.return_value = False
-            assert pull_udp_handler._single_value(FIRTS_MEASUREMENT_NAME + '#json')\
-                == '[42.0, 47.0]'
-            _old_data.assert_called_once_with(FIRTS_MEASUREMENT_NAME)
+        with mock.patch(SOCKETS_PATH.format('PullUDPHandler._points')) as _points:
+            _points.return_value = [(42.0, 47.0)]
+            assert json.loads(
+                pull_udp_handler._single_value(FIRTS_MEASUREMENT_NAME + '#json')
+            ) == [42.0, 47.0]
+            _points.assert_called_once_with([FIRTS_MEASUREMENT_NAME])
 
     def test_single_old(self, pull_udp_handler, sockets_data_single):
         """Test the _single_value old data case"""
         # raw case
-        with mock.patch(SOCKETS_PATH.format('PullUDPHandler._old_data')) as _old_data:
-            _old_data.return_value = True
+        with mock.patch(SOCKETS_PATH.format('PullUDPHandler._points')) as _points:
+            _points.return_value = [sockets.OLD_DATA]
             assert pull_udp_handler._single_value(FIRTS_MEASUREMENT_NAME + '#raw')\
                 == 'OLD_DATA'
-            _old_data.assert_called_once_with(FIRTS_MEASUREMENT_NAME)
+            _points.assert_called_once_with([FIRTS_MEASUREMENT_NAME])
 
         # json case
-        with mock.patch(SOCKETS_PATH.format('PullUDPHandler._old_data')) as _old_data:
-            _old_data.return_value = True
+        with mock.patch(SOCKETS_PATH.format('PullUDPHandler._points')) as _points:
+            _points.return_value = [sockets.OLD_DATA]
             assert pull_udp_handler._single_value(FIRTS_MEASUREMENT_NAME + '#json')\
                 == '"OLD_DATA"'
-            _old_data.assert_called_once_with(FIRTS_MEASUREMENT_NAME)
+            _points.assert_called_once_with([FIRTS_MEASUREMENT_NAME])
 
     def test_single_unknown_command(self, pull_udp_handler, sockets_data_single):
         """Test the _single_value unknown command case"""
         assert pull_udp_handler._single_value(FIRTS_MEASUREMENT_NAME + '#nonsense')\
                 == sockets.UNKNOWN_COMMAND
+        assert pull_udp_handler._single_value('nonsense#raw') == sockets.UNKNOWN_COMMAND
+
+    @pytest.mark.parametrize('data_format, expected', [
+        ('raw', '17.0,1.0;42.0,47.0'),
+        ('json', serialization.dumps([[17.0, 1.0], [42.0, 47.0]])),
+        ('raw_wn', '{1}:17.0,1.0;{0}:42.0,47.0'.format(*CODENAMES)),
+    ])
+    def test_selected(self, pull_udp_handler, sockets_data_all, data_format, expected):
+        """Test the _single_value selected codenames case"""
+        command = '{1},{0}#{2}'.format(*CODENAMES + [data_format])
+        assert pull_udp_handler._single_value(command) == expected
+
+    def test_selected_json_wn_and_old(self, pull_udp_handler, sockets_data_all):
+        """Test the _single_value selected codenames json_wn and old data case"""
+        command = '{1},{0}#json_wn'.format(*CODENAMES)
+        with mock.patch(SOCKETS_PATH.format('PullUDPHandler._points')) as _points:
+            _points.return_value = [sockets.OLD_DATA, (42.0, 47.0)]
+            expected = {FIRTS_MEASUREMENT_NAME: [42.0, 47.0],
+                        SECOND_MEASUREMENT_NAME: sockets.OLD_DATA}
+            assert json.loads(pull_udp_handler._single_value(command)) == expected
+            _points.assert_called_once_with([SECOND_MEASUREMENT_NAME, FIRTS_MEASUREMENT_NAME])
+
+    @pytest.mark.parametrize('command', [
+        '{}#nonsense'.format(','.join(CODENAMES)),
+        '{},nonsense#json'.format(FIRTS_MEASUREMENT_NAME),
+    ])
+    def test_selected_unknown(self, pull_udp_handler, sockets_data_all, command):
+        """Test the _single_value selected codenames unknown format and codename case"""
+        assert pull_udp_handler._single_value(command) == sockets.UNKNOWN_COMMAND
+
+    def test_binary(self, pull_udp_handler, sockets_data_all):
+        """Test the _binary_values method"""
+        codenames = CODENAMES + ['old']
+        with mock.patch(SOCKETS_PATH.format('PullUDPHandler._points')) as _points:
+            _points.return_value = [(42.0, 47.0), (17.0, 'RESET'), sockets.OLD_DATA]
+            packed = pull_udp_handler._binary_values(codenames)
+            _points.assert_called_once_with(codenames)
+
+        assert sockets.BINARY_HEADER.unpack_from(packed) ==\
+            (sockets.BINARY_MAGIC, sockets.BINARY_VERSION, 3)
+        flags = bytearray(packed[sockets.BINARY_HEADER.size:sockets.BINARY_HEADER.size + 3])
+        assert list(flags) == [0, sockets.BINARY_FLAG_NOT_NUMERIC,
+                               sockets.BINARY_FLAG_OLD_DATA]
+        values = struct.unpack_from('<6d', packed, sockets.BINARY_HEADER.size + 3)
+        assert values[:2] == (42.0, 47.0)
+        assert all(math.isnan(value) for value in values[2:])
+
+    def test_msgpack(self, pull_udp_handler, sockets_data_all):
+        """Test the MessagePack formats"""
+        points = [(42.0, 47.0), sockets.OLD_DATA]
+        with mock.patch(SOCKETS_PATH.format('PullUDPHandler._points')) as _points:
+            _points.return_value = points
+            assert unpackb(pull_udp_handler._values(CODENAMES, 'msgpack')) ==\
+                [[42.0, 47.0], sockets.OLD_DATA]
+            assert unpackb(pull_udp_handler._values(CODENAMES, 'msgpack_wn')) ==\
+                {CODENAMES[0]: [42.0, 47.0], CODENAMES[1]: sockets.OLD_DATA}
+            _points.return_value = points[:1]
+            command = '{}#msgpack'.format(CODENAMES[0])
+            assert unpackb(pull_udp_handler._single_value(command)) == [42.0, 47.0]
 
     def test_all_raw(self, pull_udp_handler, sockets_data_all):
         """Test the _all_values raw case"""
-        with mock.patch(SOCKETS_PATH.format('PullUDPHandler._old_data')) as _old_data:
-            _old_data.return_value = False
+        with mock.patch(SOCKETS_PATH.format('PullUDPHandler._points')) as _points:
+            _points.return_value = [(42.0, 47.0), (17.0, 1.0)]
             assert pull_udp_handler._all_values('raw')\
                 == '42.0,47.0;17.0,1.0'
-            calls = [mock.call(FIRTS_MEASUREMENT_NAME), mock.call(SECOND_MEASUREMENT_NAME)]
-            _old_data.assert_has_calls(calls)
+            _points.assert_called_once_with(CODENAMES)
 
     def test_all_json(self, pull_udp_handler, sockets_data_all):
         """Test the _all_values json case"""
-        with mock.patch(SOCKETS_PATH.format('PullUDPHandler._old_data')) as _old_data:
-            _old_data.return_value = False
-            assert pull_udp_handler._all_values('json')\
-                == '[[42.0, 47.0], [17.0, 1.0]]'
-            calls = [mock.call(FIRTS_MEASUREMENT_NAME), mock.call(SECOND_MEASUREMENT_NAME)]
-            _old_data.assert_has_calls(calls)
+        with mock.patch(SOCKETS_PATH.format('PullUDPHandler._points')) as _points:
+            _points.return_value = [(42.0, 47.0), (17.0, 1.0)]
+            assert json.loads(pull_udp_handler._all_values('json'))\
+                == [[42.0, 47.0], [17.0, 1.0]]
+            _points.assert_called_once_with(CODENAMES)
 
     def test_all_raw_with_names(self, pull_udp_handler, sockets_data_all):
         """Test the all values raw with names case"""
-        with mock.patch(SOCKETS_PATH.format('PullUDPHandler._old_data')) as _old_data:
-            _old_data.return_value = False
+        with mock.patch(SOCKETS_PATH.format('PullUDPHandler._points')) as _points:
+            _points.return_value = [(42.0, 47.0), (17.0, 1.0)]
             expected = '{}:42.0,47.0;{}:17.0,1.0'.format(FIRTS_MEASUREMENT_NAME,
                                                          SECOND_MEASUREMENT_NAME)
             assert pull_udp_handler._all_values('raw_wn') == expected
-            calls = [mock.call(FIRTS_MEASUREMENT_NAME), mock.call(SECOND_MEASUREMENT_NAME)]
-            _old_data.assert_has_calls(calls)
+            _points.assert_called_once_with(CODENAMES)
 
     def test_all_json_with_names(self, pull_udp_handler, sockets_data_all):
         """Test the all values json with names case"""
-        with mock.patch(SOCKETS_PATH.format('PullUDPHandler._old_data')) as _old_data:
-            _old_data.return_value = False
+        with mock.patch(SOCKETS_PATH.format('PullUDPHandler._points')) as _points:
+            _points.return_value = [(42.0, 47.0), (17.0, 1.0)]
             expected = {
                 FIRTS_MEASUREMENT_NAME: [42.0, 47.0],
                 SECOND_MEASUREMENT_NAME: [17.0, 1.0],
             }
             assert json.loads(pull_udp_handler._all_values('json_wn')) == expected
-            calls = [mock.call(FIRTS_MEASUREMENT_NAME), mock.call(SECOND_MEASUREMENT_NAME)]
-            _old_data.assert_has_calls(calls)
+            _points.assert_called_once_with(CODENAMES)
 
     def test_all_codenames_raw(self, pull_udp_handler, sockets_data_all):
         """Test the _all_values codenames raw case"""
@@ -333,45 +424,279 @@ class TestPullUDPHandler(object):
         """Test the all invalid command case"""
         assert pull_udp_handler._all_values('invalid_command') == sockets.UNKNOWN_COMMAND
 
-    def test_old_data_with_date_data(self, pull_udp_handler, sockets_data_single):
-        """Test the _old_date date data true case"""
-        sockets_data_single[PORT]['type'] = 'date'
-
-        # Test without a timeout
-        sockets_data_single[PORT]['timeouts'] = {}
-        assert pull_udp_handler._old_data(FIRTS_MEASUREMENT_NAME) is False
-
-        # Test with timeout and old data
-        sockets_data_single[PORT]['timeouts'] = {FIRTS_MEASUREMENT_NAME: 1.0}
-        sockets_data_single[PORT]['data'][FIRTS_MEASUREMENT_NAME] = (time.time() - 2.0, 47)
-        assert pull_udp_handler._old_data(FIRTS_MEASUREMENT_NAME) is True
-
-        # Test with timeout and new data
-        sockets_data_single[PORT]['data'][FIRTS_MEASUREMENT_NAME] = (time.time(), 47)
-        assert pull_udp_handler._old_data(FIRTS_MEASUREMENT_NAME) is False
+    def test_handle_cached(self, mocket, server, clean_data):
+        """Test that responses are cached and that set_point invalidates the cache"""
+        clean_data[PORT] = pull_socket_state([FIRTS_MEASUREMENT_NAME], SINGLE_POINTS,
+                                             timeouts=[None])
+        with mock.patch(SOCKETS_PATH.format('PullUDPHandler.handle')):
+            handler = PullUDPHandler((b'raw', mocket), CLIENT_ADDRESS, server)
 
-    def test_old_data_with_xy_data(self, pull_udp_handler, sockets_data_single):
-        """Test the _old_data xy data case"""
-        sockets_data_single[PORT]['type'] = 'data'
+        # First request renders, second is served from the cache
+        with mock.patch(SOCKETS_PATH.format('PullUDPHandler._all_values')) as _all_values:
+            _all_values.return_value = '42.0,47.0'
+            handler.handle()
+            handler.handle()
+            _all_values.assert_called_once_with('raw')
+        mocket.sendto.assert_has_calls([mock.call(b'42.0,47.0', CLIENT_ADDRESS)] * 2)
 
-        # Test without a timeout
-        sockets_data_single[PORT]['timeouts'] = {}
-        assert pull_udp_handler._old_data(FIRTS_MEASUREMENT_NAME) is False
+        # After invalidation, the response is rendered again
+        clean_data[PORT]['cache'].invalidate()
+        with mock.patch(SOCKETS_PATH.format('PullUDPHandler._all_values')) as _all_values:
+            _all_values.return_value = '1.0,2.0'
+            handler.handle()
+            _all_values.assert_called_once_with('raw')
+
+    def test_handle_metrics(self, mocket, server, sockets_data_all):
+        """Test that requests are recorded in the metrics and the metrics command"""
+        requests = (b'name', b'nonsense', b'a,b#json',
+                    FIRTS_MEASUREMENT_NAME.encode('ascii') + b'#raw')
+        for request in requests:
+            with mock.patch(SOCKETS_PATH.format('PullUDPHandler.handle')):
+                handler = PullUDPHandler((request, mocket), CLIENT_ADDRESS, server)
+            handler.handle()
 
-        # Test with timeout and old data
-        sockets_data_single[PORT]['timeouts'] = {FIRTS_MEASUREMENT_NAME: 1.0}
-        sockets_data_single[PORT]['timestamps'] = {FIRTS_MEASUREMENT_NAME: time.time() - 2.0}
-        assert pull_udp_handler._old_data(FIRTS_MEASUREMENT_NAME) is True
+        with mock.patch(SOCKETS_PATH.format('PullUDPHandler.handle')):
+            handler = PullUDPHandler((b'metrics', mocket), CLIENT_ADDRESS, server)
+        handler.handle()
+        metrics = json.loads(mocket.sendto.call_args[0][0].decode('ascii'))
+        commands = metrics['commands']
+        assert set(commands) == {'name', 'nonsense', 'codenames#json', 'codename#raw'}
+        assert commands['name']['count'] == 1
+        assert commands['name']['bytes_in'] == 4
+        assert commands['name']['bytes_out'] == len(NAME)
+        assert commands['name']['errors'] == 0
+        assert commands['nonsense']['errors'] == 1
+        assert commands['codenames#json']['errors'] == 1
+        assert sum(commands['codename#raw']['histogram']) == 1
+
+    def test_handle_request_id(self, mocket, server, sockets_data_all):
+        """Test that the request ID is echoed and not part of the command"""
+        with mock.patch(SOCKETS_PATH.format('PullUDPHandler.handle')):
+            handler = PullUDPHandler((b'&17&name', mocket), CLIENT_ADDRESS, server)
+        handler.handle()
+        mocket.sendto.assert_called_once_with(b'&17&' + NAME.encode('ascii'),
+                                              CLIENT_ADDRESS)
+        commands = sockets_data_all[PORT].metrics.as_dict()['commands']
+        assert commands['name']['errors'] == 0
+
+    def test_valid_until(self, pull_udp_handler, sockets_data_single):
+        """Test the _valid_until method"""
+        state = sockets_data_single[PORT]
+        pull_udp_handler._view = state.view()
+        assert pull_udp_handler._valid_until() == float('inf')
+        state.timeouts = [None]
+        assert pull_udp_handler._valid_until() == float('inf')
+
+        # A fresh point is valid until it times out, an old one does not matter
+        now = time.time()
+        state.timeouts = [1.0]
+        state.set_point(FIRTS_MEASUREMENT_NAME, (now, 47), now)
+        pull_udp_handler._view = state.view()
+        assert isclose(pull_udp_handler._valid_until(), now + 1.0)
+        state.set_point(FIRTS_MEASUREMENT_NAME, (now - 2.0, 47), now - 2.0)
+        pull_udp_handler._view = state.view()
+        assert pull_udp_handler._valid_until() == float('inf')
+
+        # The validity is evaluated at the time of the view, which the reply is rendered
+        # from, not at the time of the call
+        points, timestamps, _ = state.view()
+        pull_udp_handler._view = (points, timestamps, now - 2.5)
+        assert isclose(pull_udp_handler._valid_until(), now - 1.0)
+
+    def test_subscription(self, pull_udp_handler, sockets_data_all):
+        """Test the _subscription method"""
+        subscriptions = sockets_data_all[PORT].subscriptions
+        expected = '{}#{}'.format(sockets.SUBSCRIBED, sockets.SUBSCRIPTION_LEASE)
+
+        # Subscribe to all
+        assert pull_udp_handler._subscription('subscribe') == expected
+        expires, codenames = subscriptions[CLIENT_ADDRESS]
+        assert isclose(expires, time.time() + sockets.SUBSCRIPTION_LEASE, atol=0.1)
+        assert codenames is None
+
+        # Subscribe to some, unknown codenames and unsubscribe
+        command = FIRTS_MEASUREMENT_NAME + '#subscribe'
+        assert pull_udp_handler._subscription(command) == expected
+        assert subscriptions[CLIENT_ADDRESS][1] == {FIRTS_MEASUREMENT_NAME}
+        assert pull_udp_handler._subscription('nonsense#subscribe') ==\
+            sockets.UNKNOWN_COMMAND
+        assert pull_udp_handler._subscription('unsubscribe') == sockets.UNSUBSCRIBED
+        assert subscriptions == {}
+
+    def test_history(self, pull_udp_handler, sockets_data_all):
+        """Test the _history method"""
+        assert pull_udp_handler._history('history_json#0').startswith(sockets.PUSH_ERROR)
+        assert pull_udp_handler._history('history_json#nonsense') ==\
+            sockets.UNKNOWN_COMMAND
+
+        buffer_ = sockets.HistoryBuffer(10)
+        for index in range(3):
+            buffer_.append(100.0 + index, 100.0 + index, index)
+        sockets_data_all[PORT].history = {FIRTS_MEASUREMENT_NAME: buffer_}
+        assert json.loads(pull_udp_handler._history('history_json#100.5')) ==\
+            {FIRTS_MEASUREMENT_NAME: [[101.0, 1.0], [102.0, 2.0]]}
+
+    def test_points(self, pull_udp_handler, sockets_data_all):
+        """Test the _points method"""
+        state = sockets_data_all[PORT]
+
+        # Test without timeouts
+        assert pull_udp_handler._points([SECOND_MEASUREMENT_NAME, FIRTS_MEASUREMENT_NAME])\
+            == [(17.0, 1.0), (42.0, 47.0)]
+
+        # Test with a timeout and old data, and with no timeout
+        state.timeouts = [1.0, None]
+        state.set_point(FIRTS_MEASUREMENT_NAME, (1.0, 2.0), time.time() - 2.0)
+        state.set_point(SECOND_MEASUREMENT_NAME, (3.0, 4.0), time.time() - 2.0)
+        assert pull_udp_handler._points(CODENAMES) == [sockets.OLD_DATA, (3.0, 4.0)]
 
         # Test with timeout and new data
-        sockets_data_single[PORT]['timestamps'] = {FIRTS_MEASUREMENT_NAME: time.time()}
-        assert pull_udp_handler._old_data(FIRTS_MEASUREMENT_NAME) is False
-
-    def test_old_data_unkonwn_type(self, pull_udp_handler, sockets_data_single):
-        """Test the old data unknown type case"""
-        sockets_data_single[PORT]['type'] = 'nonsense type'
-        with pytest.raises(NotImplementedError):
-            pull_udp_handler._old_data(FIRTS_MEASUREMENT_NAME)
+        state.set_point(FIRTS_MEASUREMENT_NAME, (1.0, 2.0), time.time())
+        assert pull_udp_handler._points(CODENAMES) == [(1.0, 2.0), (3.0, 4.0)]
+
+
+class TestSocketMetrics(object):
+    """Test the SocketMetrics class"""
+
+    def test_record(self):
+        """Test record, as_dict and summary"""
+        metrics = sockets.SocketMetrics()
+        assert metrics.summary() == {'requests': 0, 'errors': 0, 'bytes_in': 0,
+                                     'bytes_out': 0, 'p50': None, 'p99': None}
+        for _ in range(99):
+            metrics.record('json', 4, 100, 1.5E-4)
+        metrics.record('raw', 3, 10, 3.0, error=True)
+
+        as_dict = metrics.as_dict()
+        assert as_dict['buckets'] == list(sockets.METRICS_BUCKETS)
+        json_histogram = as_dict['commands']['json']['histogram']
+        assert json_histogram[sockets.METRICS_BUCKETS.index(2E-4)] == 99
+        assert as_dict['commands']['raw']['histogram'][-1] == 1
+        assert metrics.summary() == {'requests': 100, 'errors': 1, 'bytes_in': 399,
+                                     'bytes_out': 9910, 'p50': 2E-4, 'p99': 2E-4}
+
+    def test_max_commands(self):
+        """Test that the number of recorded commands is bounded"""
+        metrics = sockets.SocketMetrics()
+        for index in range(sockets.MAX_METRICS_COMMANDS + 5):
+            metrics.record('command{}'.format(index), 1, 1, 0.0)
+        commands = metrics.as_dict()['commands']
+        assert len(commands) == sockets.MAX_METRICS_COMMANDS + 1
+        assert commands['other']['count'] == 5
+
+
+class TestPullSocketState(object):
+    """Test the PullSocketState class"""
+
+    def test_set_point_and_view(self):
+        """Test set_point, snapshot and the read-only dict view"""
+        state = sockets.PullSocketState(NAME, CODENAMES, (1.0, 2.0), [None, 3.0],
+                                        {'check_activity': False}, None)
+        assert state.index == {FIRTS_MEASUREMENT_NAME: 0, SECOND_MEASUREMENT_NAME: 1}
+        generation = state.cache.generation
+        state.set_point(SECOND_MEASUREMENT_NAME, (4.0, 5.0), 6.0)
+        assert state.cache.generation == generation + 1
+        assert state.snapshot() == (((1.0, 2.0), (4.0, 5.0)), (1.0, 6.0))
+
+        assert set(state) == {'activity', 'cache', 'codenames', 'data', 'history', 'metrics',
+                              'name', 'subscriptions', 'timeouts'}
+        assert state['data'] == {FIRTS_MEASUREMENT_NAME: (1.0, 2.0),
+                                 SECOND_MEASUREMENT_NAME: (4.0, 5.0)}
+        assert state['timeouts'] == {FIRTS_MEASUREMENT_NAME: None,
+                                     SECOND_MEASUREMENT_NAME: 3.0}
+        with pytest.raises(KeyError):
+            state['timestamps']  # pylint: disable=pointless-statement
+        state.type = 'data'
+        assert state['timestamps'] == {FIRTS_MEASUREMENT_NAME: 1.0,
+                                       SECOND_MEASUREMENT_NAME: 6.0}
+        with pytest.raises(TypeError):
+            state['name'] = 'other name'  # pylint: disable=unsupported-assignment-operation
+        with pytest.raises(AttributeError):
+            state.nonsense = 47  # pylint: disable=assigning-non-slot
+
+
+class TestSharedMemorySegment(object):
+    """Test the SharedMemorySegment class"""
+
+    def test_layout(self, tmpdir):
+        """Test the header, the points and the seqlock sequence number"""
+        with mock.patch(SOCKETS_PATH.format('SHARED_MEMORY_DIR'), str(tmpdir)):
+            segment = sockets.SharedMemorySegment(9999, ['a', 'b'], [None, 2.0])
+        path = str(tmpdir.join('PyExpLabSys_pull_socket_9999'))
+        assert segment.path == path
+        assert tmpdir.listdir() == [tmpdir.join('PyExpLabSys_pull_socket_9999')]
+
+        segment.write_all([(1.0, 2.0), (3.0, 'on')], [1.0, 3.0])
+        segment.write(0, (5.0, 6.0), 5.5)
+        data = segment._mmap[:]
+        assert sockets.SHM_HEADER.unpack_from(data) == (b'PM', 1, 2, 16)
+        assert sockets.SHM_SEQUENCE.unpack_from(data, 16) == (4,)
+        assert json.loads(data[24:40].decode('utf-8')) == ['a', 'b']
+        flags, x, y, timestamp, timeout = sockets.SHM_POINT.unpack_from(data, 40)
+        assert (flags, x, y, timestamp) == (0, 5.0, 6.0, 5.5)
+        assert math.isnan(timeout)
+        flags, x, y, timestamp, timeout = sockets.SHM_POINT.unpack_from(data, 80)
+        assert flags == sockets.BINARY_FLAG_NOT_NUMERIC
+        assert math.isnan(x) and math.isnan(y)
+        assert (timestamp, timeout) == (3.0, 2.0)
+
+        segment.close()
+        assert tmpdir.listdir() == []
+        # Writes after close, e.g. from acquisition threads, are ignored
+        segment.write(0, (7.0, 8.0), 7.5)
+        segment.write_all([(1.0, 2.0), (3.0, 4.0)], [1.0, 3.0])
+        segment.close()
+
+    def test_create_error(self, tmpdir):
+        """Test that the temporary file is removed if the segment cannot be created"""
+        with mock.patch(SOCKETS_PATH.format('SHARED_MEMORY_DIR'), str(tmpdir)):
+            with mock.patch('mmap.mmap', side_effect=EnvironmentError('BOOM')):
+                with pytest.raises(EnvironmentError):
+                    sockets.SharedMemorySegment(9999, ['a'], None)
+        assert tmpdir.listdir() == []
+
+
+class TestHistoryBuffer(object):
+    """Test the HistoryBuffer class"""
+
+    def test_since(self):
+        """Test append, wrap around and the since method"""
+        buffer_ = sockets.HistoryBuffer(3)
+        assert buffer_.since(0.0).shape == (0, 2)
+        for index in range(5):
+            buffer_.append(10.0 + index, index, index * 2.0)
+        # Non numeric points are not stored
+        buffer_.append(20.0, 5, 'not a number')
+        assert buffer_.since(0.0).tolist() == [[2.0, 4.0], [3.0, 6.0], [4.0, 8.0]]
+        assert buffer_.since(12.0).tolist() == [[3.0, 6.0], [4.0, 8.0]]
+        assert buffer_.since(14.0).tolist() == []
+
+
+class TestResponseCache(object):
+    """Test the ResponseCache"""
+
+    def test_get_set_invalidate(self):
+        """Test storing, getting and invalidating"""
+        cache = sockets.ResponseCache()
+        assert cache.get('raw') is None
+        cache.set('raw', b'1,2', cache.generation)
+        assert cache.get('raw') == b'1,2'
+        cache.invalidate()
+        assert cache.get('raw') is None
+
+    def test_stale_generation(self):
+        """Test that a response rendered before an invalidation is not stored"""
+        cache = sockets.ResponseCache()
+        generation = cache.generation
+        cache.invalidate()
+        cache.set('raw', b'1,2', generation)
+        assert cache.get('raw') is None
+
+    def test_expiry(self):
+        """Test that responses expire at valid_until"""
+        cache = sockets.ResponseCache()
+        cache.set('raw', b'1,2', cache.generation, valid_until=time.time() - 1.0)
+        assert cache.get('raw') is None
 
 
 class TestCommonDataPullSocket(object):
@@ -408,7 +733,8 @@ class TestCommonDataPullSocket(object):
         config = clean_data[PORT]
 
         # Check that the configuration dict has the correct keys
-        expected_keys = {'codenames', 'data', 'name', 'activity'}
+        expected_keys = {'codenames', 'data', 'cache', 'subscriptions', 'name', 'activity',
+                         'history', 'metrics'}
         if cdps_init_args['init_timeouts']:
             expected_keys.add('timeouts')
         assert set(config.keys()) == expected_keys
@@ -470,6 +796,9 @@ class TestCommonDataPullSocket(object):
             CommonDataPullSocket(**cdps_init_args)
         expected_error_msg = 'The character \'#\' is not allowed in the codenames'
         assert str(exception.value) == expected_error_msg
+        # The request ID mark is allowed
+        cdps_init_args['codenames'][0] = FIRTS_MEASUREMENT_NAME + '&'
+        CommonDataPullSocket(**cdps_init_args)
 
     def test_udp_server_exception(self, cdps_init_args, udp_server, clean_data):
         """Test that if UDPServer raises we either intercept of code is 98 or re raise"""
@@ -496,6 +825,16 @@ class TestCommonDataPullSocket(object):
         # Reverse monkey patch
         socket.error = original_error
 
+    def test_shared_memory_exception(self, cdps_init_args, udp_server, clean_data):
+        """Test that the socket data is removed if the shared memory cannot be created"""
+        cdps_init_args['shared_memory'] = True
+        with mock.patch(SOCKETS_PATH.format('SharedMemorySegment'),
+                        side_effect=EnvironmentError('BOOM')):
+            with pytest.raises(EnvironmentError):
+                CommonDataPullSocket(**cdps_init_args)
+        assert PORT not in clean_data
+        udp_server.return_value.server_close.assert_called_once_with()
+
     def test_run(self, cdps_init_args, clean_data):
         """Test the run method"""
         sock = CommonDataPullSocket(**cdps_init_args)
@@ -548,7 +887,9 @@ class TestDataPullSocket(object):
         assert trace_init.call_spec[1] == {
             'port':9010, 'default_x': 0.0,
             'default_y' :0.0, 'timeouts': None,
-            'check_activity': True, 'activity_timeout': 900
+            'check_activity': True, 'activity_timeout': 900,
+            'engine': None, 'history_size': None, 'shared_memory': False,
+            'tcp_port': None,
         }
 
         # With other key word arguments
@@ -558,7 +899,9 @@ class TestDataPullSocket(object):
         assert trace_init.call_spec[1] == {
             'port':1234, 'default_x': 56.0,
             'default_y' :7.7, 'timeouts': 9.0,
-            'check_activity': False, 'activity_timeout': 180
+            'check_activity': False, 'activity_timeout': 180,
+            'engine': None, 'history_size': None, 'shared_memory': False,
+            'tcp_port': None,
         }
 
         # Revert monkey patch
@@ -625,7 +968,9 @@ class TestDateDataPullSocket(object):
         assert trace_init.call_spec[1] == {
             'port':9000, 'default_x': 0.0,
             'default_y' :0.0, 'timeouts': None,
-            'check_activity': True, 'activity_timeout': 900
+            'check_activity': True, 'activity_timeout': 900,
+            'engine': None, 'history_size': None, 'shared_memory': False,
+            'tcp_port': None,
         }
 
         # With other key word arguments
@@ -635,7 +980,9 @@ class TestDateDataPullSocket(object):
         assert trace_init.call_spec[1] == {
             'port':1234, 'default_x': 56.0,
             'default_y' :7.7, 'timeouts': 9.0,
-            'check_activity': False, 'activity_timeout': 180
+            'check_activity': False, 'activity_timeout': 180,
+            'engine': None, 'history_size': None, 'shared_memory': False,
+            'tcp_port': None,
         }
 
         # Revert monkey patch
@@ -721,10 +1068,35 @@ class TestPushUDPHandler(object):
             handler = PushUDPHandler((request, mocket), CLIENT_ADDRESS, server)
 
         handler.handle()
-        expected = '{}#[\"json_wn#\", \"raw_wn#\", \"name\", \"status\", \"commands\"]'.\
-                   format(sockets.PUSH_RET)
+        expected = '{}#[\"json_wn#\", \"raw_wn#\", \"msgpack_wn#\", \"batch_json#\", '\
+                   '\"name\", \"status\", \"metrics\", \"commands\"]'.format(sockets.PUSH_RET)
         mocket.sendto.assert_called_once_with(expected.encode('ascii'), CLIENT_ADDRESS)
 
+    def test_handle_metrics(self, mocket, server, clean_data):
+        """Test that requests are recorded in the metrics and the metrics command"""
+        clean_data[9876] = {'name': SOCKET_NAME, 'metrics': sockets.SocketMetrics()}
+        for request in (b'name', b'json_wn#nonsense', b'metrics'):
+            with mock.patch(SOCKETS_PATH.format('PushUDPHandler.handle')):
+                handler = PushUDPHandler((request, mocket), CLIENT_ADDRESS, server)
+            handler.handle()
+
+        reply = mocket.sendto.call_args[0][0].decode('ascii')
+        prefix, metrics = reply.split('#', 1)
+        assert prefix == sockets.PUSH_RET
+        commands = json.loads(metrics)['commands']
+        assert commands['name']['count'] == 1
+        assert commands['json_wn']['errors'] == 1
+        assert clean_data[9876]['metrics'].summary()['requests'] == 3
+
+    def test_handle_request_id(self, mocket, server, clean_data):
+        """Test that the request ID is echoed and not part of the command"""
+        clean_data[9876] = {'name': SOCKET_NAME, 'metrics': sockets.SocketMetrics()}
+        with mock.patch(SOCKETS_PATH.format('PushUDPHandler.handle')):
+            handler = PushUDPHandler((b'&12&name', mocket), CLIENT_ADDRESS, server)
+        handler.handle()
+        expected = '&12&{}#{}'.format(sockets.PUSH_RET, SOCKET_NAME).encode('ascii')
+        mocket.sendto.assert_called_once_with(expected, CLIENT_ADDRESS)
+
     def test_handle_status(self, mocket, server, clean_data):
         """Test the handle status case"""
         request = b'status'
@@ -779,6 +1151,26 @@ class TestPushUDPHandler(object):
         mocket.sendto.assert_called_once_with(json_return_value.encode('ascii'),
                                               CLIENT_ADDRESS)
 
+    def test_handle_msgpack_wn(self, mocket, server, clean_data):
+        """Test the handle MessagePack with names case, where the data is binary"""
+        data = packb({'meas1': 4.7, 'bytes': b'\xff#\x00'})
+        with mock.patch(SOCKETS_PATH.format('PushUDPHandler.handle')):
+            handler = PushUDPHandler((b'msgpack_wn#' + data, mocket), CLIENT_ADDRESS,
+                                     server)
+
+        with mock.patch(SOCKETS_PATH.format('PushUDPHandler._set_data')) as set_data:
+            set_data.return_value = ANY_RETURN
+            handler.handle()
+            set_data.assert_called_once_with({'meas1': 4.7, 'bytes': b'\xff#\x00'})
+        mocket.sendto.assert_called_once_with(ANY_RETURN.encode('ascii'), CLIENT_ADDRESS)
+
+        # Data that is not a MessagePack dict
+        for data in (b'\xc1', packb([1, 2])):
+            handler.request = (b'msgpack_wn#' + data, mocket)
+            handler.handle()
+            reply = mocket.sendto.call_args[0][0].decode('ascii')
+            assert reply.startswith(sockets.PUSH_ERROR + '#')
+
     def test_handle_raw_wn(self, mocket, server, clean_data):
         """Test the handle raw with names case"""
         raw_return_value = 'raw_wn_return_value'
@@ -912,6 +1304,102 @@ class TestPushUDPHandler(object):
         else:
             clean_data[PORT]['queue'].put.assert_called_once_with(self.test_data)
 
+    def test_set_data_bounded_queue(self, clean_data, push_udp_handler):
+        """Test the _set_data drop report and NAK with a bounded queue"""
+        clean_data[PORT] = dict(self.set_data_dict)
+        clean_data[PORT]['action'] = 'enqueue'
+        clean_data[PORT]['queue'] = sockets.PushQueue(1, 'drop_oldest')
+        push_udp_handler.port = PORT
+
+        expected = '{}#{}'.format(sockets.PUSH_ACK, self.test_data)
+        assert push_udp_handler._set_data(self.test_data) == expected
+        assert push_udp_handler._set_data(self.test_data) ==\
+            expected + '#{}:1'.format(sockets.PUSH_DROPPED)
+
+        clean_data[PORT]['queue'] = sockets.PushQueue(1, 'nak', put_timeout=0)
+        assert push_udp_handler._set_data(self.test_data) == expected
+        reply = push_udp_handler._set_data(self.test_data)
+        assert reply.startswith(sockets.PUSH_ERROR + '#')
+        assert clean_data[PORT]['queue'].status() ==\
+            {'size': 1, 'maxsize': 1, 'overflow': 'nak', 'dropped': 1}
+
+    def test_batch_json(self, clean_data, push_udp_handler):
+        """Test the batch push with a bounded queue"""
+        clean_data[PORT] = dict(self.set_data_dict, updated={'meas1': 66})
+        clean_data[PORT]['action'] = 'enqueue'
+        clean_data[PORT]['queue'] = sockets.PushQueue(2, 'drop_oldest')
+        push_udp_handler.port = PORT
+
+        before = time.time()
+        reply = push_udp_handler._batch_json(
+            '[[10.0, {"meas1": 1}], [11.0, {"meas2": 2}], [null, {"meas1": 3}]]'
+        )
+        prefix, replies = reply.split('#', 1)
+        assert prefix == sockets.PUSH_ACK
+        assert json.loads(replies) == ['ACK', 'ACK', 'ACK#DROPPED:1']
+        assert clean_data[PORT]['last'] == {'meas1': 3}
+        assert clean_data[PORT]['last_time'] >= before
+        assert clean_data[PORT]['updated_time'] == clean_data[PORT]['last_time']
+        assert clean_data[PORT]['updated'] == {'meas1': 3, 'meas2': 2}
+        queue = clean_data[PORT]['queue']
+        assert [queue.get_nowait() for _ in range(2)] == [{'meas2': 2}, {'meas1': 3}]
+
+        push_udp_handler._batch_json('[[12.0, {"meas1": 4}]]')
+        assert clean_data[PORT]['last_time'] == 12.0
+
+    def test_batch_json_timestamped(self, clean_data, push_udp_handler):
+        """Test that a timestamped socket server enqueues the entry timestamps"""
+        clean_data[PORT] = dict(self.set_data_dict, action='enqueue', timestamped=True,
+                                queue=sockets.Queue.Queue())
+        push_udp_handler.port = PORT
+        with mock.patch('time.time') as mocktime:
+            mocktime.return_value = 789.0
+            push_udp_handler._batch_json('[[10.0, {"meas1": 1}], [null, {"meas1": 2}]]')
+            push_udp_handler._set_data({'meas1': 3})
+        queue = clean_data[PORT]['queue']
+        assert [queue.get_nowait() for _ in range(3)] ==\
+            [(10.0, {'meas1': 1}), (789.0, {'meas1': 2}), (789.0, {'meas1': 3})]
+
+        clean_data[PORT] = dict(self.set_data_dict, action='callback_direct',
+                                timestamped=True, return_format='json',
+                                callback=lambda item: item[0])
+        reply = push_udp_handler._batch_json('[[10.0, {"meas1": 1}]]')
+        assert json.loads(reply.split('#', 1)[1]) == ['{}#10.0'.format(sockets.PUSH_RET)]
+
+    def test_set_data_timestamped_coalesce(self, clean_data, push_udp_handler):
+        """Test that a timestamped socket server works with a coalescing queue"""
+        clean_data[PORT] = dict(self.set_data_dict, action='enqueue', timestamped=True,
+                                queue=sockets.PushQueue(1, 'coalesce'))
+        push_udp_handler.port = PORT
+        with mock.patch('time.time') as mocktime:
+            mocktime.return_value = 789.0
+            assert push_udp_handler._set_data({'a': 1, 'b': 1}).startswith(
+                sockets.PUSH_ACK)
+            mocktime.return_value = 790.0
+            assert push_udp_handler._set_data({'a': 2}) ==\
+                '{}#{}#{}:1'.format(sockets.PUSH_ACK, {'a': 2}, sockets.PUSH_DROPPED)
+        assert list(clean_data[PORT]['queue'].queue) == [(790.0, {'a': 2, 'b': 1})]
+
+    @pytest.mark.parametrize('batch', ['nonsense', '[]', '{"a": 1}', '[[1.0]]',
+                                       '[["now", {"a": 1}]]', '[[1.0, [1]]]',
+                                       '[[true, {"a": 1}]]'])
+    def test_batch_json_exceptions(self, clean_data, push_udp_handler, batch):
+        """Test that malformed batches raise ValueError"""
+        with pytest.raises(ValueError):
+            push_udp_handler._batch_json(batch)
+
+    def test_batch_json_callback_direct(self, clean_data, push_udp_handler):
+        """Test that the batch reply contains the callback return values"""
+        clean_data[PORT] = dict(self.set_data_dict)
+        clean_data[PORT]['action'] = 'callback_direct'
+        clean_data[PORT]['return_format'] = 'json'
+        clean_data[PORT]['callback'] = lambda data: 1 / data['a']
+        push_udp_handler.port = PORT
+        reply = push_udp_handler._batch_json('[[null, {"a": 2}], [null, {"a": 0}]]')
+        replies = json.loads(reply.split('#', 1)[1])
+        assert replies[0] == '{}#0.5'.format(sockets.PUSH_RET)
+        assert replies[1].startswith(sockets.PUSH_EXCEP + '#')
+
     @pytest.mark.parametrize(
         'formatter', ['_format_return_json', '_format_return_raw', '_format_return_string'],
         ids=['format_return_json', 'format_return_raw', 'format_return_string'])
@@ -1172,6 +1660,7 @@ class TestDataPushSocket(object):
         expected_values = {
             'action': 'store_last', 'last': None, 'type': 'push', 'updated': {},
             'last_time': None, 'updated_time': None, 'name': NAME,
+            'metrics': clean_data[port]['metrics'], 'timestamped': False,
             'activity': {
                 'check_activity': False,
                 'activity_timeout': 900,
@@ -1179,6 +1668,7 @@ class TestDataPushSocket(object):
             }
         }
         assert clean_data[port] == expected_values
+        assert isinstance(clean_data[port]['metrics'], sockets.SocketMetrics)
 
     def test_init_bad_queue_raise(self, clean_data, udp_server):
         """Test that using the queue argument is only allowed with enqueue action"""
@@ -1220,6 +1710,45 @@ class TestDataPushSocket(object):
             mock_queue.assert_called_once_with()
             assert clean_data[PORT]['queue'] == 'queue_from_Queue'
 
+    @pytest.mark.parametrize('action', ('enqueue', 'callback_async'))
+    def test_init_bounded_queue(self, clean_data, udp_server, action):
+        """Test that giving a queue size sets up a bounded queue"""
+        callback = mock.MagicMock() if action == 'callback_async' else None
+        with mock.patch(SOCKETS_PATH.format('CallBackThread')):
+            DataPushSocket(NAME, port=PORT, action=action, queue_size=10,
+                           overflow='coalesce', callback=callback)
+        queue = clean_data[PORT]['queue']
+        assert isinstance(queue, sockets.PushQueue)
+        assert (queue.maxsize, queue.overflow) == (10, 'coalesce')
+        assert queue.put_timeout == sockets.QUEUE_PUT_TIMEOUT
+
+    def test_init_bounded_queue_engine(self, clean_data):
+        """Test that the bounded queue does not wait for room under the engine"""
+        DataPushSocket(NAME, port=PORT, action='enqueue', queue_size=10,
+                       engine=mock.MagicMock())
+        assert clean_data[PORT]['queue'].put_timeout == 0
+
+    @pytest.mark.parametrize('kwargs', (
+        {'action': 'store_last', 'queue_size': 10},
+        {'action': 'enqueue', 'queue_size': 10, 'queue': 'myqueue'},
+        {'action': 'enqueue', 'queue_size': 10, 'overflow': 'nonsense'},
+    ), ids=('bad_action', 'custom_queue', 'bad_overflow'))
+    def test_init_bounded_queue_raise(self, clean_data, udp_server, kwargs):
+        """Test that bad bounded queue arguments raise"""
+        with pytest.raises(ValueError):
+            DataPushSocket(NAME, port=PORT, **kwargs)
+
+    def test_init_executor(self, clean_data, udp_server):
+        """Test that a custom executor is used for callback_async"""
+        callback, executor = mock.MagicMock(), mock.MagicMock()
+        data_push_socket = DataPushSocket(NAME, port=PORT, action='callback_async',
+                                          callback=callback, executor=executor)
+        executor.assert_called_once_with(clean_data[PORT]['queue'], callback)
+        assert data_push_socket._callback_thread == executor.return_value
+
+        with pytest.raises(ValueError):
+            DataPushSocket(NAME, port=PORT + 1, executor=executor)
+
     def test_init_callback_async(self, clean_data, udp_server):
         """Test that choosing callback_async is properly setup"""
         def callback_func():
@@ -1403,6 +1932,209 @@ class TestDataPushSocket(object):
         assert clean_data[PORT]['activity']['last_activity'] == 12345.6
 
 
+class TestCallBackPool(object):
+    """Test the CallBackPool class"""
+
+    @staticmethod
+    def run_pool(items, callback, **kwargs):
+        """Run items through a started pool and return it"""
+        queue = sockets.Queue.Queue()
+        pool = sockets.CallBackPool(queue, callback, **kwargs)
+        for item in items:
+            queue.put(item)
+        pool.start()
+        return pool
+
+    def test_parallel_and_ordered(self):
+        """Test that data sets are called back in parallel, except when they share a
+        codename
+        """
+        release = threading.Event()
+        started = []
+        def callback(item):
+            """Callback that blocks on a codename 'a' data set until released"""
+            started.append(item)
+            if 'a' in item:
+                release.wait(1)
+        pool = self.run_pool([{'a': 1}, {'b': 1}, {'a': 2, 'c': 1}, {'c': 2}],
+                             callback, workers=3)
+        time.sleep(0.1)
+        # {'a': 2, 'c': 1} waits for {'a': 1} and {'c': 2} waits for it in turn
+        assert started == [{'a': 1}, {'b': 1}]
+        release.set()
+        time.sleep(0.1)
+        assert started[2:] == [{'a': 2, 'c': 1}, {'c': 2}]
+        pool.stop()
+
+    def test_unordered(self):
+        """Test that data sets with common codenames are called in parallel without
+        ordering
+        """
+        release = threading.Event()
+        started = []
+        def callback(item):
+            """Callback that blocks until released"""
+            started.append(item)
+            release.wait(1)
+        pool = self.run_pool([{'a': 1}, {'a': 2}], callback, workers=2, ordered=False)
+        time.sleep(0.1)
+        assert len(started) == 2
+        release.set()
+        pool.stop()
+
+    def test_coalesce(self):
+        """Test that superseded values are removed from the waiting data sets"""
+        release = threading.Event()
+        called = []
+        def callback(item):
+            """Callback that blocks on the first data set until released"""
+            called.append(item)
+            release.wait(1)
+        pool = self.run_pool([{'x': 0}], callback, workers=1, coalesce=True)
+        time.sleep(0.1)
+        for item in ({'a': 1, 'b': 1}, {'a': 2}, {'a': 3, 'b': 3}):
+            pool.queue.put(item)
+        time.sleep(0.1)
+        release.set()
+        time.sleep(0.1)
+        assert called == [{'x': 0}, {'a': 3, 'b': 3}]
+        assert pool.coalesced == 3
+        pool.stop()
+
+    def test_timestamped(self):
+        """Test ordering and coalescing of (timestamp, data) items"""
+        release = threading.Event()
+        started = []
+        def callback(item):
+            """Callback that blocks on codename 'a' data sets until released"""
+            started.append(item)
+            if 'a' in item[1]:
+                release.wait(1)
+        pool = self.run_pool([(1.0, {'a': 0})], callback, workers=2, coalesce=True)
+        time.sleep(0.1)
+        for item in ((2.0, {'a': 1, 'b': 1}), (3.0, {'a': 2}), (4.0, {'c': 1}),
+                     (5.0, {'b': 5})):
+            pool.queue.put(item)
+        time.sleep(0.1)
+        # The second data set is removed, (3.0, {'a': 2}) waits for (1.0, {'a': 0})
+        assert started == [(1.0, {'a': 0}), (4.0, {'c': 1}), (5.0, {'b': 5})]
+        assert pool.coalesced == 2
+        release.set()
+        time.sleep(0.1)
+        assert started[3:] == [(3.0, {'a': 2})]
+        assert all(thread.is_alive() for thread in pool._threads)
+        pool.stop()
+
+    def test_exception_and_stop(self):
+        """Test that an exception in the callback does not stop the worker"""
+        callback = mock.MagicMock(side_effect=[ValueError('BOOM'), None])
+        pool = self.run_pool([{'a': 1}, {'a': 2}], callback, workers=1)
+        time.sleep(0.1)
+        assert callback.call_count == 2
+        pool.stop()
+        time.sleep(0.1)
+        assert not any(thread.is_alive() for thread in pool._threads[1:])
+
+    def test_functools_partial(self):
+        """Test use as executor via functools.partial"""
+        executor = functools.partial(sockets.CallBackPool, workers=2, coalesce=True)
+        pool = executor('queue', 'callback')
+        assert (pool.queue, pool.callback, pool.coalesce) == ('queue', 'callback', True)
+        assert len(pool._threads) == 3
+        with pytest.raises(ValueError):
+            sockets.CallBackPool('queue', 'callback', workers=0)
+
+
+class TestPushQueue(object):
+    """Test the PushQueue class"""
+
+    def test_unbounded(self):
+        """Test that a queue with maxsize 0 never drops"""
+        queue = sockets.PushQueue(0, 'drop_oldest')
+        for index in range(100):
+            assert queue.put_data({'a': index}) == 0
+        assert queue.qsize() == 100
+
+    def test_drop_oldest(self):
+        """Test the drop_oldest policy"""
+        queue = sockets.PushQueue(2, 'drop_oldest')
+        for index in range(4):
+            queue.put_data({'a': index})
+        assert [queue.get_nowait() for _ in range(2)] == [{'a': 2}, {'a': 3}]
+        assert queue.dropped == 2
+        assert queue.unfinished_tasks == 2
+
+    def test_nak(self):
+        """Test the nak policy"""
+        queue = sockets.PushQueue(1, 'nak')
+        assert queue.put_timeout == sockets.QUEUE_PUT_TIMEOUT
+        assert queue.put_data({'a': 1}) == 0
+        with pytest.raises(sockets.Queue.Full):
+            queue.put_data({'a': 2})
+        assert queue.get_nowait() == {'a': 1}
+        assert queue.dropped == 1
+
+    def test_nak_without_waiting(self):
+        """Test that the nak policy with a put_timeout of 0 does not wait"""
+        queue = sockets.PushQueue(1, 'nak', put_timeout=0)
+        queue.put_data({'a': 1})
+        with mock.patch.object(queue, 'put', wraps=queue.put) as put:
+            with pytest.raises(sockets.Queue.Full):
+                queue.put_data({'a': 2})
+        put.assert_called_once_with({'a': 2}, block=False)
+        assert queue.dropped == 1
+
+    def test_coalesce(self):
+        """Test the coalesce policy"""
+        queue = sockets.PushQueue(2, 'coalesce')
+        first, second = {'a': 1, 'b': 1}, {'a': 2}
+        queue.put_data(first)
+        queue.put_data(second)
+        # 'a' is superseded in both queued data sets, which removes the second
+        assert queue.put_data({'a': 3}) == 2
+        assert list(queue.queue) == [{'b': 1}, {'a': 3}]
+        # The data sets that were pushed are not changed
+        assert first == {'a': 1, 'b': 1}
+        # Nothing superseded, so merge into the newest
+        assert queue.put_data({'c': 4}) == 0
+        assert list(queue.queue) == [{'b': 1}, {'a': 3, 'c': 4}]
+        assert queue.unfinished_tasks == 2
+        assert queue.status() ==\
+            {'size': 2, 'maxsize': 2, 'overflow': 'coalesce', 'dropped': 2}
+
+    def test_coalesce_timestamped(self):
+        """Test the coalesce policy with (timestamp, data) items"""
+        queue = sockets.PushQueue(2, 'coalesce')
+        queue.put_data((1.0, {'a': 1, 'b': 1}))
+        queue.put_data((2.0, {'a': 2}))
+        assert queue.put_data((3.0, {'a': 3})) == 2
+        assert list(queue.queue) == [(1.0, {'b': 1}), (3.0, {'a': 3})]
+        assert queue.put_data((4.0, {'c': 4})) == 0
+        assert list(queue.queue) == [(1.0, {'b': 1}), (4.0, {'a': 3, 'c': 4})]
+
+    def test_bad_overflow(self):
+        """Test that an unknown overflow policy raises"""
+        with pytest.raises(ValueError):
+            sockets.PushQueue(2, 'nonsense')
+
+    @pytest.mark.parametrize('overflow', ['drop_oldest', 'coalesce'])
+    def test_join_after_drops(self, overflow):
+        """Test that dropping data sets wakes up join, when no tasks are left"""
+        queue = sockets.PushQueue(1, overflow)
+        queue.put_data({'a': 1})
+        with mock.patch.object(queue.all_tasks_done, 'notify_all') as notify_all:
+            queue.put_data({'a': 2})
+        notify_all.assert_called_once_with()
+        assert queue.unfinished_tasks == 1
+
+        joiner = threading.Thread(target=queue.join)
+        joiner.start()
+        assert queue.get_nowait() == {'a': 2}
+        queue.task_done()
+        joiner.join(1.0)
+        assert not joiner.is_alive()
+
+
 class TestCallBackThread(object):
     """Test the CallBackThread class"""
 
@@ -1437,3 +2169,82 @@ class TestCallBackThread(object):
         assert callbackthread._stop is False
         callbackthread.stop()
         assert callbackthread._stop is True
+
+
+class TestLiveSocket(object):
+    """Test the LiveSocket class"""
+
+    def _live_socket(self, **kwargs):
+        """Return a LiveSocket with a mock socket and no internal pull socket"""
+        live_socket = LiveSocket('name', ['a', 'b', 'c'], live_server=('127.0.0.1', 8888),
+                                 no_internal_data_pull_socket=True, **kwargs)
+        live_socket.socket = mock.MagicMock()
+        live_socket.hostname = 'host'
+        return live_socket
+
+    def _sent(self, live_socket):
+        """Return the decoded datagrams sent by live_socket"""
+        return [json.loads(call[0][0].decode('utf-8'))
+                for call in live_socket.socket.sendto.call_args_list]
+
+    def test_set_batch(self):
+        """Test that without flush interval, points are sent right away"""
+        live_socket = self._live_socket()
+        live_socket.set_point('a', (1.0, 2.0))
+        assert self._sent(live_socket) == [{'host': 'host', 'data': {'a': [1.0, 2.0]}}]
+        with pytest.raises(RuntimeError):
+            live_socket.set_point('d', (1.0, 2.0))
+
+    def test_flush_interval(self):
+        """Test that points are coalesced in flush interval mode"""
+        live_socket = self._live_socket(flush_interval=10.0)
+        live_socket.set_point('a', (1.0, 2.0))
+        live_socket.set_point('b', (1.0, 3.0))
+        live_socket.set_point('a', (2.0, 4.0))
+        assert live_socket.socket.sendto.call_count == 0
+        live_socket.flush()
+        assert self._sent(live_socket) == [
+            {'host': 'host', 'data': {'a': [2.0, 4.0], 'b': [1.0, 3.0]}}
+        ]
+        # Nothing is sent, when there is nothing pending
+        live_socket.flush()
+        assert live_socket.socket.sendto.call_count == 1
+
+        with pytest.raises(ValueError):
+            self._live_socket(flush_interval=0)
+
+    def test_flush_split(self):
+        """Test that large batches are split in datagrams below the size limit"""
+        live_socket = self._live_socket(flush_interval=10.0)
+        live_socket.codename_set = {'code{}'.format(n) for n in range(200)}
+        data = {'code{}'.format(n): (1E9 + n, 'x' * n) for n in range(200)}
+        assert live_socket._send(data) > 1
+        received = {}
+        for call in live_socket.socket.sendto.call_args_list:
+            assert len(call[0][0]) <= sockets.LIVE_MAX_DATAGRAM_SIZE
+        for datagram in self._sent(live_socket):
+            assert datagram['host'] == 'host'
+            received.update(datagram['data'])
+        assert received == {key: list(value) for key, value in data.items()}
+
+    def test_reset(self):
+        """Test that reset sends pending points and then the reset right away"""
+        live_socket = self._live_socket(flush_interval=10.0)
+        live_socket.set_point('a', (1.0, 2.0))
+        live_socket.reset(['a'])
+        live_socket.set_point('a', (3.0, 4.0))
+        assert [datagram['data'] for datagram in self._sent(live_socket)] == [
+            {'a': [1.0, 2.0]}, {'a': 'RESET'}
+        ]
+        live_socket.stop()
+        assert self._sent(live_socket)[-1]['data'] == {'a': [3.0, 4.0]}
+
+    def test_flush_thread(self):
+        """Test that the flush thread sends the points and is stopped"""
+        live_socket = self._live_socket(flush_interval=0.01)
+        live_socket.start()
+        live_socket.set_point('a', (1.0, 2.0))
+        time.sleep(0.1)
+        assert self._sent(live_socket) == [{'host': 'host', 'data': {'a': [1.0, 2.0]}}]
+        live_socket.stop()
+        assert not live_socket._flush_thread.is_alive()
@@ -0,0 +1,110 @@
+# pylint: disable=protected-access,no-self-use
+
+"""This file contains unit tests for PyExpLabSys.common.system_status"""
+
+from __future__ import unicode_literals, print_function
+
+import time
+import mock
+from PyExpLabSys.common import system_status
+from PyExpLabSys.common.system_status import SystemStatus
+from PyExpLabSys.common.supported_versions import python2_and_3
+python2_and_3(__file__)
+
+
+def item(name, ttl=None, unknown=None):
+    """Return a mock status item method"""
+    method = mock.Mock(return_value=name)
+    method.__name__ = name
+    if ttl is not None:
+        method._ttl = ttl
+    else:
+        del method._ttl
+    method._unknown = unknown
+    return method
+
+
+def test_ttls():
+    """Test that items are fetched again only when their TTL has expired"""
+    status = SystemStatus(machinename='my_machine')
+    assert status.python_version._ttl == system_status.STATIC
+    static, dynamic, default = item('static', system_status.STATIC), item('dynamic', 5.0),\
+        item('default')
+    status.methods_on_this_platform = [static, dynamic, default]
+
+    with mock.patch('time.time') as time_:
+        time_.return_value = 1000.0
+        assert status.complete_status() ==\
+            {'static': 'static', 'dynamic': 'dynamic', 'default': 'default'}
+        # Within the TTLs, the cached values are returned
+        time_.return_value += system_status.DEFAULT_TTL - 0.01
+        status.complete_status()
+        assert [method.call_count for method in (static, dynamic, default)] == [1, 1, 1]
+        # After the default TTL
+        time_.return_value = 1000.0 + system_status.DEFAULT_TTL
+        status.complete_status()
+        assert [method.call_count for method in (static, dynamic, default)] == [1, 1, 2]
+        # After the dynamic TTL
+        time_.return_value = 1005.0
+        status.complete_status()
+        assert [method.call_count for method in (static, dynamic, default)] == [1, 2, 3]
+
+
+def test_unknown_ttl():
+    """Test that the fallback value of a static item is only cached for UNKNOWN_TTL"""
+    status = SystemStatus(machinename='my_machine')
+    assert status.mac_address._unknown == system_status.MAC_ADDRESS_UNKNOWN
+    static = item('static', system_status.STATIC, unknown='unknown')
+    static.return_value = 'unknown'
+    status.methods_on_this_platform = [static]
+
+    with mock.patch('time.time') as time_:
+        time_.return_value = 1000.0
+        assert status.complete_status() == {'static': 'unknown'}
+        time_.return_value += system_status.UNKNOWN_TTL - 0.01
+        status.complete_status()
+        assert static.call_count == 1
+        # Once determined, the value is cached for good
+        static.return_value = 'known'
+        time_.return_value = 1000.0 + system_status.UNKNOWN_TTL
+        assert status.complete_status() == {'static': 'known'}
+        time_.return_value += 1E6
+        assert status.complete_status() == {'static': 'known'}
+        assert static.call_count == 2
+
+
+def test_refresh():
+    """Test that refresh fetches the items that expire within the horizon and skips
+    items that raise
+    """
+    status = SystemStatus(machinename='my_machine')
+    failing, dynamic = item('failing', 5.0), item('dynamic', 5.0)
+    failing.side_effect = ValueError('BOOM')
+    status.methods_on_this_platform = [failing, dynamic]
+    with mock.patch.object(system_status, 'LOGGER') as logger:
+        status.refresh()
+        status.refresh(horizon=10.0)
+    # The failure is logged with the traceback only the first time
+    logger.exception.assert_called_once_with('Status item %s failed', 'failing')
+    assert logger.debug.call_count == 1
+    assert dynamic.call_count == 2
+    assert 'failing' not in status._item_cache
+    failing.side_effect = None
+    status.refresh(horizon=1.0)
+    assert 'failing' in status._item_cache
+    assert not status._failing
+    assert dynamic.call_count == 2
+    status.refresh(horizon=10.0)
+    assert dynamic.call_count == 3
+
+
+def test_refresher():
+    """Test that the refresher keeps refreshing the items"""
+    status = SystemStatus(machinename='my_machine')
+    dynamic = item('dynamic', 0.01)
+    status.methods_on_this_platform = [dynamic]
+    status.start_refresher(interval=0.01)
+    time.sleep(0.1)
+    status.stop_refresher()
+    assert dynamic.call_count > 2
+    assert status._refresher is None